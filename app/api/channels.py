@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from app.models.schemas import ChannelMarkup, ChannelWithMarkup
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Response, status
+from decimal import Decimal, InvalidOperation
+from typing import List, Optional
+from app.models.schemas import ChannelMarkup, ChannelWithMarkup, RepriceJobStatus
 from app.services.markup_service import markup_service
+from app.services.channel_registry import channel_registry
+from app.services.price_table import price_table
+from app.services.reprice_jobs import reprice_jobs
 from app.core.security import verify_token
-import httpx
+from app.saleor.client import saleor_client
+from app.saleor.api import SaleorAPIError
 
 router = APIRouter()
 
@@ -16,73 +21,66 @@ router = APIRouter()
 async def test_channels_endpoint(subdomain: str = None):
     """Test new channels logic with real Saleor API"""
     from app.saleor.api import settings
-    import httpx
     
     # Test connection to real Saleor API
     if settings.SALEOR_API_URL and not settings.SALEOR_API_URL.endswith('your-instance.saleor.cloud/graphql/'):
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                # Test API connectivity
-                test_response = await client.post(
-                    settings.SALEOR_API_URL,
-                    json={"query": "query { shop { name } }"},
-                    headers={"Content-Type": "application/json"}
-                )
+            # Test API connectivity
+            test_response = await saleor_client.post(
+                {"query": "query { shop { name } }"},
+                authenticated=False
+            )
+            
+            if test_response.is_success:
+                test_data = test_response.json()
+                shop_name = test_data.get('data', {}).get('shop', {}).get('name', 'Unknown')
                 
-                if test_response.is_success:
-                    test_data = test_response.json()
-                    shop_name = test_data.get('data', {}).get('shop', {}).get('name', 'Unknown')
-                    
-                    # Try to get channels without token
-                    query = """
-                    query {
-                        channels {
-                            id
-                            name
-                            slug
-                            metadata {
-                                key
-                                value
-                            }
+                # Try to get channels without token
+                query = """
+                query {
+                    channels {
+                        id
+                        name
+                        slug
+                        metadata {
+                            key
+                            value
                         }
                     }
-                    """
-                    
-                    response = await client.post(
-                        settings.SALEOR_API_URL,
-                        json={"query": query},
-                        headers={"Content-Type": "application/json"}
-                    )
-                    data = response.json()
-                    
-                    if "errors" in data:
-                        # Return demo data based on real API structure
-                        return [
-                            {
-                                "id": "demo-connected-api",
-                                "name": f"Demo for {shop_name}",
-                                "slug": "demo-connected",
-                                "markup_percent": "0",
-                                "metadata": [
-                                    {"key": "price_markup_percent", "value": "0"},
-                                    {"key": "subdomains", "value": "demo,connected,api"},
-                                    {"key": "api_status", "value": "connected_no_auth"}
-                                ]
-                            }
-                        ]
-                    else:
-                        # Real channels from API
-                        channels = data.get("data", {}).get("channels", [])
-                        result = []
-                        for channel in channels:
-                            markup = "0"  # Default markup
-                            for meta in channel.get("metadata", []):
-                                if meta["key"] == "price_markup_percent":
-                                    markup = meta["value"]
-                                    break
-                            channel["markup_percent"] = markup
-                            result.append(channel)
-                        return result
+                }
+                """
+                
+                response = await saleor_client.post({"query": query}, authenticated=False)
+                data = response.json()
+                
+                if "errors" in data:
+                    # Return demo data based on real API structure
+                    return [
+                        {
+                            "id": "demo-connected-api",
+                            "name": f"Demo for {shop_name}",
+                            "slug": "demo-connected",
+                            "markup_percent": "0",
+                            "metadata": [
+                                {"key": "price_markup_percent", "value": "0"},
+                                {"key": "subdomains", "value": "demo,connected,api"},
+                                {"key": "api_status", "value": "connected_no_auth"}
+                            ]
+                        }
+                    ]
+                else:
+                    # Real channels from API
+                    channels = data.get("data", {}).get("channels", [])
+                    result = []
+                    for channel in channels:
+                        markup = "0"  # Default markup
+                        for meta in channel.get("metadata", []):
+                            if meta["key"] == "price_markup_percent":
+                                markup = meta["value"]
+                                break
+                        channel["markup_percent"] = markup
+                        result.append(channel)
+                    return result
         except Exception as e:
             return [{"id": "error", "name": f"API Error: {str(e)}", "slug": "error", "markup_percent": "0", "metadata": []}]
     
@@ -97,6 +95,12 @@ async def test_channels_endpoint(subdomain: str = None):
     This endpoint queries Saleor API for channel information and enriches it with
     markup data from Redis cache or Saleor metadata.
     
+    **Caching:** channels are served from an in-memory snapshot (stale-while-revalidate).
+    Once the snapshot is older than `CHANNEL_LIST_SOFT_TTL` seconds it is still served
+    while a background refresh runs. If Saleor is unavailable, the last good snapshot
+    is served instead of demo data. The `Age` header holds the snapshot age in seconds,
+    `X-Cache-Status` is one of `fresh`, `stale-while-revalidate`, `stale-if-error`.
+    
     **Parameters:**
     - subdomain (optional): Filter channels by subdomain value in metadata
     
@@ -114,28 +118,35 @@ async def test_channels_endpoint(subdomain: str = None):
         500: {"description": "Internal server error"}
     }
 )
-async def list_channels_endpoint(subdomain: str = None):  # Временно убрали аутентификацию для demo
+async def list_channels_endpoint(response: Response, subdomain: str = None):  # Временно убрали аутентификацию для demo
     """Get list of all channels with markup information - now uses real API"""
+    from app.core.config import settings
+    
+    # Снимок каналов из реестра: Saleor опрашивается только при первой загрузке
+    snapshot = await channel_registry.get_snapshot()
+    age = snapshot.age
+    
+    if channel_registry.last_error and snapshot.live:
+        cache_status = "stale-if-error"
+    elif age >= settings.CHANNEL_LIST_SOFT_TTL:
+        cache_status = "stale-while-revalidate"
+    else:
+        cache_status = "fresh"
+    
+    if age >= settings.CHANNEL_LIST_SOFT_TTL:
+        # Отдаем устаревший снимок сразу, обновляем в фоне
+        channel_registry.revalidate()
     
-    # Get channels from real API or fallback to Pool demo data
-    channels = await get_real_channels_or_fallback()
+    response.headers["Age"] = str(int(age))
+    response.headers["X-Cache-Status"] = cache_status
     
     if subdomain:
-        # Filter by subdomain
-        for channel in channels:
-            for meta in channel.get("metadata", []):
-                if meta["key"] in ["subdomain", "subdomains"]:
-                    subdomains = [s.strip() for s in meta["value"].split(",")]
-                    if subdomain in subdomains:
-                        return [channel]
-        # If not found by metadata, try by slug
-        for channel in channels:
-            if channel["slug"] == subdomain:
-                return [channel]
-        return []
+        # Filter by subdomain, then by slug
+        channel = snapshot.find(subdomain)
+        return [channel] if channel else []
     else:
         # Return all channels
-        return channels
+        return snapshot.channels
 
 @router.post(
     "/markup",
@@ -145,12 +156,17 @@ async def list_channels_endpoint(subdomain: str = None):  # Временно у
     This operation will:
     1. Update the channel metadata in Saleor via GraphQL API
     2. Update the Redis cache for immediate access
-    3. Trigger price recalculation for products in this channel
+    3. Trigger price recalculation for products in this channel: a repricing job
+       walks the channel catalog page by page, prices each page with the batch
+       engine and writes changed prices back to Saleor channel listings
     
     **Parameters:**
     - channel_id: Base64 encoded Saleor channel ID
     - markup_percent: Percentage markup to apply (0-1000)
     
+    **Returns:** `reprice_job_id` - poll `GET /api/channels/reprice-jobs/{job_id}` for progress.
+    A newer markup for the same channel supersedes an unfinished job.
+    
     **Authentication:** Bearer token required
     """,
     responses={
@@ -160,7 +176,7 @@ async def list_channels_endpoint(subdomain: str = None):  # Временно у
         422: {"description": "Request validation failed"}
     }
 )
-async def set_markup(markup: ChannelMarkup):  # Временно убрали аутентификацию для demo
+async def set_markup(markup: ChannelMarkup, background_tasks: BackgroundTasks):  # Временно убрали аутентификацию для demo
     """Set markup percentage for a channel"""
     success = await markup_service.set_channel_markup(
         markup.channel_id, markup.markup_percent
@@ -171,111 +187,207 @@ async def set_markup(markup: ChannelMarkup):  # Временно убрали а
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Failed to update channel markup"
         )
+    
+    # Наценка хранится в метаданных канала - обновляем снимок реестра
+    background_tasks.add_task(channel_registry.refresh)
+    # Цены канала в материализованной таблице пересчитываем с новой наценкой
+    background_tasks.add_task(price_table.reprice_channel, markup.channel_id, markup.markup_percent)
+    # Цены в Saleor пересчитывает задача очереди, страницами по каталогу канала
+    job_id = await reprice_jobs.start(markup.channel_id, markup.markup_percent)
         
-    return {"success": True, "markup": markup}
+    return {"success": True, "markup": markup, "reprice_job_id": job_id}
+
+
+@router.get(
+    "/reprice-jobs/{job_id}",
+    response_model=RepriceJobStatus,
+    summary="Get Repricing Job Status",
+    description="""Progress of a channel repricing job started by `POST /api/channels/markup`.
+    
+    **Returns:** status (`queued`, `running`, `completed`, `failed`, `superseded`),
+    pages and products processed, listing prices written to Saleor, the last committed
+    page cursor, elapsed time and average throughput (`products_per_second`)
+    """,
+    responses={
+        200: {"description": "Job status"},
+        404: {"description": "Job not found (unknown or expired)"}
+    }
+)
+async def get_reprice_job(job_id: str):
+    """Get repricing job progress"""
+    state = await reprice_jobs.load(job_id)
+    if state is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repricing job not found")
+    return reprice_jobs.progress(state)
+
+
+@router.post(
+    "/reprice-jobs/{job_id}/resume",
+    response_model=RepriceJobStatus,
+    summary="Resume Repricing Job",
+    description="""Queue an unfinished repricing job again, starting after its last committed
+    page cursor (for example after it exhausted its queue retries). Completed and superseded
+    jobs are returned unchanged.
+    """,
+    responses={
+        200: {"description": "Job status"},
+        404: {"description": "Job not found (unknown or expired)"}
+    }
+)
+async def resume_reprice_job(job_id: str):
+    """Resume a repricing job from its last committed cursor"""
+    state = await reprice_jobs.resume(job_id)
+    if state is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Repricing job not found")
+    return reprice_jobs.progress(state)
+
+
+class ChannelsUnavailable(SaleorAPIError):
+    """Saleor настроен, но каналы получить не удалось"""
+    
+    def __init__(self, message: str, shop_name: str):
+        super().__init__(message)
+        self.shop_name = shop_name
 
 
 async def get_real_channels_or_fallback():
     """Get channels from real Saleor API or return Pool demo data"""
+    try:
+        channels = await fetch_saleor_channels()
+    except ChannelsUnavailable as e:
+        return await _get_pool_channels_demo(e.shop_name)
+    
+    if channels is None:
+        # Fallback to demo data
+        print("📋 Using demo data (SALEOR_API_URL not configured)")
+        return await _get_pool_channels_demo("Demo")
+    return channels
+
+
+async def fetch_saleor_channels() -> Optional[List[dict]]:
+    """Get channels from real Saleor API.
+    
+    Returns None if SALEOR_API_URL is not configured and raises
+    ChannelsUnavailable if Saleor is configured but the channels could not be loaded.
+    """
     from app.core.config import settings
     
-    # Always try to connect to real Saleor API if URL is configured
-    if settings.SALEOR_API_URL and not settings.SALEOR_API_URL.endswith('your-instance.saleor.cloud/graphql/'):
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                # Test API connectivity
-                test_response = await client.post(
-                    settings.SALEOR_API_URL,
-                    json={"query": "query { shop { name } }"},
-                    headers={"Content-Type": "application/json"}
-                )
-                
-                if test_response.is_success:
-                    test_data = test_response.json()
-                    shop_name = test_data.get('data', {}).get('shop', {}).get('name', 'Unknown')
-                    print(f"✅ Connected to Saleor shop: {shop_name}")
-                    
-                    # Try to get channels
-                    query = """
-                    query {
-                        channels {
-                            id
-                            name
-                            slug
-                            metadata {
-                                key
-                                value
-                            }
-                        }
-                    }
-                    """
-                    
-                    headers = {"Content-Type": "application/json"}
-                    if settings.SALEOR_APP_TOKEN and settings.SALEOR_APP_TOKEN != "your_saleor_app_token_here":
-                        headers["Authorization"] = f"Bearer {settings.SALEOR_APP_TOKEN}"
-                        print("🔑 Using authentication token")
-                    else:
-                        print("🔓 Trying without authentication token")
-                        
-                    response = await client.post(
-                        settings.SALEOR_API_URL,
-                        json={"query": query},
-                        headers=headers
-                    )
-                    data = response.json()
-                    
-                    if "errors" in data:
-                        errors = data["errors"]
-                        print(f"❌ Channels require authentication: {errors}")
-                        return await _get_pool_channels_demo(shop_name)
-                    else:
-                        # Real channels from API
-                        channels = data.get("data", {}).get("channels", [])
-                        if channels:
-                            print(f"📊 Got {len(channels)} real channels from Saleor API")
-                            
-                            # Process real channels
-                            result = []
-                            for channel in channels:
-                                # Add markup_percent and subdomains if missing
-                                markup_found = False
-                                subdomains_found = False
-                                
-                                for meta in channel.get("metadata", []):
-                                    if meta["key"] == "price_markup_percent":
-                                        markup_found = True
-                                    if meta["key"] in ["subdomain", "subdomains"]:
-                                        subdomains_found = True
-                                
-                                if not markup_found:
-                                    channel.setdefault("metadata", []).append(
-                                        {"key": "price_markup_percent", "value": "0"}
-                                    )
-                                
-                                if not subdomains_found:
-                                    # Generate subdomains based on channel name/slug
-                                    subdomains = _generate_subdomains_for_channel(channel)
-                                    channel.setdefault("metadata", []).append(
-                                        {"key": "subdomains", "value": ",".join(subdomains)}
-                                    )
-                                
-                                # Add markup_percent for frontend compatibility
-                                markup = await markup_service.get_channel_markup(channel["id"])
-                                channel["markup_percent"] = str(markup)
-                                result.append(channel)
-                                
-                            return result
-                        else:
-                            print("📭 No channels found in API")
-                            return await _get_pool_channels_demo(shop_name)
-                            
-        except Exception as e:
-            print(f"💥 Error connecting to Saleor API: {e}")
-            return await _get_pool_channels_demo("Offline")
+    if not settings.SALEOR_API_URL or settings.SALEOR_API_URL.endswith('your-instance.saleor.cloud/graphql/'):
+        return None
+    
+    try:
+        return await _load_saleor_channels()
+    except ChannelsUnavailable:
+        raise
+    except Exception as e:
+        print(f"💥 Error connecting to Saleor API: {e}")
+        raise ChannelsUnavailable(str(e), "Offline")
+
+
+async def _load_saleor_channels() -> List[dict]:
+    """Shop probe, channels query and markup/subdomains enrichment"""
+    # Test API connectivity
+    test_response = await saleor_client.post(
+        {"query": "query { shop { name } }"},
+        authenticated=False
+    )
+    
+    if not test_response.is_success:
+        print(f"❌ Saleor API is not reachable: HTTP {test_response.status_code}")
+        raise ChannelsUnavailable(f"HTTP {test_response.status_code}", "Demo")
+    
+    test_data = test_response.json()
+    shop_name = test_data.get('data', {}).get('shop', {}).get('name', 'Unknown')
+    print(f"✅ Connected to Saleor shop: {shop_name}")
+    
+    # Try to get channels
+    query = """
+    query {
+        channels {
+            id
+            name
+            slug
+            metadata {
+                key
+                value
+            }
+        }
+    }
+    """
     
-    # Fallback to demo data
-    print("📋 Using demo data (SALEOR_API_URL not configured)")
-    return await _get_pool_channels_demo("Demo")
+    if saleor_client.auth_headers():
+        print("🔑 Using authentication token")
+    else:
+        print("🔓 Trying without authentication token")
+        
+    response = await saleor_client.post({"query": query})
+    data = response.json()
+    
+    if "errors" in data:
+        errors = data["errors"]
+        print(f"❌ Channels require authentication: {errors}")
+        raise ChannelsUnavailable(str(errors), shop_name)
+    
+    # Real channels from API
+    channels = data.get("data", {}).get("channels", [])
+    if not channels:
+        print("📭 No channels found in API")
+        raise ChannelsUnavailable("No channels found", shop_name)
+    
+    print(f"📊 Got {len(channels)} real channels from Saleor API")
+    
+    # Process real channels
+    result = []
+    markups = {}
+    for channel in channels:
+        # Add markup_percent and subdomains if missing
+        markup_found = False
+        subdomains_found = False
+        
+        for meta in channel.get("metadata", []):
+            if meta["key"] == "price_markup_percent":
+                markup_found = True
+                markup = _parse_markup(meta["value"])
+                if markup is not None:
+                    markups[channel["id"]] = markup
+            if meta["key"] in ["subdomain", "subdomains"]:
+                subdomains_found = True
+        
+        if not markup_found:
+            channel.setdefault("metadata", []).append(
+                {"key": "price_markup_percent", "value": "0"}
+            )
+        
+        if not subdomains_found:
+            # Generate subdomains based on channel name/slug
+            subdomains = _generate_subdomains_for_channel(channel)
+            channel.setdefault("metadata", []).append(
+                {"key": "subdomains", "value": ",".join(subdomains)}
+            )
+        
+        result.append(channel)
+    
+    # Наценка уже есть в метаданных ответа - кладем ее в L1 без отдельных запросов
+    markup_service.remember_markups(markups)
+    
+    # Остальные каналы - одним MGET; в Saleor за ними не ходим: этот ответ
+    # и есть метаданные канала, а ключа наценки в нем нет
+    missing = [channel["id"] for channel in result if channel["id"] not in markups]
+    if missing:
+        markups.update(await markup_service.get_cached_markups(missing))
+    
+    # Add markup_percent for frontend compatibility
+    for channel in result:
+        channel["markup_percent"] = str(markups.get(channel["id"], Decimal('0')))
+        
+    return result
+
+
+def _parse_markup(value) -> Optional[Decimal]:
+    try:
+        return Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
 
 
 async def _get_pool_channels_demo(shop_name: str):
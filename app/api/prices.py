@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from typing import List
 from decimal import Decimal
-from app.models.schemas import PriceCalculationRequest, PriceCalculationResponse
-from app.services.price_calculator import calculate_price_with_markup, batch_calculate_prices
-from app.services.discount_service import discount_service
-from app.saleor.api import get_product, get_channel_by_subdomain
-from app.services.markup_service import markup_service
+from app.models.schemas import PriceCalculationRequest, PriceCalculationResponse, BatchPriceCalculationResult, PriceMatrixRequest, PriceMatrixResponse
+from app.services.price_calculator import calculate_price_with_markup
+from app.services.batch_pricing import calculate_batch, stream_batch
+from app.services.price_matrix import calculate_price_matrix
+from app.services.price_table import price_table, PriceEntry
+from app.services.pricing_context import PricingContext, get_pricing_context
 from app.core.security import verify_token
 
 router = APIRouter()
@@ -19,6 +21,9 @@ router = APIRouter()
     
     **Formula:** `final_price = base_price * (1 + markup_percent / 100)`
     
+    Served from the materialized price table when it holds a fresh price
+    for the same product, channel and base price; calculated live otherwise.
+    
     **Parameters:**
     - product_id: Base64 encoded Saleor product ID
     - channel_id: Base64 encoded Saleor channel ID (optional if subdomain provided)
@@ -38,15 +43,18 @@ router = APIRouter()
         422: {"description": "Request validation failed"}
     }
 )
-async def calculate_price(request: PriceCalculationRequest, subdomain: str = None):  # Временно убрали аутентификацию для demo
+async def calculate_price(
+    request: PriceCalculationRequest,
+    subdomain: str = None,
+    context: PricingContext = Depends(get_pricing_context)
+):  # Временно убрали аутентификацию для demo
     """Calculate product price with channel markup"""
     try:
         channel_id = request.channel_id
         
         # Если указан subdomain, ищем канал по нему
         if subdomain:
-            from app.saleor.api import get_channel_by_subdomain
-            channel = await get_channel_by_subdomain(subdomain)
+            channel = await context.get_channel_by_subdomain(subdomain)
             if not channel:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -54,13 +62,32 @@ async def calculate_price(request: PriceCalculationRequest, subdomain: str = Non
                 )
             channel_id = channel["id"]
         
-        markup_percent = await markup_service.get_channel_markup(channel_id)
+        # Горячий путь: готовая цена из материализованной таблицы (один HGET)
+        entry = await price_table.get(request.product_id, channel_id, request.base_price)
+        if entry is not None:
+            return PriceCalculationResponse(
+                product_id=request.product_id,
+                channel_id=channel_id,
+                base_price=str(request.base_price),
+                markup_percent=str(entry.markup_percent),
+                final_price=str(entry.final_price),
+                currency="USD"
+            )
+        
+        markup_percent = await context.get_markup(channel_id)
         final_price = await calculate_price_with_markup(
             request.product_id,
             channel_id,
-            request.base_price
+            request.base_price,
+            context
         )
         
+        # Записываем посчитанную цену обратно, чтобы следующее чтение было из таблицы
+        await price_table.store(request.product_id, channel_id, PriceEntry.build(
+            request.base_price, markup_percent, final_price,
+            await context.get_discounts(request.product_id), context.now
+        ))
+        
         return PriceCalculationResponse(
             product_id=request.product_id,
             channel_id=channel_id,
@@ -79,7 +106,7 @@ async def calculate_price(request: PriceCalculationRequest, subdomain: str = Non
 
 @router.post(
     "/batch-calculate",
-    response_model=List[PriceCalculationResponse],
+    response_model=List[BatchPriceCalculationResult],
     summary="Batch Calculate Prices",
     description="""Calculate prices for multiple products across different channels in a single request.
     
@@ -92,7 +119,8 @@ async def calculate_price(request: PriceCalculationRequest, subdomain: str = Non
       - base_price: Original price before markup
     
     **Returns:**
-    - Array of detailed price calculations
+    - Array of detailed price calculations in request order; an item that
+      could not be priced carries an `error` instead of failing the batch
     
     **Authentication:** Bearer token required
     """,
@@ -103,34 +131,103 @@ async def calculate_price(request: PriceCalculationRequest, subdomain: str = Non
         422: {"description": "Request validation failed"}
     }
 )
-async def batch_calculate(items: List[PriceCalculationRequest]):  # Временно убрали аутентификацию для demo
+async def batch_calculate(
+    items: List[PriceCalculationRequest],
+    context: PricingContext = Depends(get_pricing_context)
+):  # Временно убрали аутентификацию для demo
     """Batch calculate prices for multiple products"""
     try:
-        results = []
-        for item in items:
-            markup_percent = await markup_service.get_channel_markup(item.channel_id)
-            final_price = await calculate_price_with_markup(
-                item.product_id,
-                item.channel_id,
-                item.base_price
-            )
-            
-            results.append(PriceCalculationResponse(
-                product_id=item.product_id,
-                channel_id=item.channel_id,
-                base_price=str(item.base_price),
-                markup_percent=str(markup_percent),
-                final_price=str(final_price),
-                currency="USD"
-            ))
-            
-        return results
+        # Ошибки отдельных позиций возвращаются в поле error, порядок ответа совпадает с запросом
+        return await calculate_batch(items, context)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Batch calculation failed: {str(e)}"
         )
 
+class NDJSONStreamingResponse(StreamingResponse):
+    """StreamingResponse, которая читает тело запроса во время ответа.
+
+    Обычный StreamingResponse на ASGI < 2.4 слушает receive() в поисках
+    disconnect и забирал бы себе куски тела; здесь тело читает сам генератор,
+    а отключение клиента приходит к нему как ClientDisconnect.
+    """
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+@router.post(
+    "/batch-calculate/stream",
+    response_class=NDJSONStreamingResponse,
+    summary="Stream Batch Price Calculation (NDJSON)",
+    description="""Price an arbitrarily large batch as a stream.
+    
+    The request body is NDJSON: one price calculation request per line
+    (`product_id`, `channel_id`, `base_price`). Lines are read incrementally,
+    priced in chunks of `PRICE_STREAM_CHUNK_SIZE` through the batch engine and
+    written back as NDJSON as soon as each chunk is done, so memory stays flat
+    regardless of input size.
+    
+    **Returns:**
+    - One result per input line, in input order; invalid lines, lines longer
+      than `PRICE_STREAM_MAX_LINE_BYTES` and items that could not be priced
+      carry an `error`
+    
+    **Authentication:** Bearer token required
+    """,
+    responses={
+        200: {"description": "NDJSON stream of price calculations"},
+        401: {"description": "Authentication required or token invalid"}
+    }
+)
+async def batch_calculate_stream(request: Request):  # Временно убрали аутентификацию для demo
+    """Stream batch price calculation over NDJSON"""
+    return NDJSONStreamingResponse(stream_batch(request.stream()))
+
+@router.post(
+    "/matrix",
+    response_model=PriceMatrixResponse,
+    summary="Products x Channels Price Matrix",
+    description="""Calculate every product's price in every channel in one request.
+    
+    **Parameters:**
+    - product_ids: Products to price, or omit them to take a product page from
+      Saleor (`channel_slug`, `first`, `after`)
+    - channel_ids: Matrix columns (all known channels if omitted)
+    - base_prices: Base price per product ID; `default_base_price` for the rest
+    
+    Each product's discounts are evaluated once and the channel markups are
+    applied to the whole grid in one vectorized pass.
+    
+    **Returns:**
+    - Channel columns with their markups and one row of final prices per product;
+      `next_cursor` continues the product page
+    
+    **Authentication:** Bearer token required
+    """,
+    responses={
+        200: {"description": "Price matrix calculated"},
+        400: {"description": "Matrix calculation error or matrix too large"},
+        401: {"description": "Authentication required or token invalid"},
+        422: {"description": "Request validation failed"}
+    }
+)
+async def price_matrix(
+    request: PriceMatrixRequest,
+    context: PricingContext = Depends(get_pricing_context)
+):  # Временно убрали аутентификацию для demo
+    """Calculate a products x channels price matrix"""
+    try:
+        return await calculate_price_matrix(request, context)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Price matrix calculation failed: {str(e)}"
+        )
+
 @router.post(
     "/calculate-by-subdomain", 
     response_model=PriceCalculationResponse,
@@ -162,14 +259,13 @@ async def batch_calculate(items: List[PriceCalculationRequest]):  # Времен
 async def calculate_price_by_subdomain(
     product_id: str,
     base_price: float,
-    subdomain: str
+    subdomain: str,
+    context: PricingContext = Depends(get_pricing_context)
 ):
     """Calculate product price using subdomain to identify channel"""
     try:
-        from app.saleor.api import get_channel_by_subdomain
-        
         # Find channel by subdomain
-        channel = await get_channel_by_subdomain(subdomain)
+        channel = await context.get_channel_by_subdomain(subdomain)
         if not channel:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -187,7 +283,7 @@ async def calculate_price_by_subdomain(
         
         # Если не нашли в метаданных, пробуем через markup_service
         if markup_percent == 0:
-            markup_percent = await markup_service.get_channel_markup(channel_id)
+            markup_percent = await context.get_markup(channel_id)
         
         # Рассчитываем цену вручную, так как calculate_price_with_markup использует markup_service
         final_price_decimal = Decimal(str(base_price)) * (Decimal('1') + markup_percent / Decimal('100'))
@@ -241,7 +337,8 @@ async def calculate_price_by_subdomain(
 )
 async def calculate_price_with_discounts(
     request: PriceCalculationRequest, 
-    subdomain: str = None
+    subdomain: str = None,
+    context: PricingContext = Depends(get_pricing_context)
 ):
     """Calculate product price with detailed discount information"""
     try:
@@ -249,7 +346,7 @@ async def calculate_price_with_discounts(
         
         # Если указан subdomain, ищем канал по нему
         if subdomain:
-            channel = await get_channel_by_subdomain(subdomain)
+            channel = await context.get_channel_by_subdomain(subdomain)
             if not channel:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -257,30 +354,27 @@ async def calculate_price_with_discounts(
                 )
             channel_id = channel["id"]
         
-        # Получаем продукт и его скидки
-        product = await get_product(request.product_id)
+        # Получаем продукт и его скидки (продукт запоминается в контексте запроса)
+        product = await context.get_product(request.product_id)
         if not product:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail=f"Product not found: {request.product_id}"
             )
         
-        # Парсим скидки
-        discounts_json = next(
-            (meta["value"] for meta in product.get("metadata", []) if meta["key"] == "discounts"),
-            ""
-        )
-        discounts = discount_service.parse_discounts(discounts_json)
-        active_discount = discount_service.get_active_discount(discounts)
+        # Находим активную скидку
+        compiled_discount = await context.get_active_discount(request.product_id)
+        active_discount = compiled_discount.discount if compiled_discount else None
         
-        # Рассчитываем цену (это уже включает скидку)
+        # Рассчитываем цену (это уже включает скидку); продукт и наценка берутся из контекста
         final_price = await calculate_price_with_markup(
             request.product_id,
             channel_id,
-            request.base_price
+            request.base_price,
+            context
         )
         
-        markup_percent = await markup_service.get_channel_markup(channel_id)
+        markup_percent = await context.get_markup(channel_id)
         
         # Формируем ответ
         response_data = {
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from app.models.schemas import ProductDiscounts, ProductWithDiscounts, SetDiscountsRequest
-from app.saleor.api import get_products, get_product, set_product_discounts
+from app.saleor.api import get_products, get_product, set_product_discounts, set_products_discounts_bulk, iter_product_pages, SaleorAPIError
 from app.services.discount_service import discount_service
+from app.services.price_table import price_table
 from app.core.security import verify_token
 from datetime import datetime
 import pytz
@@ -13,23 +14,21 @@ router = APIRouter()
 async def list_products(
     channel_slug: Optional[str] = Query(None, description="Channel slug to filter products"),
     subdomain: Optional[str] = Query(None, description="Subdomain to identify channel"),
-    first: int = Query(100, description="Number of products to fetch")
+    first: int = Query(100, ge=1, description="Number of products to fetch (walks Saleor pages past the first 100)")
 ):
     """Get list of products with their discount information"""
     # Get products from Saleor
     products = await get_products(channel_slug, first)
     
+    current_time = datetime.now(pytz.UTC)
     result = []
     for product in products:
-        # Parse discounts
-        discounts_json = next(
-            (meta["value"] for meta in product.get("metadata", []) if meta["key"] == "discounts"),
-            ""
-        )
-        discounts = discount_service.parse_discounts(discounts_json)
+        # Parse and compile discounts (cached by the metadata string)
+        compiled = discount_service.compile_discounts(discount_service.extract_discounts_json(product))
+        discounts = compiled.discounts
         
         # Find active discount
-        active_discount = discount_service.get_active_discount(discounts)
+        active_discount = compiled.get_active(current_time)
         
         result.append(ProductWithDiscounts(
             id=product["id"],
@@ -51,15 +50,12 @@ async def get_product_with_discounts(product_id: str):
             detail="Product not found"
         )
     
-    # Parse discounts
-    discounts_json = next(
-        (meta["value"] for meta in product.get("metadata", []) if meta["key"] == "discounts"),
-        ""
-    )
-    discounts = discount_service.parse_discounts(discounts_json)
+    # Parse and compile discounts
+    compiled = discount_service.compile_discounts(discount_service.extract_discounts_json(product))
+    discounts = compiled.discounts
     
     # Find active discount
-    active_discount = discount_service.get_active_discount(discounts)
+    active_discount = compiled.get_active()
     
     return ProductWithDiscounts(
         id=product["id"],
@@ -69,6 +65,10 @@ async def get_product_with_discounts(product_id: str):
         active_discount=active_discount
     )
 
+def _compiled(discounts_list: list):
+    """Compiled form of a discounts list that is about to be saved"""
+    return discount_service.compile_discounts(discount_service.format_discounts(discounts_list))
+
 @router.post("/{product_id}/discounts")
 async def set_product_discounts_endpoint(
     product_id: str,
@@ -100,6 +100,9 @@ async def set_product_discounts_endpoint(
             detail="Failed to update product discounts"
         )
     
+    # Reprice the product in the materialized price table with its new discounts
+    await price_table.reprice_products([product_id], _compiled(discounts_list))
+    
     return {"success": True, "discounts_count": len(discounts_list)}
 
 @router.post("/batch-set-discounts")
@@ -121,23 +124,40 @@ async def batch_set_discounts(
             detail={"validation_errors": errors}
         )
     
-    # Get all products
-    products = await get_products(channel_slug)
-    
     # Convert to dict format
     discounts_list = [discount.dict() for discount in request.discounts]
     
-    # Apply to all products
+    # Stream the whole catalog page by page instead of loading only the first page
+    compiled_discounts = _compiled(discounts_list)
+    total_products = 0
     success_count = 0
-    for product in products:
-        success = await set_product_discounts(product["id"], discounts_list)
-        if success:
-            success_count += 1
+    failed_products = []
+    try:
+        async for products, _ in iter_product_pages(channel_slug):
+            total_products += len(products)
+            # One aliased mutation document per chunk instead of one request per product
+            results = await set_products_discounts_bulk(
+                [product["id"] for product in products], discounts_list
+            )
+            for product_id, success in results.items():
+                if success:
+                    success_count += 1
+                else:
+                    failed_products.append(product_id)
+            await price_table.reprice_products(
+                [product_id for product_id, success in results.items() if success], compiled_discounts
+            )
+    except SaleorAPIError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Failed to list products: {str(e)}"
+        )
     
     return {
         "success": True, 
-        "total_products": len(products),
+        "total_products": total_products,
         "updated_products": success_count,
+        "failed_products": failed_products,
         "discounts_count": len(discounts_list)
     }
 
@@ -151,16 +171,13 @@ async def get_active_discount(product_id: str):
             detail="Product not found"
         )
     
-    # Parse discounts
-    discounts_json = next(
-        (meta["value"] for meta in product.get("metadata", []) if meta["key"] == "discounts"),
-        ""
-    )
-    discounts = discount_service.parse_discounts(discounts_json)
+    # Parse and compile discounts
+    compiled = discount_service.compile_discounts(discount_service.extract_discounts_json(product))
+    discounts = compiled.discounts
     
     # Find active discount with current time info
     current_time = datetime.now(pytz.UTC)
-    active_discount = discount_service.get_active_discount(discounts, current_time)
+    active_discount = compiled.get_active(current_time)
     
     return {
         "product_id": product_id,
@@ -1,11 +1,21 @@
 from fastapi import APIRouter, Request, BackgroundTasks, HTTPException, status
-from app.models.schemas import SaleorWebhookPayload
+from typing import Optional
+from app.core.config import settings
+from app.models.schemas import SaleorWebhookPayload, PriceCalculationRequest
 from app.services.markup_service import markup_service
-from app.services.price_calculator import batch_calculate_prices
+from app.services.channel_registry import channel_registry
+from app.services.batch_pricing import calculate_batch
+from app.services.price_table import price_table
+from app.services.price_writeback import price_writeback, collect_listings
+from app.services.job_queue import job_queue
+from app.services.pricing_context import PricingContext
 from app.saleor.api import get_product_data
 
 router = APIRouter()
 
+# Тип задачи очереди для пересчета цен продукта
+RECALCULATE_PRODUCT_JOB = "recalculate_product_prices"
+
 @router.post(
     "/product-updated",
     summary="Handle Product Updated Webhook",
@@ -16,12 +26,17 @@ router = APIRouter()
     
     **Event Processing:**
     1. Validates the webhook payload
-    2. Queues background task for price recalculation
-    3. Updates prices across all channels for the product
+    2. Queues a price recalculation job (Redis Streams job queue); events for the
+       same product within `PRODUCT_WEBHOOK_DEBOUNCE_WINDOW` seconds are coalesced
+       into one job, queued at most `PRODUCT_WEBHOOK_DEBOUNCE_MAX_DELAY` seconds
+       after the first of them
+    3. A queue worker updates prices across all channels for the product
     
     **Authentication:** No bearer token required (webhook signatures handled separately)
     
-    **Background Processing:** Price calculations are performed asynchronously
+    **Background Processing:** Jobs survive restarts, run with bounded concurrency
+    (`WEBHOOK_WORKER_CONCURRENCY`), are retried with backoff and end up in a
+    dead-letter stream after `WEBHOOK_JOB_MAX_ATTEMPTS` failures
     """,
     responses={
         200: {
@@ -42,7 +57,7 @@ router = APIRouter()
         }
     }
 )
-async def handle_product_updated(payload: SaleorWebhookPayload, background_tasks: BackgroundTasks):
+async def handle_product_updated(payload: SaleorWebhookPayload):
     """Handle Saleor product updated webhook"""
     if payload.event_type != "PRODUCT_UPDATED" or not payload.product_id:
         raise HTTPException(
@@ -50,7 +65,17 @@ async def handle_product_updated(payload: SaleorWebhookPayload, background_tasks
             detail="Invalid webhook payload: missing product_id or wrong event_type"
         )
     
-    background_tasks.add_task(recalculate_product_prices, payload.product_id)
+    # События одного продукта внутри окна склеиваются в один пересчет;
+    # сам пересчет выполнит пул воркеров очереди
+    await job_queue.enqueue_debounced(
+        RECALCULATE_PRODUCT_JOB,
+        payload.product_id,
+        settings.PRODUCT_WEBHOOK_DEBOUNCE_WINDOW,
+        settings.PRODUCT_WEBHOOK_DEBOUNCE_MAX_DELAY,
+        product_id=payload.product_id,
+        # Данные продукта из тела вебхука едут с задачей, чтобы не запрашивать их снова
+        product=_payload_product(payload.product_id, payload.data)
+    )
     return {"status": "received"}
 
 @router.post(
@@ -64,7 +89,7 @@ async def handle_product_updated(payload: SaleorWebhookPayload, background_tasks
     **Event Processing:**
     1. Validates the webhook payload
     2. Invalidates Redis cache for the new channel
-    3. Prepares channel for markup configuration
+    3. Refreshes the in-memory channel registry (subdomain index)
     
     **Authentication:** No bearer token required (webhook signatures handled separately)
     """,
@@ -87,7 +112,7 @@ async def handle_product_updated(payload: SaleorWebhookPayload, background_tasks
         }
     }
 )
-async def handle_channel_created(payload: SaleorWebhookPayload):
+async def handle_channel_created(payload: SaleorWebhookPayload, background_tasks: BackgroundTasks):
     """Handle Saleor channel created webhook"""
     if payload.event_type != "CHANNEL_CREATED" or not payload.channel_id:
         raise HTTPException(
@@ -97,29 +122,136 @@ async def handle_channel_created(payload: SaleorWebhookPayload):
     
     # Invalidate cache for the new channel
     await markup_service.invalidate_cache(payload.channel_id)
+    background_tasks.add_task(channel_registry.refresh)
+    return {"status": "received"}
+
+CHANNEL_CHANGE_EVENTS = {"CHANNEL_UPDATED", "CHANNEL_METADATA_UPDATED", "CHANNEL_DELETED"}
+
+@router.post(
+    "/channel-updated",
+    summary="Handle Channel Updated/Deleted Webhook",
+    description="""Webhook endpoint for Saleor CHANNEL_UPDATED, CHANNEL_METADATA_UPDATED
+    and CHANNEL_DELETED events.
+    
+    Subdomains and markup live in channel metadata, so any channel change
+    invalidates the channel's markup cache, refreshes the in-memory
+    channel registry used for subdomain lookups and reprices the channel
+    in the materialized price table (a deleted channel's prices are dropped).
+    
+    **Authentication:** No bearer token required (webhook signatures handled separately)
+    """,
+    responses={
+        200: {
+            "description": "Webhook received and processed",
+            "content": {
+                "application/json": {
+                    "example": {"status": "received"}
+                }
+            }
+        },
+        400: {
+            "description": "Invalid webhook payload",
+            "content": {
+                "application/json": {
+                    "example": {"detail": "Invalid webhook payload"}
+                }
+            }
+        }
+    }
+)
+async def handle_channel_updated(payload: SaleorWebhookPayload, background_tasks: BackgroundTasks):
+    """Handle Saleor channel updated/deleted webhooks"""
+    if payload.event_type not in CHANNEL_CHANGE_EVENTS or not payload.channel_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, 
+            detail="Invalid webhook payload: missing channel_id or wrong event_type"
+        )
+    
+    await markup_service.invalidate_cache(payload.channel_id)
+    background_tasks.add_task(channel_registry.refresh)
+    if payload.event_type == "CHANNEL_DELETED":
+        await price_table.drop_channel(payload.channel_id)
+    else:
+        background_tasks.add_task(price_table.refresh_channel, payload.channel_id)
     return {"status": "received"}
 
-async def recalculate_product_prices(product_id: str):
-    """Background task: recalculate prices for a product across all channels"""
+class PayloadUsage:
+    """Сколько запросов в Saleor сэкономили данные из тела вебхука"""
+    
+    def __init__(self):
+        self.product_refetches = 0
+        self.product_refetches_avoided = 0
+        self.metadata_refetches_avoided = 0
+    
+    def stats(self) -> dict:
+        return {
+            "product_refetches": self.product_refetches,
+            "product_refetches_avoided": self.product_refetches_avoided,
+            "metadata_refetches_avoided": self.metadata_refetches_avoided,
+        }
+
+payload_usage = PayloadUsage()
+
+def _payload_product(product_id: str, data: Optional[dict]) -> Optional[dict]:
+    """Продукт из тела вебхука, если он там есть и это тот же продукт"""
+    product = (data or {}).get("product")
+    if isinstance(product, dict) and product.get("id") in (None, product_id):
+        return product
+    return None
+
+def _has_channel_listings(product: Optional[dict]) -> bool:
+    """В продукте есть все, что нужно для пересчета: варианты с листингами каналов
+    и метаданными (в них сохранены базовые цены)"""
+    variants = (product or {}).get("variants")
+    return isinstance(variants, list) and all(
+        isinstance(variant, dict) and "channelListings" in variant and "metadata" in variant
+        for variant in variants
+    )
+
+async def recalculate_product_prices(product_id: str, product: Optional[dict] = None):
+    """Background task: recalculate prices for a product across all channels
+    
+    `product` is the product from the webhook payload. Fields it already carries
+    (variant channel listings, metadata) are not fetched from Saleor again.
+    """
     try:
-        product_data = await get_product_data(product_id)
+        if _has_channel_listings(product):
+            product_data = product
+            payload_usage.product_refetches_avoided += 1
+        else:
+            product_data = await get_product_data(product_id)
+            payload_usage.product_refetches += 1
         if not product_data:
             print(f"Product {product_id} not found")
             return
         
         # Extract channel pricing information from product variants
-        batch_items = []
-        for variant in product_data.get("variants", []):
-            for channel_listing in variant.get("channelListings", []):
-                if channel_listing.get("price"):
-                    batch_items.append({
-                        "product_id": product_id,
-                        "channel_id": channel_listing["channel"]["id"],
-                        "base_price": float(channel_listing["price"]["amount"])
-                    })
+        listings = collect_listings(product_data)
+        batch_items = [
+            PriceCalculationRequest(product_id=product_id, channel_id=listing.channel_id, base_price=listing.base_price)
+            for listing in listings
+        ]
         
         if batch_items:
-            await batch_calculate_prices(batch_items)
-            print(f"Recalculated prices for product {product_id} across {len(batch_items)} channel(s)")
+            # Скидки продукта могли измениться - старые цены в таблице больше не действуют
+            await price_table.drop_products([product_id])
+            context = PricingContext()
+            if product is not None and "metadata" in product:
+                # Скидки лежат в метаданных из тела вебхука - продукт повторно не запрашиваем
+                context.remember_products([{**product, "id": product_id}])
+                payload_usage.metadata_refetches_avoided += 1
+            results = await calculate_batch(batch_items, context)
+            await price_table.store_results(results, context)
+            written = await price_writeback.write_back(product_id, listings, results)
+            print(f"Recalculated prices for product {product_id} across {len(batch_items)} channel(s), "
+                  f"{written} listing price(s) updated in Saleor")
     except Exception as e:
         print(f"Error recalculating prices for product {product_id}: {str(e)}")
+        # Ошибку видит очередь задач: повтор с задержкой, затем dead-letter
+        raise
+
+async def _recalculate_product_job(product_id: str, product: Optional[dict] = None):
+    # Имя функции разрешается при вызове, поэтому ее можно подменить (например, в тестах)
+    await recalculate_product_prices(product_id, product)
+
+job_queue.register(RECALCULATE_PRODUCT_JOB, _recalculate_product_job)
@@ -10,7 +10,69 @@ class Settings(BaseSettings):
     REDIS_URL: str = "redis://127.0.0.1:6379/0"
     CORS_ORIGINS: str = "http://127.0.0.1:3000,https://your-instance.saleor.cloud"
     SALEOR_APP_TOKEN: str = ""  # Токен для авторизации в Saleor
+
+    # Пул соединений к Saleor (общий httpx.AsyncClient на всё приложение)
+    SALEOR_HTTP2: bool = False  # Требует установленного пакета h2
+    SALEOR_POOL_MAX_CONNECTIONS: int = 100
+    SALEOR_POOL_MAX_KEEPALIVE: int = 20
+    SALEOR_POOL_KEEPALIVE_EXPIRY: float = 30.0
+    SALEOR_TIMEOUT: float = 10.0
+    SALEOR_CONNECT_TIMEOUT: float = 5.0
+    SALEOR_POOL_TIMEOUT: float = 5.0
+    SALEOR_BATCH_MAX_SIZE: int = 100  # Максимум алиасов в одном пакетном GraphQL-запросе
+    SALEOR_PAGE_SIZE: int = 100  # Размер страницы при обходе каталога (максимум Saleor - 100)
+    SALEOR_PAGE_PREFETCH: bool = True  # Запрашивать следующую страницу заранее
+    SALEOR_BULK_CHUNK_SIZE: int = 50  # Мутаций в одном пакетном GraphQL-документе
+    SALEOR_BULK_CONCURRENCY: int = 4  # Пакетов мутаций, отправляемых одновременно
+    SALEOR_WRITE_CONCURRENCY: int = 4  # Одновременных записей цен в листинги каналов на процесс
+
+    # Пакетный расчет цен
+    PRICE_BATCH_THREAD_THRESHOLD: int = 1000  # С этого размера пакет считается вне event loop
+    RUST_PARALLEL_THRESHOLD: int = 50000  # С этого размера Rust считает параллельно (rayon)
+    PRICE_BATCH_CONCURRENCY: int = 50  # Одновременных загрузок продуктов при пакетном расчете
+    PRICE_STREAM_CHUNK_SIZE: int = 1000  # Размер порции потокового NDJSON-расчета
+    PRICE_STREAM_MAX_LINE_BYTES: int = 65536  # Максимальная длина строки потокового NDJSON-запроса
+    PRICE_MATRIX_MAX_CELLS: int = 100000  # Максимум ячеек (продукты x каналы) в матрице цен
+    
+    # Материализованная таблица итоговых цен в Redis
+    PRICE_TABLE_ENABLED: bool = True
+    PRICE_TABLE_MAX_AGE: float = 60.0  # Секунд; запись действует не дольше (и не дольше смены активности скидки)
+    
+    # Запись пересчитанных цен в листинги каналов Saleor
+    PRICE_WRITEBACK_ENABLED: bool = True
+    PRICE_WRITEBACK_LOCK_TTL: int = 30  # Блокировка записи цен продукта в Redis (одна запись продукта за раз)
+    PRICE_WRITEBACK_LOCK_WAIT: float = 30.0  # Сколько ждать чужую запись продукта, прежде чем повторить задачу
     
+    # Очередь задач вебхуков (Redis Streams, без Redis - локальная очередь)
+    WEBHOOK_QUEUE_STREAM: str = "price_manager:webhook_jobs"
+    WEBHOOK_QUEUE_GROUP: str = "price_manager"
+    WEBHOOK_QUEUE_MAXLEN: int = 1000000  # Приблизительная обрезка потока (XADD MAXLEN ~)
+    WEBHOOK_QUEUE_BLOCK_MS: int = 1000  # Сколько воркер ждет новую задачу в XREADGROUP
+    WEBHOOK_QUEUE_POLL_INTERVAL: float = 1.0  # Как часто переносить отложенные повторы
+    WEBHOOK_WORKER_CONCURRENCY: int = 8  # Одновременно выполняемых задач на процесс
+    WEBHOOK_JOB_MAX_ATTEMPTS: int = 5  # После стольких попыток задача уходит в dead-letter
+    WEBHOOK_RETRY_BACKOFF: float = 1.0  # Первая задержка повтора, дальше удваивается
+    WEBHOOK_RETRY_BACKOFF_MAX: float = 300.0
+    WEBHOOK_JOB_VISIBILITY_TIMEOUT: float = 300.0  # Через сколько забирать задачу упавшего воркера
+    PRODUCT_WEBHOOK_DEBOUNCE_WINDOW: float = 2.0  # Окно склейки PRODUCT_UPDATED одного продукта (0 - без склейки)
+    PRODUCT_WEBHOOK_DEBOUNCE_MAX_DELAY: float = 10.0  # Пересчет не позже, чем через столько секунд после первого события
+    
+    # Пересчет каталога канала после смены наценки
+    REPRICE_JOB_PAGE_SIZE: int = 100  # Продуктов на странице (не больше 100 - лимит Saleor)
+    REPRICE_JOB_PAGES_PER_STEP: int = 10  # Страниц за один шаг задачи очереди
+    REPRICE_JOB_TTL: int = 604800  # Секунд хранения состояния задачи в Redis
+
+    # Двухуровневый кэш наценок (L1 в процессе перед Redis)
+    MARKUP_L1_MAX_SIZE: int = 10000
+    MARKUP_L1_TTL: float = 60.0  # Страховка на случай потерянной инвалидации через pub/sub
+    MARKUP_NEGATIVE_TTL: int = 300  # TTL записи "у канала нет наценки"
+    MARKUP_LOCK_TTL: int = 10  # Блокировка пересчета ключа в Redis (защита от stampede)
+    MARKUP_LOCK_WAIT: float = 2.0  # Сколько ждать чужой пересчет, прежде чем идти в Saleor самим
+
+    # Реестр каналов в памяти (поиск канала по поддомену без запросов в Saleor)
+    CHANNEL_REGISTRY_REFRESH_INTERVAL: float = 60.0
+    CHANNEL_LIST_SOFT_TTL: float = 30.0  # После этого возраста снимок отдается и обновляется в фоне
+
     # Additional settings that may be present in .env but not used by our app
     APPLICATION_HOST: str = "0.0.0.0"
     APPLICATION_PORT: int = 8000
@@ -118,6 +118,91 @@ class PriceCalculationResponse(BaseModel):
         }
     )
 
+class BatchPriceCalculationResult(PriceCalculationResponse):
+    """Batch item result: a calculated price or a per-item error"""
+    channel_id: Optional[str] = Field(None, description="Base64 encoded Saleor channel ID")
+    markup_percent: Optional[str] = Field(None, description="Applied markup percentage")
+    final_price: Optional[str] = Field(None, description="Final price after markup and discount")
+    error: Optional[str] = Field(None, description="Why this item could not be priced (other items are unaffected)")
+
+class PriceMatrixRequest(BaseModel):
+    """Request model for the products x channels price matrix"""
+    product_ids: Optional[List[str]] = Field(
+        None,
+        description="Products to price; if omitted, a page of products is taken from Saleor"
+    )
+    channel_slug: Optional[str] = Field(None, description="Channel used to filter the product page")
+    first: int = Field(100, ge=1, le=100, description="Product page size")
+    after: Optional[str] = Field(None, description="Product page cursor (next_cursor of the previous page)")
+    channel_ids: Optional[List[str]] = Field(
+        None,
+        description="Matrix columns; all known channels if omitted"
+    )
+    base_prices: Dict[str, Decimal] = Field(
+        default_factory=dict,
+        description="Base price per product ID"
+    )
+    default_base_price: Optional[Decimal] = Field(
+        None,
+        gt=0,
+        description="Base price for products missing from base_prices"
+    )
+    
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "product_ids": ["UHJvZHVjdDox", "UHJvZHVjdDoy"],
+                "channel_ids": ["Q2hhbm5lbDox", "Q2hhbm5lbDoy"],
+                "base_prices": {"UHJvZHVjdDox": 100.00, "UHJvZHVjdDoy": 50.00}
+            }
+        }
+    )
+    
+    @field_validator('base_prices')
+    @classmethod
+    def validate_base_prices(cls, v):
+        for product_id, price in v.items():
+            if price <= 0:
+                raise ValueError(f"Base price for {product_id} must be positive")
+        return v
+
+class PriceMatrixRow(BaseModel):
+    """One product row of the price matrix"""
+    product_id: str = Field(..., description="Base64 encoded Saleor product ID")
+    base_price: Optional[str] = Field(None, description="Original base price")
+    discount_percent: Optional[str] = Field(None, description="Active discount percentage (if any)")
+    prices: List[Optional[str]] = Field(
+        default_factory=list,
+        description="Final prices, aligned with the matrix channels"
+    )
+    error: Optional[str] = Field(None, description="Why this product could not be priced")
+
+class PriceMatrixResponse(BaseModel):
+    """Products x channels price matrix"""
+    channels: List[str] = Field(..., description="Channel IDs (matrix columns)")
+    markups: List[str] = Field(..., description="Markup percentage per channel")
+    rows: List[PriceMatrixRow] = Field(..., description="One row per product")
+    currency: str = Field(default="USD", description="Currency code")
+    next_cursor: Optional[str] = Field(None, description="Cursor of the next product page (page mode only)")
+
+class RepriceJobStatus(BaseModel):
+    """Progress of a channel repricing job"""
+    job_id: str = Field(..., description="Repricing job ID")
+    channel_id: str = Field(..., description="Base64 encoded Saleor channel ID")
+    markup_percent: str = Field(..., description="Markup percentage the job was started for")
+    status: str = Field(..., description="queued, running, completed, failed or superseded")
+    cursor: Optional[str] = Field(None, description="Last committed product page cursor; the job resumes after it")
+    pages: int = Field(0, description="Product pages processed")
+    products: int = Field(0, description="Products processed")
+    listings_written: int = Field(0, description="Channel listing prices updated in Saleor")
+    failed_products: int = Field(0, description="Products whose prices could not be written")
+    started_at: Optional[float] = Field(None, description="Unix time the first page started")
+    updated_at: Optional[float] = Field(None, description="Unix time of the last committed page")
+    finished_at: Optional[float] = Field(None, description="Unix time the job finished")
+    elapsed_seconds: float = Field(0.0, description="Seconds since the job started (until it finished)")
+    products_per_second: float = Field(0.0, description="Average throughput")
+    error: Optional[str] = Field(None, description="Last error, if any")
+
 class SaleorWebhookPayload(BaseModel):
     """Saleor webhook event payload"""
     event_type: str = Field(
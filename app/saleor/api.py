@@ -1,7 +1,49 @@
-import httpx
+import asyncio
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from app.core.config import settings
+from app.saleor.client import saleor_client
+from app.saleor.loader import current_loader
+
+class SaleorAPIError(Exception):
+    """Ошибка, возвращенная Saleor GraphQL API"""
+
+CHANNEL_FIELDS = """
+    id
+    name
+    slug
+    metadata {
+        key
+        value
+    }
+"""
+
+VARIANT_METADATA_FIELDS = """
+    id
+    metadata {
+        key
+        value
+    }
+"""
+
+PRODUCT_FIELDS = """
+    id
+    name
+    slug
+    metadata {
+        key
+        value
+    }
+"""
 
 async def get_channel(channel_id: str):
+    """Получает данные канала из Saleor (через пакетный загрузчик запроса, если он активен)"""
+    loader = current_loader()
+    if loader is not None:
+        return await loader.load_channel(channel_id)
+    return await _fetch_channel(channel_id)
+
+async def _fetch_channel(channel_id: str):
     """Получает данные канала из Saleor"""
     # Demo-режим для тестирования
     if not settings.SALEOR_APP_TOKEN or settings.SALEOR_APP_TOKEN == "your_saleor_app_token_here":
@@ -49,17 +91,11 @@ async def get_channel(channel_id: str):
         }
     }
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            settings.SALEOR_API_URL,
-            json={"query": query, "variables": {"id": channel_id}},
-            headers={"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"}
-        )
-        data = response.json()
-        if "errors" in data:
-            print(f"Saleor API Error for channel {channel_id}: {data['errors']}")
-            return None
-        return data.get("data", {}).get("channel")
+    data = await saleor_client.execute(query, {"id": channel_id})
+    if "errors" in data:
+        print(f"Saleor API Error for channel {channel_id}: {data['errors']}")
+        return None
+    return data.get("data", {}).get("channel")
 
 async def list_channels():
     """Получает список всех каналов"""
@@ -111,37 +147,31 @@ async def list_channels():
     
     # Используем реальный Saleor API
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                settings.SALEOR_API_URL,
-                json={"query": query},
-                headers={"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"} if settings.SALEOR_APP_TOKEN != "your_saleor_app_token_here" else {}
-            )
-            data = response.json()
+        data = await saleor_client.execute(query)
+        
+        # Если есть ошибки, возвращаем demo-данные
+        if "errors" in data:
+            print(f"Saleor API Error: {data['errors']}")
+            print("Falling back to demo mode")
+            return await _get_demo_channels_with_markup()
             
-            # Если есть ошибки, возвращаем demo-данные
-            if "errors" in data:
-                print(f"Saleor API Error: {data['errors']}")
-                print("Falling back to demo mode")
-                return await _get_demo_channels_with_markup()
+        channels = data.get("data", {}).get("channels", [])
+        
+        # Добавляем markup_percent из metadata для каждого канала
+        for channel in channels:
+            markup_found = False
+            for meta in channel.get("metadata", []):
+                if meta["key"] == "price_markup_percent":
+                    markup_found = True
+                    break
+            if not markup_found:
+                # Добавляем default markup если его нет
+                channel.setdefault("metadata", []).append(
+                    {"key": "price_markup_percent", "value": "0"}
+                )
                 
-            channels = data.get("data", {}).get("channels", [])
-            
-            # Добавляем markup_percent из metadata для каждого канала
-            for channel in channels:
-                markup_found = False
-                for meta in channel.get("metadata", []):
-                    if meta["key"] == "price_markup_percent":
-                        markup_found = True
-                        break
-                if not markup_found:
-                    # Добавляем default markup если его нет
-                    channel.setdefault("metadata", []).append(
-                        {"key": "price_markup_percent", "value": "0"}
-                    )
-                    
-            return channels
-            
+        return channels
+        
     except Exception as e:
         print(f"Error connecting to Saleor API: {e}")
         print("Falling back to demo mode")
@@ -193,17 +223,11 @@ async def update_channel_metadata(channel_id: str, metadata: list):
         }
     }
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            settings.SALEOR_API_URL,
-            json={"query": mutation, "variables": {"id": channel_id, "input": metadata}},
-            headers={"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"}
-        )
-        data = response.json()
-        if "errors" in data:
-            print(f"Saleor API Error updating metadata for channel {channel_id}: {data['errors']}")
-            return False
-        return not data.get("data", {}).get("updateMetadata", {}).get("errors")
+    data = await saleor_client.execute(mutation, {"id": channel_id, "input": metadata})
+    if "errors" in data:
+        print(f"Saleor API Error updating metadata for channel {channel_id}: {data['errors']}")
+        return False
+    return not data.get("data", {}).get("updateMetadata", {}).get("errors")
 
 async def get_product_data(product_id: str):
     """Получает данные продукта из Saleor"""
@@ -216,6 +240,10 @@ async def get_product_data(product_id: str):
             variants {
                 id
                 name
+                metadata {
+                    key
+                    value
+                }
                 channelListings {
                     channel {
                         id
@@ -231,35 +259,13 @@ async def get_product_data(product_id: str):
         }
     }
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            settings.SALEOR_API_URL,
-            json={"query": query, "variables": {"id": product_id}},
-            headers={"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"}
-        )
-        data = response.json()
-        return data.get("data", {}).get("product")
+    data = await saleor_client.execute(query, {"id": product_id})
+    return data.get("data", {}).get("product")
 async def get_channel_by_subdomain(subdomain: str):
     """Получает канал по поддомену (поддерживает множественные subdomains)"""
-    # Используем ту же логику, что и endpoint /api/channels/
-    from app.api.channels import get_real_channels_or_fallback
-    channels = await get_real_channels_or_fallback()
-    
-    for channel in channels:
-        for meta in channel.get("metadata", []):
-            # Поддерживаем как одиночные subdomain, так и множественные subdomains
-            if meta["key"] in ["subdomain", "subdomains"]:
-                # Разделяем по запятым и проверяем каждый subdomain
-                subdomains = [s.strip() for s in meta["value"].split(",")]
-                if subdomain in subdomains:
-                    return channel
-                    
-    # Если не нашли по subdomain, попробуем найти по slug
-    for channel in channels:
-        if channel["slug"] == subdomain:
-            return channel
-            
-    return None
+    # Поиск по индексу реестра каналов: снимок обновляется в фоне и по вебхукам
+    from app.services.channel_registry import channel_registry
+    return await channel_registry.get_by_subdomain(subdomain)
 
 def get_channel_subdomains(channel):
     """Извлекает список subdomains для канала"""
@@ -269,6 +275,13 @@ def get_channel_subdomains(channel):
     return [channel["slug"]]  # fallback к slug канала
 
 async def get_product(product_id: str):
+    """Получает данные продукта из Saleor (через пакетный загрузчик запроса, если он активен)"""
+    loader = current_loader()
+    if loader is not None:
+        return await loader.load_product(product_id)
+    return await _fetch_product(product_id)
+
+async def _fetch_product(product_id: str):
     """Получает данные продукта из Saleor включая метаданные"""
     # Demo-режим для тестирования
     if not settings.SALEOR_APP_TOKEN or settings.SALEOR_APP_TOKEN == "your_saleor_app_token_here":
@@ -305,17 +318,54 @@ async def get_product(product_id: str):
         }
     }
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            settings.SALEOR_API_URL,
-            json={"query": query, "variables": {"id": product_id}},
-            headers={"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"}
-        )
-        data = response.json()
+    data = await saleor_client.execute(query, {"id": product_id})
+    if "errors" in data:
+        print(f"Saleor API Error for product {product_id}: {data['errors']}")
+        return None
+    return data.get("data", {}).get("product")
+
+def _build_aliased_query(operation: str, field: str, selection: str, ids: List[str]) -> str:
+    """Собирает один GraphQL-документ с алиасом на каждый ID: n0: product(id: $id0) {...}"""
+    variables = ", ".join(f"$id{i}: ID!" for i in range(len(ids)))
+    fields = "\n".join(
+        f"n{i}: {field}(id: $id{i}) {{{selection}}}" for i in range(len(ids))
+    )
+    return f"query {operation}({variables}) {{\n{fields}\n}}"
+
+async def _fetch_by_ids(operation: str, field: str, selection: str, ids: List[str]) -> Dict[str, Optional[dict]]:
+    """Получает объекты Saleor по списку ID пакетами по SALEOR_BATCH_MAX_SIZE алиасов"""
+    result: Dict[str, Optional[dict]] = {}
+    unique_ids = list(dict.fromkeys(ids))
+    chunk_size = max(1, settings.SALEOR_BATCH_MAX_SIZE)
+    for start in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[start:start + chunk_size]
+        query = _build_aliased_query(operation, field, selection, chunk)
+        variables = {f"id{i}": object_id for i, object_id in enumerate(chunk)}
+        data = await saleor_client.execute(query, variables)
         if "errors" in data:
-            print(f"Saleor API Error for product {product_id}: {data['errors']}")
-            return None
-        return data.get("data", {}).get("product")
+            print(f"Saleor API Error in {operation}: {data['errors']}")
+        nodes = data.get("data") or {}
+        for i, object_id in enumerate(chunk):
+            result[object_id] = nodes.get(f"n{i}")
+    return result
+
+async def get_channels_by_ids(channel_ids: List[str]) -> Dict[str, Optional[dict]]:
+    """Получает несколько каналов одним aliased GraphQL-запросом"""
+    if not settings.SALEOR_APP_TOKEN or settings.SALEOR_APP_TOKEN == "your_saleor_app_token_here":
+        return {channel_id: await _fetch_channel(channel_id) for channel_id in channel_ids}
+    return await _fetch_by_ids("GetChannels", "channel", CHANNEL_FIELDS, channel_ids)
+
+async def get_products_by_ids(product_ids: List[str]) -> Dict[str, Optional[dict]]:
+    """Получает несколько продуктов одним aliased GraphQL-запросом"""
+    if not settings.SALEOR_APP_TOKEN or settings.SALEOR_APP_TOKEN == "your_saleor_app_token_here":
+        return {product_id: await _fetch_product(product_id) for product_id in product_ids}
+    return await _fetch_by_ids("GetProductsByIds", "product", PRODUCT_FIELDS, product_ids)
+
+async def get_variants_metadata(variant_ids: List[str]) -> Optional[Dict[str, Optional[dict]]]:
+    """Свежие метаданные вариантов одним aliased GraphQL-запросом; None в demo-режиме"""
+    if not settings.SALEOR_APP_TOKEN or settings.SALEOR_APP_TOKEN == "your_saleor_app_token_here":
+        return None
+    return await _fetch_by_ids("GetVariantsMetadata", "productVariant", VARIANT_METADATA_FIELDS, variant_ids)
 
 async def get_products(channel_slug: str = None, first: int = 100):
     """Получает список продуктов с метаданными"""
@@ -340,9 +390,44 @@ async def get_products(channel_slug: str = None, first: int = 100):
             }
         ]
     
+    # Собираем первые `first` продуктов, проходя по курсорам Saleor
+    products = []
+    try:
+        async with aclosing(iter_products(channel_slug, page_size=min(first, settings.SALEOR_PAGE_SIZE))) as stream:
+            async for product in stream:
+                products.append(product)
+                if len(products) >= first:
+                    break
+    except SaleorAPIError as e:
+        print(e)
+        return []
+    return products
+
+# Варианты с листингами каналов и метаданными (базовые цены) - для пересчета цен страницами
+PRODUCT_VARIANT_PRICING_FIELDS = """
+                    variants {
+                        id
+                        metadata {
+                            key
+                            value
+                        }
+                        channelListings {
+                            channel {
+                                id
+                            }
+                            price {
+                                amount
+                                currency
+                            }
+                        }
+                    }"""
+
+async def _fetch_product_page(channel_slug: Optional[str], first: int, after: Optional[str],
+                              with_variants: bool = False) -> Tuple[List[dict], dict]:
+    """Получает одну страницу продуктов и pageInfo"""
     query = """
-    query GetProducts($channel: String, $first: Int!) {
-        products(first: $first, channel: $channel) {
+    query GetProducts($channel: String, $first: Int!, $after: String) {
+        products(first: $first, after: $after, channel: $channel) {
             edges {
                 node {
                     id
@@ -351,25 +436,72 @@ async def get_products(channel_slug: str = None, first: int = 100):
                     metadata {
                         key
                         value
-                    }
+                    }%s
                 }
             }
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
         }
     }
+    """ % (PRODUCT_VARIANT_PRICING_FIELDS if with_variants else "")
+    data = await saleor_client.execute(query, {"channel": channel_slug, "first": first, "after": after})
+    if "errors" in data:
+        raise SaleorAPIError(f"Saleor API Error getting products: {data['errors']}")
+    
+    products = (data.get("data") or {}).get("products") or {}
+    return [edge["node"] for edge in products.get("edges", [])], products.get("pageInfo") or {}
+
+async def iter_product_pages(
+    channel_slug: str = None,
+    page_size: int = None,
+    after: str = None,
+    prefetch: bool = None,
+    with_variants: bool = False
+) -> AsyncIterator[Tuple[List[dict], Optional[str]]]:
+    """Асинхронно обходит каталог Saleor по курсорам.
+
+    Отдает пары (продукты страницы, endCursor этой страницы); endCursor можно
+    передать в `after`, чтобы продолжить обход с того же места. При `prefetch`
+    следующая страница запрашивается, пока потребитель обрабатывает текущую.
+    В памяти одновременно держится не больше двух страниц. `with_variants`
+    добавляет в продукты варианты с листингами каналов и метаданными.
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            settings.SALEOR_API_URL,
-            json={"query": query, "variables": {"channel": channel_slug, "first": first}},
-            headers={"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"}
-        )
-        data = response.json()
-        if "errors" in data:
-            print(f"Saleor API Error getting products: {data['errors']}")
-            return []
-        
-        edges = data.get("data", {}).get("products", {}).get("edges", [])
-        return [edge["node"] for edge in edges]
+    # Demo-режим: весь каталог помещается на одну страницу
+    if not settings.SALEOR_APP_TOKEN or settings.SALEOR_APP_TOKEN == "your_saleor_app_token_here":
+        yield await get_products(channel_slug), None
+        return
+    
+    page_size = max(1, min(page_size or settings.SALEOR_PAGE_SIZE, 100))
+    prefetch = settings.SALEOR_PAGE_PREFETCH if prefetch is None else prefetch
+    
+    next_page = asyncio.ensure_future(_fetch_product_page(channel_slug, page_size, after, with_variants))
+    try:
+        while next_page is not None:
+            products, page_info = await next_page
+            next_page = None
+            end_cursor = page_info.get("endCursor")
+            has_next = page_info.get("hasNextPage") and end_cursor
+            
+            if has_next and prefetch:
+                next_page = asyncio.ensure_future(_fetch_product_page(channel_slug, page_size, end_cursor, with_variants))
+            
+            yield products, end_cursor
+            
+            if has_next and not prefetch:
+                next_page = asyncio.ensure_future(_fetch_product_page(channel_slug, page_size, end_cursor, with_variants))
+    finally:
+        # Потребитель прервал обход - не оставляем висящий запрос следующей страницы
+        if next_page is not None and not next_page.done():
+            next_page.cancel()
+
+async def iter_products(channel_slug: str = None, page_size: int = None, prefetch: bool = None) -> AsyncIterator[dict]:
+    """Асинхронно отдает продукты каталога по одному (постоянная память на любом объеме)"""
+    async with aclosing(iter_product_pages(channel_slug, page_size=page_size, prefetch=prefetch)) as pages:
+        async for products, _ in pages:
+            for product in products:
+                yield product
 
 async def update_product_metadata(product_id: str, metadata: list):
     """Обновляет метаданные продукта"""
@@ -394,17 +526,170 @@ async def update_product_metadata(product_id: str, metadata: list):
         }
     }
     """
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            settings.SALEOR_API_URL,
-            json={"query": mutation, "variables": {"id": product_id, "input": metadata}},
-            headers={"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"}
+    data = await saleor_client.execute(mutation, {"id": product_id, "input": metadata})
+    if "errors" in data:
+        print(f"Saleor API Error updating product metadata for {product_id}: {data['errors']}")
+        return False
+    return not data.get("data", {}).get("updateMetadata", {}).get("errors")
+
+def _build_bulk_metadata_mutation(count: int) -> str:
+    """Собирает один документ с `count` алиасами updateMetadata и общим $input"""
+    variables = ", ".join(f"$id{i}: ID!" for i in range(count))
+    fields = "\n".join(
+        f"m{i}: updateMetadata(id: $id{i}, input: $input) {{ errors {{ field message }} }}"
+        for i in range(count)
+    )
+    return f"mutation BulkUpdateMetadata({variables}, $input: [MetadataInput!]!) {{\n{fields}\n}}"
+
+async def _update_metadata_chunk(object_ids: List[str], metadata: list) -> Dict[str, bool]:
+    """Отправляет один пакет мутаций и возвращает успех по каждому объекту"""
+    variables = {f"id{i}": object_id for i, object_id in enumerate(object_ids)}
+    variables["input"] = metadata
+    try:
+        data = await saleor_client.execute(_build_bulk_metadata_mutation(len(object_ids)), variables)
+    except Exception as e:
+        print(f"Saleor API Error in bulk metadata update: {e}")
+        return {object_id: False for object_id in object_ids}
+    
+    if "errors" in data:
+        print(f"Saleor API Error in bulk metadata update: {data['errors']}")
+    nodes = data.get("data") or {}
+    results = {}
+    for i, object_id in enumerate(object_ids):
+        node = nodes.get(f"m{i}")
+        results[object_id] = node is not None and not node.get("errors")
+    return results
+
+async def bulk_update_product_metadata(
+    product_ids: List[str],
+    metadata: list,
+    chunk_size: int = None,
+    concurrency: int = None
+) -> Dict[str, bool]:
+    """Обновляет одинаковые метаданные у многих продуктов.
+
+    Мутации упаковываются по `chunk_size` алиасов в один GraphQL-документ,
+    пакеты отправляются параллельно, но не больше `concurrency` одновременно.
+    Возвращает {product_id: успех}.
+    """
+    # Demo-режим: просто логируем операцию
+    if not settings.SALEOR_APP_TOKEN or settings.SALEOR_APP_TOKEN == "your_saleor_app_token_here":
+        print(f"DEMO: Would update {len(product_ids)} product(s) metadata: {metadata}")
+        return {product_id: True for product_id in product_ids}
+    
+    unique_ids = list(dict.fromkeys(product_ids))
+    chunk_size = max(1, chunk_size or settings.SALEOR_BULK_CHUNK_SIZE)
+    semaphore = asyncio.Semaphore(max(1, concurrency or settings.SALEOR_BULK_CONCURRENCY))
+    
+    async def run_chunk(chunk: List[str]) -> Dict[str, bool]:
+        async with semaphore:
+            return await _update_metadata_chunk(chunk, metadata)
+    
+    chunks = [unique_ids[i:i + chunk_size] for i in range(0, len(unique_ids), chunk_size)]
+    results: Dict[str, bool] = {}
+    for chunk_result in await asyncio.gather(*(run_chunk(chunk) for chunk in chunks)):
+        results.update(chunk_result)
+    return results
+
+# Общий ограничитель записи цен в Saleor: нагрузка не растет с числом одновременных пересчетов
+_listing_write_semaphore: Optional[asyncio.Semaphore] = None
+
+def _listing_write_limiter() -> asyncio.Semaphore:
+    global _listing_write_semaphore
+    if _listing_write_semaphore is None:
+        _listing_write_semaphore = asyncio.Semaphore(max(1, settings.SALEOR_WRITE_CONCURRENCY))
+    return _listing_write_semaphore
+
+def _build_variant_metadata_mutation(count: int) -> str:
+    """updateMetadata на каждый вариант, у каждого свои метаданные"""
+    variables = ", ".join(f"$id{i}: ID!, $meta{i}: [MetadataInput!]!" for i in range(count))
+    fields = "\n".join(
+        f"m{i}: updateMetadata(id: $id{i}, input: $meta{i}) {{ errors {{ field message }} }}" for i in range(count)
+    )
+    return f"mutation UpdateVariantMetadata({variables}) {{\n{fields}\n}}"
+
+def _build_variant_listings_mutation(count: int) -> str:
+    """productVariantChannelListingUpdate на каждый вариант"""
+    variables = ", ".join(f"$id{i}: ID!, $input{i}: [ProductVariantChannelListingAddInput!]!" for i in range(count))
+    fields = "\n".join(
+        f"v{i}: productVariantChannelListingUpdate(id: $id{i}, input: $input{i}) {{ errors {{ field message }} }}"
+        for i in range(count)
+    )
+    return f"mutation UpdateVariantListings({variables}) {{\n{fields}\n}}"
+
+async def _execute_variant_mutation(query: str, variables: dict, updates: List[dict], alias: str) -> Dict[str, bool]:
+    """Выполняет aliased-мутацию по вариантам и возвращает {variant_id: успех}"""
+    try:
+        async with _listing_write_limiter():
+            data = await saleor_client.execute(query, variables)
+    except Exception as e:
+        print(f"Saleor API Error updating variants: {e}")
+        return {update["variant_id"]: False for update in updates}
+    
+    if "errors" in data:
+        print(f"Saleor API Error updating variants: {data['errors']}")
+    nodes = data.get("data") or {}
+    results = {}
+    for i, update in enumerate(updates):
+        node = nodes.get(f"{alias}{i}")
+        results[update["variant_id"]] = node is not None and not node.get("errors")
+    return results
+
+async def _update_variant_prices_chunk(updates: List[dict]) -> Dict[str, bool]:
+    # Сначала метаданные: без записанной базовой цены листинг трогать нельзя,
+    # иначе следующий пересчет примет итоговую цену листинга за базовую
+    with_metadata = [update for update in updates if update.get("metadata")]
+    metadata_results: Dict[str, bool] = {}
+    if with_metadata:
+        variables = {}
+        for i, update in enumerate(with_metadata):
+            variables[f"id{i}"] = update["variant_id"]
+            variables[f"meta{i}"] = update["metadata"]
+        metadata_results = await _execute_variant_mutation(
+            _build_variant_metadata_mutation(len(with_metadata)), variables, with_metadata, "m"
         )
-        data = response.json()
-        if "errors" in data:
-            print(f"Saleor API Error updating product metadata for {product_id}: {data['errors']}")
-            return False
-        return not data.get("data", {}).get("updateMetadata", {}).get("errors")
+    
+    results = {update["variant_id"]: False for update in updates}
+    listings = [update for update in updates if metadata_results.get(update["variant_id"], True)]
+    if listings:
+        variables = {}
+        for i, update in enumerate(listings):
+            variables[f"id{i}"] = update["variant_id"]
+            variables[f"input{i}"] = [
+                {"channelId": channel_id, "price": str(price)} for channel_id, price in update["prices"].items()
+            ]
+        results.update(await _execute_variant_mutation(
+            _build_variant_listings_mutation(len(listings)), variables, listings, "v"
+        ))
+    return results
+
+async def update_variant_channel_prices(updates: List[dict]) -> Dict[str, bool]:
+    """Записывает цены вариантов одного продукта в их листинги каналов.
+
+    `updates` - [{"variant_id", "prices": {channel_id: цена}, "metadata": [...] или None}].
+    Метаданные и листинги - два запроса подряд (по SALEOR_BULK_CHUNK_SIZE алиасов):
+    листинги обновляются только у вариантов, чьи метаданные записались. Все записи
+    процесса проходят через общий ограничитель SALEOR_WRITE_CONCURRENCY.
+    Возвращает {variant_id: успех}.
+    """
+    # Demo-режим: просто логируем операцию
+    if not settings.SALEOR_APP_TOKEN or settings.SALEOR_APP_TOKEN == "your_saleor_app_token_here":
+        print(f"DEMO: Would update channel prices of {len(updates)} variant(s)")
+        return {update["variant_id"]: True for update in updates}
+    
+    chunk_size = max(1, settings.SALEOR_BULK_CHUNK_SIZE)
+    chunks = [updates[i:i + chunk_size] for i in range(0, len(updates), chunk_size)]
+    results: Dict[str, bool] = {}
+    for chunk_result in await asyncio.gather(*(_update_variant_prices_chunk(chunk) for chunk in chunks)):
+        results.update(chunk_result)
+    return results
+
+async def set_products_discounts_bulk(product_ids: List[str], discounts: list) -> Dict[str, bool]:
+    """Устанавливает одинаковые скидки для многих продуктов пакетными мутациями"""
+    from app.services.discount_service import discount_service
+    
+    metadata = [{"key": "discounts", "value": discount_service.format_discounts(discounts)}]
+    return await bulk_update_product_metadata(product_ids, metadata)
 
 async def set_product_discounts(product_id: str, discounts: list):
     """Устанавливает скидки для продукта в метаданных"""
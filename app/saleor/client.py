@@ -1,7 +1,101 @@
 # app/saleor/client.py
+import json
+from typing import Optional
 from app.core.config import settings
+from app.saleor.singleflight import SingleFlight
 import httpx
 
+class SaleorClient:
+    """Общий HTTP-клиент Saleor с пулом keep-alive соединений.
+
+    Создается один раз в lifespan приложения и переиспользуется всеми
+    запросами к Saleor, чтобы не платить за TCP+TLS handshake на каждый вызов.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self.single_flight = SingleFlight()
+
+    def _build_client(self) -> httpx.AsyncClient:
+        http2 = settings.SALEOR_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("Warning: h2 package not installed, falling back to HTTP/1.1 for Saleor client")
+                http2 = False
+
+        return httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=settings.SALEOR_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.SALEOR_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=settings.SALEOR_POOL_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                settings.SALEOR_TIMEOUT,
+                connect=settings.SALEOR_CONNECT_TIMEOUT,
+                pool=settings.SALEOR_POOL_TIMEOUT,
+            ),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Возвращает пул соединений, создавая его при первом обращении"""
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self):
+        """Открывает пул соединений (вызывается из lifespan)"""
+        return self.client
+
+    async def close(self):
+        """Закрывает пул соединений (вызывается при остановке приложения)"""
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+
+    @staticmethod
+    def auth_headers() -> dict:
+        """Заголовок авторизации, если токен приложения настроен"""
+        if settings.SALEOR_APP_TOKEN and settings.SALEOR_APP_TOKEN != "your_saleor_app_token_here":
+            return {"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"}
+        return {}
+
+    async def post(self, payload: dict, url: str = None, authenticated: bool = True) -> httpx.Response:
+        """Отправляет POST-запрос в Saleor через общий пул"""
+        headers = {"Content-Type": "application/json"}
+        if authenticated:
+            headers.update(self.auth_headers())
+        return await self.client.post(url or settings.SALEOR_API_URL, json=payload, headers=headers)
+
+    async def execute(self, query: str, variables: dict = None, authenticated: bool = True) -> dict:
+        """Выполняет GraphQL-запрос и возвращает разобранный JSON-ответ"""
+        payload = {"query": query}
+        if variables is not None:
+            payload["variables"] = variables
+
+        if query.lstrip().startswith("mutation"):
+            response = await self.post(payload, authenticated=authenticated)
+        else:
+            # Одинаковые одновременные запросы чтения идут в Saleor один раз;
+            # JSON разбирается каждым вызывающим заново, чтобы не делить изменяемые dict
+            key = (query, json.dumps(variables, sort_keys=True), authenticated)
+            response = await self.single_flight.do(
+                key, lambda: self.post(payload, authenticated=authenticated)
+            )
+        return response.json()
+
+    def stats(self) -> dict:
+        """Статистика клиента для /metrics"""
+        return {
+            "pool_open": self._client is not None,
+            "single_flight": self.single_flight.stats(),
+        }
+
+saleor_client = SaleorClient()
+
 async def register_app():
     """Регистрация приложения в Saleor"""
     manifest = {
@@ -31,28 +125,25 @@ async def register_app():
         ]
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{settings.SALEOR_API_URL}/app-manifest/",
-            json=manifest
-        )
-        
-        return response.json()
+    response = await saleor_client.post(
+        manifest,
+        url=f"{settings.SALEOR_API_URL}/app-manifest/",
+        authenticated=False
+    )
+    return response.json()
 
 async def init_saleor_client():
-    """Инициализация клиента Saleor"""
-    # Здесь можно добавить логику инициализации клиента
-    # Например, проверку подключения к API
+    """Инициализация клиента Saleor: открываем пул и проверяем подключение к API"""
+    await saleor_client.start()
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                settings.SALEOR_API_URL,
-                json={"query": "query { me { id email } }"},
-                headers={"Authorization": f"Bearer {settings.SALEOR_APP_TOKEN}"}
-            )
-            if response.status_code == 200:
-                print("Saleor client initialized successfully")
-            else:
-                print(f"Failed to initialize Saleor client: {response.status_code}")
+        response = await saleor_client.post({"query": "query { me { id email } }"})
+        if response.status_code == 200:
+            print("Saleor client initialized successfully")
+        else:
+            print(f"Failed to initialize Saleor client: {response.status_code}")
     except Exception as e:
-        print(f"Saleor client initialization error: {e}")
\ No newline at end of file
+        print(f"Saleor client initialization error: {e}")
+
+async def close_saleor_client():
+    """Закрытие пула соединений Saleor"""
+    await saleor_client.close()
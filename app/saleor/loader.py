@@ -0,0 +1,91 @@
+# app/saleor/loader.py
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+BatchFn = Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+
+class BatchLoader:
+    """DataLoader: собирает ключи, запрошенные в одном тике event loop,
+    и разрешает их одним пакетным вызовом.
+
+    Результаты мемоизируются на время жизни загрузчика (один HTTP-запрос),
+    поэтому повторный `load` того же ключа не создает нового запроса к Saleor.
+    """
+
+    def __init__(self, batch_fn: BatchFn):
+        self._batch_fn = batch_fn
+        self._futures: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+        self.dispatches = 0
+
+    async def load(self, key: Hashable) -> Any:
+        future = self._futures.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[key] = future
+            self._queue.append(key)
+            if len(self._queue) == 1:
+                # Отправляем пакет после того, как отработают все уже готовые корутины
+                loop.call_soon(self._dispatch)
+        return await asyncio.shield(future)
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Any]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def _dispatch(self):
+        keys, self._queue = self._queue, []
+        if keys:
+            self.dispatches += 1
+            asyncio.ensure_future(self._resolve(keys))
+
+    async def _resolve(self, keys: List[Hashable]):
+        try:
+            results = await self._batch_fn(keys)
+        except Exception as e:
+            for key in keys:
+                future = self._futures.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key in keys:
+            future = self._futures[key]
+            if not future.done():
+                future.set_result(results.get(key))
+
+class SaleorLoader:
+    """Загрузчики продуктов и каналов Saleor в рамках одного запроса"""
+
+    def __init__(self):
+        from app.saleor.api import get_products_by_ids, get_channels_by_ids
+        self.products = BatchLoader(get_products_by_ids)
+        self.channels = BatchLoader(get_channels_by_ids)
+
+    async def load_product(self, product_id: str) -> Optional[dict]:
+        return await self.products.load(product_id)
+
+    async def load_channel(self, channel_id: str) -> Optional[dict]:
+        return await self.channels.load(channel_id)
+
+_current_loader: ContextVar[Optional[SaleorLoader]] = ContextVar("saleor_loader", default=None)
+
+def current_loader() -> Optional[SaleorLoader]:
+    """Активный загрузчик текущего запроса (если есть)"""
+    return _current_loader.get()
+
+@contextmanager
+def use_loader(loader: SaleorLoader = None):
+    """Направляет get_product/get_channel через пакетный загрузчик.
+
+    Задачи, созданные внутри блока (asyncio.gather, create_task), наследуют
+    загрузчик через contextvars.
+    """
+    loader = loader or SaleorLoader()
+    token = _current_loader.set(loader)
+    try:
+        yield loader
+    finally:
+        _current_loader.reset(token)
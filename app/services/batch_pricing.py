@@ -0,0 +1,196 @@
+import asyncio
+import json
+from decimal import Decimal
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Union
+from pydantic import ValidationError
+from app.core.config import settings
+from app.models.schemas import PriceCalculationRequest, BatchPriceCalculationResult
+from app.saleor.loader import use_loader
+from app.services.discount_service import CompiledDiscount
+from app.services.price_calculator import calculate_prices_columnar_async, apply_compiled_discount
+from app.services.pricing_context import PricingContext
+
+def _error_result(item: PriceCalculationRequest, error: str) -> BatchPriceCalculationResult:
+    return BatchPriceCalculationResult(
+        product_id=item.product_id,
+        channel_id=item.channel_id,
+        base_price=str(item.base_price),
+        error=error
+    )
+
+async def prefetch_discounts(context: PricingContext,
+                             product_ids: Sequence[str]) -> List[Union[Optional[CompiledDiscount], Exception]]:
+    """Активные скидки продуктов: конкурентно, не больше PRICE_BATCH_CONCURRENCY
+    загрузок одновременно. Ошибка загрузки продукта возвращается на его месте."""
+    semaphore = asyncio.Semaphore(max(1, settings.PRICE_BATCH_CONCURRENCY))
+
+    async def prefetch(product_id: str) -> Optional[CompiledDiscount]:
+        async with semaphore:
+            return await context.get_active_discount(product_id)
+
+    return await asyncio.gather(*(prefetch(product_id) for product_id in product_ids), return_exceptions=True)
+
+async def calculate_batch(items: Sequence[PriceCalculationRequest],
+                          context: Optional[PricingContext] = None) -> List[BatchPriceCalculationResult]:
+    """
+    Пакетный расчет цен:
+    1. наценки всех каналов пакета - одним обращением (товары сгруппированы по каналам);
+    2. продукты и их активные скидки - конкурентно, не больше PRICE_BATCH_CONCURRENCY
+       загрузок одновременно, через пакетный загрузчик Saleor;
+    3. наценка для всех строк - одним колоночным вызовом (Rust, если доступен),
+       затем скидка и cap для строк с активной скидкой.
+    Результаты возвращаются в порядке входа; ошибка одной позиции не валит весь пакет.
+    """
+    if context is None:
+        context = PricingContext()
+
+    results: List[Optional[BatchPriceCalculationResult]] = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        if not item.channel_id:
+            results[index] = _error_result(item, "channel_id is required")
+        else:
+            pending.append(index)
+    if not pending:
+        return results
+
+    channel_ids = list(dict.fromkeys(items[index].channel_id for index in pending))
+    product_ids = list(dict.fromkeys(items[index].product_id for index in pending))
+
+    # Запросы get_product, сделанные в одном тике event loop, уходят в Saleor одним пакетом
+    with use_loader():
+        markups, discounts = await asyncio.gather(
+            context.get_markups(channel_ids),
+            prefetch_discounts(context, product_ids),
+            return_exceptions=True
+        )
+
+    if isinstance(markups, Exception):
+        for index in pending:
+            results[index] = _error_result(items[index], f"Markup lookup failed: {markups}")
+        return results
+    discounts_by_product: Dict[str, object] = dict(zip(product_ids, discounts))
+
+    rows = []
+    for index in pending:
+        discount = discounts_by_product[items[index].product_id]
+        if isinstance(discount, Exception):
+            results[index] = _error_result(items[index], f"Product lookup failed: {discount}")
+        else:
+            rows.append(index)
+
+    # Наценка для всех строк пакета одним колоночным вызовом
+    try:
+        marked_prices = await calculate_prices_columnar_async(
+            [Decimal(str(items[index].base_price)) for index in rows],
+            [markups[items[index].channel_id] for index in rows]
+        )
+    except Exception as e:
+        for index in rows:
+            results[index] = _error_result(items[index], f"Price calculation failed: {e}")
+        return results
+
+    for index, marked_price in zip(rows, marked_prices):
+        item = items[index]
+        discount = discounts_by_product[item.product_id]
+        try:
+            final_price = apply_compiled_discount(marked_price, discount)
+        except Exception as e:
+            results[index] = _error_result(item, f"Discount calculation failed: {e}")
+            continue
+        results[index] = BatchPriceCalculationResult(
+            product_id=item.product_id,
+            channel_id=item.channel_id,
+            base_price=str(item.base_price),
+            markup_percent=str(markups[item.channel_id]),
+            final_price=str(final_price),
+            currency="USD",
+            discount_applied=discount is not None,
+            discount_percent=str(discount.pricing()[0]) if discount is not None else None
+        )
+
+    return results
+
+
+async def iter_ndjson_lines(chunks: AsyncIterator[bytes],
+                            max_line_bytes: Optional[int] = None) -> AsyncIterator[Optional[str]]:
+    """Непустые строки NDJSON из потока байтов; в памяти держится только текущая строка.
+
+    Переводы строк ищутся только в новом фрагменте. Вместо строки длиннее
+    max_line_bytes (PRICE_STREAM_MAX_LINE_BYTES) отдается None, а ее остаток
+    до следующего перевода строки отбрасывается, не накапливаясь в памяти.
+    """
+    max_line_bytes = max_line_bytes or settings.PRICE_STREAM_MAX_LINE_BYTES
+    buffer = bytearray()
+    oversized = False
+    async for chunk in chunks:
+        *ends, rest = chunk.split(b"\n")
+        for end in ends:
+            if not oversized:
+                if len(buffer) + len(end) > max_line_bytes:
+                    yield None
+                else:
+                    buffer += end
+                    line = buffer.strip()
+                    if line:
+                        yield line.decode("utf-8", errors="replace")
+            oversized = False
+            buffer.clear()
+        if not oversized:
+            if len(buffer) + len(rest) > max_line_bytes:
+                oversized = True
+                buffer.clear()
+                yield None
+            else:
+                buffer += rest
+    line = buffer.strip()
+    if line:
+        yield line.decode("utf-8", errors="replace")
+
+def _parse_line(line: Optional[str]) -> Union[PriceCalculationRequest, BatchPriceCalculationResult]:
+    """Строка запроса или готовый результат с ошибкой, если строку не удалось разобрать"""
+    if line is None:
+        return BatchPriceCalculationResult(
+            product_id="", base_price="",
+            error=f"Line exceeds {settings.PRICE_STREAM_MAX_LINE_BYTES} bytes"
+        )
+    try:
+        raw = json.loads(line)
+    except ValueError as e:
+        return BatchPriceCalculationResult(product_id="", base_price="", error=f"Invalid JSON: {e}")
+    try:
+        return PriceCalculationRequest.model_validate(raw)
+    except ValidationError as e:
+        raw = raw if isinstance(raw, dict) else {}
+        return BatchPriceCalculationResult(
+            product_id=str(raw.get("product_id") or ""),
+            channel_id=raw.get("channel_id") if isinstance(raw.get("channel_id"), str) else None,
+            base_price=str(raw.get("base_price") or ""),
+            error=f"Invalid request: {e.errors()[0]['msg']}"
+        )
+
+async def _calculate_chunk(entries: List[Union[PriceCalculationRequest, BatchPriceCalculationResult]]) -> str:
+    requests = [entry for entry in entries if isinstance(entry, PriceCalculationRequest)]
+    # Свежий контекст на каждую порцию: запомненные продукты не копятся на весь поток
+    priced = iter(await calculate_batch(requests, PricingContext()))
+    return "".join(
+        (next(priced) if isinstance(entry, PriceCalculationRequest) else entry).model_dump_json() + "\n"
+        for entry in entries
+    )
+
+async def stream_batch(chunks: AsyncIterator[bytes], chunk_size: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Потоковый пакетный расчет: NDJSON на входе, NDJSON на выходе.
+    Строки читаются по мере поступления и считаются порциями по
+    PRICE_STREAM_CHUNK_SIZE через calculate_batch; результаты порции отдаются
+    сразу, в порядке входа. Память не зависит от размера всего потока.
+    """
+    chunk_size = max(1, chunk_size or settings.PRICE_STREAM_CHUNK_SIZE)
+    entries: List[Union[PriceCalculationRequest, BatchPriceCalculationResult]] = []
+    async for line in iter_ndjson_lines(chunks):
+        entries.append(_parse_line(line))
+        if len(entries) >= chunk_size:
+            yield await _calculate_chunk(entries)
+            entries = []
+    if entries:
+        yield await _calculate_chunk(entries)
@@ -0,0 +1,177 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+from app.core.config import settings
+
+class ChannelSnapshot:
+    """Неизменяемый снимок каналов с готовыми индексами по поддомену, slug и id"""
+
+    __slots__ = ("channels", "by_subdomain", "by_slug", "by_id", "loaded_at", "live")
+
+    def __init__(self, channels: List[Dict], live: bool = True):
+        self.channels = channels
+        # False - демо-данные (Saleor не настроен или ни разу не ответил)
+        self.live = live
+        self.by_subdomain: Dict[str, Dict] = {}
+        self.by_slug: Dict[str, Dict] = {}
+        self.by_id: Dict[str, Dict] = {}
+        self.loaded_at = time.monotonic()
+
+        for channel in channels:
+            for meta in channel.get("metadata", []):
+                # Поддерживаем как одиночные subdomain, так и множественные subdomains
+                if meta["key"] in ["subdomain", "subdomains"]:
+                    for subdomain in meta["value"].split(","):
+                        # Как и при линейном поиске, выигрывает первый канал в списке
+                        self.by_subdomain.setdefault(subdomain.strip(), channel)
+            if channel.get("slug"):
+                self.by_slug.setdefault(channel["slug"], channel)
+            if channel.get("id"):
+                self.by_id.setdefault(channel["id"], channel)
+
+    def find(self, subdomain: str) -> Optional[Dict]:
+        """Канал по поддомену, а если такого поддомена нет - по slug"""
+        channel = self.by_subdomain.get(subdomain)
+        if channel is None:
+            channel = self.by_slug.get(subdomain)
+        return channel
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.loaded_at
+
+
+class ChannelRegistry:
+    """Реестр каналов в памяти процесса.
+
+    Держит последний снимок каналов и обновляет его в фоне раз в
+    CHANNEL_REGISTRY_REFRESH_INTERVAL секунд и по вебхукам каналов,
+    поэтому поиск канала по поддомену не делает запросов в Saleor.
+    Если Saleor недоступен, остается последний удачный снимок (stale-if-error).
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[ChannelSnapshot] = None
+        self._refreshing: Optional[asyncio.Task] = None
+        # Номер последнего запроса refresh() и номер запроса, который видела последняя загрузка
+        self._requested = 0
+        self._loaded = 0
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def snapshot(self) -> Optional[ChannelSnapshot]:
+        return self._snapshot
+
+    async def _load(self) -> ChannelSnapshot:
+        from app.api.channels import fetch_saleor_channels, _get_pool_channels_demo, ChannelsUnavailable
+        # Запросы refresh(), сделанные до начала чтения Saleor, этой загрузкой выполнены
+        generation = self._requested
+        try:
+            channels = await fetch_saleor_channels()
+        except ChannelsUnavailable as e:
+            self.refresh_errors += 1
+            self.last_error = str(e)
+            if self._snapshot is not None and self._snapshot.live:
+                # stale-if-error: отдаем последний удачный снимок вместо демо-данных
+                print(f"⚠️ Saleor unavailable, serving channels snapshot from {self._snapshot.age:.0f}s ago")
+                return self._snapshot
+            snapshot = ChannelSnapshot(await _get_pool_channels_demo(e.shop_name), live=False)
+        else:
+            self.last_error = None
+            if channels is None:
+                print("📋 Using demo data (SALEOR_API_URL not configured)")
+                snapshot = ChannelSnapshot(await _get_pool_channels_demo("Demo"), live=False)
+            else:
+                snapshot = ChannelSnapshot(channels)
+        finally:
+            self._loaded = max(self._loaded, generation)
+        self._snapshot = snapshot
+        self.refreshes += 1
+        return snapshot
+
+    def _start_refresh(self) -> asyncio.Future:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._load())
+            # Ошибку фонового обновления забираем здесь, чтобы она не терялась молча
+            self._refreshing.add_done_callback(self._log_refresh_failure)
+        return self._refreshing
+
+    def _log_refresh_failure(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            self.refresh_errors += 1
+            self.last_error = str(task.exception())
+            print(f"Channel registry refresh failed: {task.exception()}")
+
+    async def refresh(self) -> ChannelSnapshot:
+        """Перечитать каналы; одновременные вызовы ждут одну и ту же загрузку.
+
+        Загрузка, которая уже читала Saleor до вызова, могла не увидеть
+        изменение (вебхук канала, новая наценка) - после нее запускается еще одна.
+        """
+        self._requested += 1
+        generation = self._requested
+        while True:
+            snapshot = await asyncio.shield(self._start_refresh())
+            if self._loaded >= generation:
+                return snapshot
+
+    def revalidate(self):
+        """Обновить снимок в фоне, не дожидаясь результата (stale-while-revalidate)"""
+        self._start_refresh()
+
+    @property
+    def revalidating(self) -> bool:
+        return self._refreshing is not None and not self._refreshing.done()
+
+    async def get_snapshot(self) -> ChannelSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = await self.refresh()
+        return snapshot
+
+    async def get_by_subdomain(self, subdomain: str) -> Optional[Dict]:
+        """Найти канал по поддомену (I/O только до первой загрузки снимка)"""
+        return (await self.get_snapshot()).find(subdomain)
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Уже учтено в _log_refresh_failure
+                pass
+            await asyncio.sleep(settings.CHANNEL_REGISTRY_REFRESH_INTERVAL)
+
+    def start(self):
+        """Запускает фоновое обновление (вызывается при старте приложения)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._task, self._refreshing):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._task = None
+        self._refreshing = None
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "channels": len(snapshot.channels) if snapshot else 0,
+            "age": round(snapshot.age, 3) if snapshot else None,
+            "live": snapshot.live if snapshot else None,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "last_error": self.last_error,
+        }
+
+channel_registry = ChannelRegistry()
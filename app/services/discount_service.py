@@ -1,10 +1,229 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import json
 from datetime import datetime
+from functools import lru_cache
 import pytz
 from croniter import croniter
 from decimal import Decimal
 
+PERIOD_FORMAT = "%d-%m-%YT%H:%M:%SZ"
+
+# (min, max, names) for minute, hour, day of month, month, day of week
+_CRON_FIELDS = (
+    (0, 59, None),
+    (0, 23, None),
+    (1, 31, None),
+    (1, 12, {name: i + 1 for i, name in enumerate(
+        ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"])}),
+    (0, 7, {name: i for i, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}),
+)
+
+
+def _parse_cron_value(value: str, names: Optional[Dict[str, int]]) -> int:
+    if names and value.lower() in names:
+        return names[value.lower()]
+    return int(value)
+
+
+def _compile_cron_field(expr: str, low: int, high: int, names: Optional[Dict[str, int]]) -> int:
+    """Expand one cron field into a bitset (bit N set = value N matches)"""
+    mask = 0
+    for part in expr.split(","):
+        step = 1
+        if "/" in part:
+            part, step_str = part.split("/", 1)
+            step = int(step_str)
+            if step < 1:
+                raise ValueError(f"Invalid cron step: {expr}")
+        if part in ("*", "?"):
+            start, end = low, high
+        elif "-" in part:
+            start_str, end_str = part.split("-", 1)
+            start, end = _parse_cron_value(start_str, names), _parse_cron_value(end_str, names)
+        else:
+            start = _parse_cron_value(part, names)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high:
+            raise ValueError(f"Cron value out of range: {expr}")
+        for value in range(start, end + 1, step):
+            mask |= 1 << value
+    return mask
+
+
+def _croniter_matches(schedule: str, current_time: datetime) -> bool:
+    """Slow path for cron syntax the bitset compiler does not handle (L, W, #, @macros, seconds)"""
+    cron = croniter(schedule, current_time)
+    current_minute = current_time.replace(second=0, microsecond=0)
+    next_run = cron.get_next(datetime)
+    prev_run = cron.get_prev(datetime)
+    return (abs((current_minute - prev_run).total_seconds()) < 60 or
+            abs((current_minute - next_run).total_seconds()) < 60)
+
+
+class CompiledSchedule:
+    """Cron expression pre-expanded into minute/hour/day/month/weekday bitsets"""
+    
+    __slots__ = ("schedule", "minutes", "hours", "days", "months", "weekdays", "day_or", "always", "fallback")
+    
+    def __init__(self, schedule: str):
+        self.schedule = schedule
+        self.always = False
+        self.fallback = False
+        fields = schedule.split() if isinstance(schedule, str) else []
+        try:
+            if len(fields) != 5:
+                raise ValueError(f"Unsupported cron format: {schedule}")
+            masks = [
+                _compile_cron_field(field, low, high, names)
+                for field, (low, high, names) in zip(fields, _CRON_FIELDS)
+            ]
+        except ValueError:
+            try:
+                croniter(schedule)
+            except (ValueError, TypeError) as e:
+                # If cron parsing fails, default to active
+                print(f"Error parsing cron schedule '{schedule}': {e}")
+                self.always = True
+            else:
+                self.fallback = True
+            return
+        
+        self.minutes, self.hours, self.days, self.months, weekdays = masks
+        # Both 0 and 7 mean Sunday
+        self.weekdays = (weekdays | (weekdays >> 7)) & 0x7F
+        # Standard cron: when both day fields are restricted, either may match
+        self.day_or = not fields[2].startswith(("*", "?")) and not fields[4].startswith(("*", "?"))
+        self.always = all(field == "*" for field in fields)
+    
+    def matches(self, current_time: datetime) -> bool:
+        if self.always:
+            return True
+        if self.fallback:
+            return _croniter_matches(self.schedule, current_time)
+        if not (self.minutes >> current_time.minute & 1
+                and self.hours >> current_time.hour & 1
+                and self.months >> current_time.month & 1):
+            return False
+        day_match = self.days >> current_time.day & 1
+        # datetime.weekday(): Monday=0, cron: Sunday=0
+        weekday_match = self.weekdays >> ((current_time.weekday() + 1) % 7) & 1
+        if self.day_or:
+            return bool(day_match or weekday_match)
+        return bool(day_match and weekday_match)
+
+
+class CompiledDiscount:
+    """Discount with its period turned into epoch bounds and its schedule into bitsets"""
+    
+    __slots__ = ("discount", "start_ts", "end_ts", "period_valid", "schedule", "percent", "cap")
+    
+    def __init__(self, discount: Dict):
+        self.discount = discount
+        # Pricing parameters are parsed lazily so a malformed value fails only when applied
+        self.percent = None
+        self.cap = None
+        self.start_ts = None
+        self.end_ts = None
+        self.period_valid = True
+        
+        period = discount.get("period") or {}
+        start_str = period.get("datetime_start")
+        end_str = period.get("datetime_end")
+        if start_str and end_str:
+            try:
+                self.start_ts = pytz.UTC.localize(datetime.strptime(start_str, PERIOD_FORMAT)).timestamp()
+                self.end_ts = pytz.UTC.localize(datetime.strptime(end_str, PERIOD_FORMAT)).timestamp()
+            except (ValueError, TypeError) as e:
+                print(f"Error parsing discount period: {e}")
+                self.period_valid = False
+        
+        self.schedule = _compile_schedule(discount.get("shedule", "* * * * *"))
+    
+    def is_within_period(self, current_time: datetime) -> bool:
+        if not self.period_valid:
+            return False
+        if self.start_ts is None:
+            return True
+        if current_time.tzinfo is None:
+            current_time = pytz.UTC.localize(current_time)
+        return self.start_ts <= current_time.timestamp() <= self.end_ts
+    
+    def is_active(self, current_time: datetime) -> bool:
+        return self.is_within_period(current_time) and self.schedule.matches(current_time)
+    
+    def next_change(self, timestamp: float) -> Optional[float]:
+        """Earliest epoch time from `timestamp` on at which is_active() may flip, None if it never does"""
+        if not self.period_valid:
+            return None
+        if self.start_ts is not None:
+            if timestamp < self.start_ts:
+                return self.start_ts
+            if timestamp > self.end_ts:
+                return None
+        # Schedules match whole minutes, so activity can only flip on a minute boundary
+        change = None if self.schedule.always else (timestamp // 60 + 1) * 60
+        if self.start_ts is not None:
+            change = self.end_ts if change is None else min(change, self.end_ts)
+        return change
+    
+    def pricing(self) -> Tuple[Decimal, Decimal]:
+        """(percent, cap) as Decimals, parsed once per compiled discount"""
+        if self.percent is None:
+            self.percent = Decimal(str(self.discount.get("percent", 0)))
+            self.cap = Decimal(str(self.discount.get("cap", "0")))
+        return self.percent, self.cap
+
+
+class CompiledDiscounts:
+    """Parsed and compiled form of a product's `discounts` metadata value"""
+    
+    __slots__ = ("discounts", "compiled")
+    
+    def __init__(self, discounts: List[Dict]):
+        self.discounts = discounts
+        self.compiled = tuple(
+            CompiledDiscount(discount) for discount in discounts if isinstance(discount, dict)
+        )
+    
+    def get_active_compiled(self, current_time: datetime = None) -> Optional[CompiledDiscount]:
+        """Get the first active compiled discount"""
+        if not self.compiled:
+            return None
+        if current_time is None:
+            current_time = datetime.now(pytz.UTC)
+        for compiled in self.compiled:
+            if compiled.is_active(current_time):
+                return compiled
+        return None
+    
+    def next_change(self, current_time: datetime) -> Optional[float]:
+        """Earliest epoch time at which the active discount may change, None if it never does"""
+        if current_time.tzinfo is None:
+            current_time = pytz.UTC.localize(current_time)
+        timestamp = current_time.timestamp()
+        changes = [
+            change for change in (compiled.next_change(timestamp) for compiled in self.compiled)
+            if change is not None
+        ]
+        return min(changes) if changes else None
+    
+    def get_active(self, current_time: datetime = None) -> Optional[Dict]:
+        """Get the first active discount (the returned dict is shared - do not mutate it)"""
+        compiled = self.get_active_compiled(current_time)
+        return compiled.discount if compiled else None
+
+
+@lru_cache(maxsize=1024)
+def _compile_schedule(schedule: str) -> CompiledSchedule:
+    return CompiledSchedule(schedule)
+
+
+@lru_cache(maxsize=4096)
+def _compile_discounts(discounts_json: str) -> CompiledDiscounts:
+    discounts = DiscountService.parse_discounts(discounts_json)
+    return CompiledDiscounts(discounts if isinstance(discounts, list) else [])
+
+
 class DiscountService:
     """Service for managing product discounts with cron scheduling"""
     
@@ -21,6 +240,25 @@ class DiscountService:
         """Format discounts list to JSON string"""
         return json.dumps(discounts, ensure_ascii=False)
     
+    @staticmethod
+    def extract_discounts_json(product: Optional[Dict]) -> str:
+        """Get the raw `discounts` metadata value of a Saleor product"""
+        if not product:
+            return ""
+        return next(
+            (meta["value"] for meta in product.get("metadata") or [] if meta["key"] == "discounts"),
+            ""
+        )
+    
+    @staticmethod
+    def compile_discounts(discounts_json: str) -> CompiledDiscounts:
+        """Parse and compile discounts metadata, cached by the metadata string"""
+        return _compile_discounts(discounts_json or "")
+    
+    def get_active_discount_from_json(self, discounts_json: str, current_time: datetime = None) -> Optional[Dict]:
+        """Get the first active discount straight from the `discounts` metadata string"""
+        return self.compile_discounts(discounts_json).get_active(current_time)
+    
     def get_active_discount(self, discounts: List[Dict], current_time: datetime = None) -> Optional[Dict]:
         """Get the first active discount based on period and cron schedule"""
         if not discounts:
@@ -37,64 +275,15 @@ class DiscountService:
     
     def _is_discount_active(self, discount: Dict, current_time: datetime) -> bool:
         """Check if discount is active based on period and cron schedule"""
-        # Check period
-        if not self._is_within_period(discount, current_time):
-            return False
-        
-        # Check cron schedule
-        return self._is_cron_active(discount, current_time)
+        return CompiledDiscount(discount).is_active(current_time)
     
     def _is_within_period(self, discount: Dict, current_time: datetime) -> bool:
         """Check if current time is within discount period"""
-        period = discount.get("period", {})
-        
-        # If no period specified, discount is always valid by period
-        if not period:
-            return True
-        
-        start_str = period.get("datetime_start")
-        end_str = period.get("datetime_end")
-        
-        if not start_str or not end_str:
-            return True
-        
-        try:
-            # Parse dates - format: DD-MM-YYYYTHH:MM:SSZ
-            start_date = datetime.strptime(start_str, "%d-%m-%YT%H:%M:%SZ")
-            end_date = datetime.strptime(end_str, "%d-%m-%YT%H:%M:%SZ")
-            
-            # Make timezone aware
-            start_date = pytz.UTC.localize(start_date) if start_date.tzinfo is None else start_date
-            end_date = pytz.UTC.localize(end_date) if end_date.tzinfo is None else end_date
-            
-            return start_date <= current_time <= end_date
-            
-        except (ValueError, TypeError) as e:
-            print(f"Error parsing discount period: {e}")
-            return False
+        return CompiledDiscount(discount).is_within_period(current_time)
     
     def _is_cron_active(self, discount: Dict, current_time: datetime) -> bool:
         """Check if current time matches cron schedule"""
-        schedule = discount.get("shedule", "* * * * *")  # Default: always active
-        
-        try:
-            # Create croniter instance
-            cron = croniter(schedule, current_time)
-            
-            # Check if current time matches the cron expression
-            # We check if the current minute matches the cron schedule
-            current_minute = current_time.replace(second=0, microsecond=0)
-            next_run = cron.get_next(datetime)
-            prev_run = cron.get_prev(datetime)
-            
-            # If current time is within the same minute as a scheduled run, it's active
-            return (abs((current_minute - prev_run).total_seconds()) < 60 or
-                   abs((current_minute - next_run).total_seconds()) < 60)
-            
-        except (ValueError, TypeError) as e:
-            print(f"Error parsing cron schedule '{schedule}': {e}")
-            # If cron parsing fails, default to active
-            return True
+        return _compile_schedule(discount.get("shedule", "* * * * *")).matches(current_time)
     
     def apply_discount(self, base_price: Decimal, discount: Dict) -> Decimal:
         """Apply discount to base price with cap consideration"""
@@ -153,13 +342,13 @@ class DiscountService:
             
             if start_str:
                 try:
-                    datetime.strptime(start_str, "%d-%m-%YT%H:%M:%SZ")
+                    datetime.strptime(start_str, PERIOD_FORMAT)
                 except ValueError:
                     errors.append(f"Invalid datetime_start format: {start_str}")
             
             if end_str:
                 try:
-                    datetime.strptime(end_str, "%d-%m-%YT%H:%M:%SZ")
+                    datetime.strptime(end_str, PERIOD_FORMAT)
                 except ValueError:
                     errors.append(f"Invalid datetime_end format: {end_str}")
         
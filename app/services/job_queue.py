@@ -0,0 +1,539 @@
+import asyncio
+import collections
+import json
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from app.core.config import settings
+
+JobHandler = Callable[..., Awaitable[None]]
+
+# Сколько отложенных повторов переносится в поток за один проход
+DELAYED_BATCH = 100
+
+# Как часто (доля WEBHOOK_JOB_VISIBILITY_TIMEOUT) воркер продлевает сообщение выполняемой задачи
+LEASE_RENEW_FRACTION = 1 / 3
+
+# Продлевает окно склейки ключа, но не дальше первого события + max_delay.
+# Возвращает 1, если событие открыло новое окно.
+DEBOUNCE_SCRIPT = """
+local first = redis.call("hget", KEYS[2], ARGV[1])
+local opened = 0
+if not first then
+    first = ARGV[2]
+    opened = 1
+    redis.call("hset", KEYS[2], ARGV[1], first)
+end
+local due = math.min(tonumber(ARGV[2]) + tonumber(ARGV[3]), tonumber(first) + tonumber(ARGV[4]))
+redis.call("zadd", KEYS[1], due, ARGV[1])
+redis.call("hset", KEYS[3], ARGV[1], ARGV[5])
+return opened
+"""
+
+# Переносит задачу закрывшегося окна в поток (KEYS[4]) одной атомарной операцией:
+# окно не может исчезнуть без XADD. Возвращает 1, если задачу поставил этот вызов.
+DEBOUNCE_POP_SCRIPT = """
+local due = redis.call("zscore", KEYS[1], ARGV[1])
+if not due or tonumber(due) > tonumber(ARGV[2]) then
+    return 0
+end
+local fields = redis.call("hget", KEYS[3], ARGV[1])
+redis.call("zrem", KEYS[1], ARGV[1])
+redis.call("hdel", KEYS[2], ARGV[1])
+redis.call("hdel", KEYS[3], ARGV[1])
+if not fields then
+    return 0
+end
+local args = {}
+for field, value in pairs(cjson.decode(fields)) do
+    table.insert(args, field)
+    table.insert(args, value)
+end
+redis.call("xadd", KEYS[4], "MAXLEN", "~", ARGV[3], "*", unpack(args))
+return 1
+"""
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+class Job:
+    """Задача очереди: тип, параметры обработчика и номер попытки"""
+
+    __slots__ = ("job_id", "type", "payload", "attempt", "message_id")
+
+    def __init__(self, job_type: str, payload: dict, attempt: int = 1,
+                 job_id: Optional[str] = None, message_id: Optional[str] = None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.type = job_type
+        self.payload = payload
+        self.attempt = attempt
+        # id сообщения в Redis Stream (только для Redis-бэкенда)
+        self.message_id = message_id
+
+    def fields(self) -> Dict[str, str]:
+        return {
+            "job_id": self.job_id,
+            "type": self.type,
+            "payload": json.dumps(self.payload),
+            "attempt": str(self.attempt),
+        }
+
+    @classmethod
+    def from_fields(cls, fields: dict, message_id: Optional[str] = None) -> "Job":
+        fields = {_decode(key): _decode(value) for key, value in fields.items()}
+        return cls(
+            fields.get("type", ""),
+            json.loads(fields.get("payload") or "{}"),
+            int(fields.get("attempt") or 1),
+            fields.get("job_id"),
+            message_id
+        )
+
+
+class JobQueue:
+    """Очередь фоновых задач вебхуков с пулом воркеров.
+
+    Основной бэкенд - Redis Streams с consumer group: задачи переживают
+    перезапуск, а сообщения упавшего воркера забираются другими через
+    XAUTOCLAIM после WEBHOOK_JOB_VISIBILITY_TIMEOUT. Пока задача выполняется,
+    воркер продлевает ее сообщение (XCLAIM JUSTID сбрасывает время простоя),
+    поэтому долгая задача не отдается второму воркеру. Без Redis работает
+    локальная asyncio-очередь с тем же поведением, но без надежности; при
+    остановке ее задачи переносятся в поток Redis, если он доступен, иначе
+    пишутся в лог. Неудачные задачи повторяются с экспоненциальной задержкой,
+    после WEBHOOK_JOB_MAX_ATTEMPTS попыток уходят в dead-letter поток.
+
+    Доставка - at-least-once: задача, чей воркер упал (или не смог продлить
+    сообщение) до подтверждения, выполнится еще раз, поэтому обработчики
+    должны быть идемпотентными.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, JobHandler] = {}
+        self._dead_letter_handlers: Dict[str, JobHandler] = {}
+        self._workers: List[asyncio.Task] = []
+        self._maintenance: Optional[asyncio.Task] = None
+        self._local: Optional[asyncio.Queue] = None
+        # Локальные отложенные повторы: id задачи -> (таймер, задача)
+        self._local_delayed: Dict[str, Tuple[asyncio.TimerHandle, Job]] = {}
+        self._local_dead: collections.deque = collections.deque(maxlen=1000)
+        self._in_flight = 0
+        self.backend = "local"
+        self.consumer_prefix = f"{socket.gethostname()}:{os.getpid()}"
+        self.enqueued = 0
+        self.processed = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.reclaimed = 0
+        self.enqueue_fallbacks = 0
+        self.debounced_events = 0
+        self.coalesced_events = 0
+        # Локальные окна склейки: ключ -> [первое событие, таймер, задача]
+        self._local_debounce: Dict[str, list] = {}
+
+    @property
+    def redis(self):
+        # Общее подключение с кэшем наценок
+        from app.services.markup_service import markup_service
+        return markup_service.redis
+
+    @property
+    def stream(self) -> str:
+        return settings.WEBHOOK_QUEUE_STREAM
+
+    @property
+    def dead_letter_stream(self) -> str:
+        return f"{settings.WEBHOOK_QUEUE_STREAM}:dead"
+
+    @property
+    def delayed_key(self) -> str:
+        return f"{settings.WEBHOOK_QUEUE_STREAM}:delayed"
+
+    def _debounce_keys(self) -> List[str]:
+        # Срок окна (zset), время первого события и последняя задача ключа
+        base = f"{settings.WEBHOOK_QUEUE_STREAM}:debounce"
+        return [base, f"{base}:first", f"{base}:job"]
+
+    def register(self, job_type: str, handler: JobHandler, on_dead_letter: Optional[JobHandler] = None):
+        """Регистрирует обработчик: handler(**payload).
+
+        on_dead_letter(error, **payload) вызывается, когда задача исчерпала
+        попытки и ушла в dead-letter (например, чтобы пометить ее состояние).
+        """
+        self._handlers[job_type] = handler
+        if on_dead_letter is not None:
+            self._dead_letter_handlers[job_type] = on_dead_letter
+
+    def _local_queue(self) -> asyncio.Queue:
+        if self._local is None:
+            self._local = asyncio.Queue()
+        return self._local
+
+    async def enqueue(self, job_type: str, **payload) -> str:
+        """Ставит задачу в очередь; один XADD, без ожидания выполнения"""
+        job = Job(job_type, payload)
+        if self.backend == "redis":
+            try:
+                await self.redis.xadd(
+                    self.stream, job.fields(), maxlen=settings.WEBHOOK_QUEUE_MAXLEN, approximate=True
+                )
+                self.enqueued += 1
+                return job.job_id
+            except Exception as e:
+                # Redis недоступен - не теряем задачу, выполняем ее в этом процессе
+                self.enqueue_fallbacks += 1
+                print(f"Job queue: Redis enqueue failed, running {job_type} locally: {e}")
+        self._local_queue().put_nowait(job)
+        self.enqueued += 1
+        return job.job_id
+
+    async def enqueue_debounced(self, job_type: str, key: str, window: float, max_delay: float, **payload):
+        """Ставит задачу после окна склейки: события с тем же ключом внутри окна
+        дают одно выполнение с параметрами последнего события.
+
+        Каждое событие продлевает окно на `window` секунд, но задача уйдет в
+        очередь не позже чем через `max_delay` после первого события окна.
+        """
+        if window <= 0:
+            return await self.enqueue(job_type, **payload)
+        member = f"{job_type}:{key}"
+        job = Job(job_type, payload)
+        self.debounced_events += 1
+        if self.backend == "redis":
+            try:
+                opened = await self.redis.eval(
+                    DEBOUNCE_SCRIPT, 3, *self._debounce_keys(),
+                    member, time.time(), window, max(window, max_delay), json.dumps(job.fields())
+                )
+                if not opened:
+                    self.coalesced_events += 1
+                return job.job_id
+            except Exception as e:
+                self.enqueue_fallbacks += 1
+                print(f"Job queue: Redis debounce failed, debouncing {job_type} locally: {e}")
+        self._debounce_local(member, job, window, max(window, max_delay))
+        return job.job_id
+
+    def _debounce_local(self, member: str, job: Job, window: float, max_delay: float):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        entry = self._local_debounce.get(member)
+        if entry is None:
+            entry = self._local_debounce[member] = [now, None, job]
+        else:
+            self.coalesced_events += 1
+            entry[1].cancel()
+            entry[2] = job
+        due = min(now + window, entry[0] + max_delay)
+
+        def flush():
+            self._local_debounce.pop(member, None)
+            self._local_queue().put_nowait(entry[2])
+            self.enqueued += 1
+
+        entry[1] = loop.call_at(due, flush)
+
+    async def _flush_debounced(self):
+        """Ставит в поток задачи, у которых закрылось окно склейки"""
+        keys = self._debounce_keys()
+        now = time.time()
+        due = await self.redis.zrangebyscore(keys[0], 0, now, start=0, num=DELAYED_BATCH)
+        for member in due:
+            if await self.redis.eval(
+                DEBOUNCE_POP_SCRIPT, 4, *keys, self.stream, member, now, settings.WEBHOOK_QUEUE_MAXLEN
+            ):
+                self.enqueued += 1
+
+    # --- Обработка ---
+
+    def _backoff(self, attempt: int) -> float:
+        return min(settings.WEBHOOK_RETRY_BACKOFF * (2 ** (attempt - 1)), settings.WEBHOOK_RETRY_BACKOFF_MAX)
+
+    async def _run(self, job: Job) -> Optional[str]:
+        """Выполняет задачу; возвращает текст ошибки или None"""
+        handler = self._handlers.get(job.type)
+        if handler is None:
+            return f"No handler for job type {job.type}"
+        self._in_flight += 1
+        try:
+            await handler(**job.payload)
+            self.processed += 1
+            return None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return str(e) or e.__class__.__name__
+        finally:
+            self._in_flight -= 1
+
+    async def _notify_dead_letter(self, job: Job, error: str):
+        callback = self._dead_letter_handlers.get(job.type)
+        if callback is None:
+            return
+        try:
+            await callback(error, **job.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Dead-letter handler of job {job.type} {job.job_id} failed: {e}")
+
+    async def _dead_letter_redis(self, job: Job, error: str):
+        await self.redis.xadd(
+            self.dead_letter_stream, {**job.fields(), "error": error, "failed_at": str(time.time())},
+            maxlen=settings.WEBHOOK_QUEUE_MAXLEN, approximate=True
+        )
+        self.dead_lettered += 1
+        print(f"Job {job.type} {job.job_id} moved to dead-letter stream: {error}")
+        await self._notify_dead_letter(job, error)
+
+    async def _ack_redis(self, job: Job):
+        await self.redis.xack(self.stream, settings.WEBHOOK_QUEUE_GROUP, job.message_id)
+        await self.redis.xdel(self.stream, job.message_id)
+
+    async def _keep_claimed(self, job: Job, consumer: str):
+        """Продлевает сообщение выполняемой задачи, чтобы _reclaim_stale не отдал его другому воркеру"""
+        while True:
+            await asyncio.sleep(settings.WEBHOOK_JOB_VISIBILITY_TIMEOUT * LEASE_RENEW_FRACTION)
+            try:
+                # XCLAIM своим же consumer сбрасывает время простоя сообщения
+                await self.redis.xclaim(
+                    self.stream, settings.WEBHOOK_QUEUE_GROUP, consumer, 0, [job.message_id], justid=True
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Failed to extend job {job.type} {job.job_id}: {e}")
+
+    async def _process_redis(self, job: Job, consumer: Optional[str] = None):
+        lease = asyncio.create_task(self._keep_claimed(job, consumer)) if consumer else None
+        try:
+            error = await self._run(job)
+        finally:
+            if lease is not None:
+                lease.cancel()
+        if error is not None:
+            if job.type in self._handlers and job.attempt < settings.WEBHOOK_JOB_MAX_ATTEMPTS:
+                retry = Job(job.type, job.payload, job.attempt + 1, job.job_id)
+                delay = self._backoff(job.attempt)
+                await self.redis.zadd(self.delayed_key, {json.dumps(retry.fields()): time.time() + delay})
+                self.retried += 1
+                print(f"Job {job.type} {job.job_id} failed (attempt {job.attempt}), retry in {delay:.1f}s: {error}")
+            else:
+                await self._dead_letter_redis(job, error)
+        # Повтор уже запланирован отдельной записью - исходное сообщение подтверждаем и удаляем
+        await self._ack_redis(job)
+
+    async def _redis_worker(self, consumer: str):
+        delay = 1.0
+        while True:
+            try:
+                response = await self.redis.xreadgroup(
+                    settings.WEBHOOK_QUEUE_GROUP, consumer, {self.stream: ">"},
+                    count=1, block=settings.WEBHOOK_QUEUE_BLOCK_MS
+                )
+                for _, messages in response or []:
+                    for message_id, fields in messages:
+                        await self._process_redis(Job.from_fields(fields, _decode(message_id)), consumer)
+                delay = 1.0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job queue worker {consumer} error: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def _promote_delayed(self):
+        """Переносит в поток повторы, у которых подошло время"""
+        due = await self.redis.zrangebyscore(self.delayed_key, 0, time.time(), start=0, num=DELAYED_BATCH)
+        for member in due:
+            # Забирает только тот процесс, чей ZREM удалил запись
+            if await self.redis.zrem(self.delayed_key, member):
+                job = Job.from_fields(json.loads(member))
+                await self.redis.xadd(
+                    self.stream, job.fields(), maxlen=settings.WEBHOOK_QUEUE_MAXLEN, approximate=True
+                )
+
+    async def _reclaim_stale(self, consumer: str):
+        """Возвращает в поток сообщения воркеров, которые взяли их и не подтвердили (упали).
+
+        Задачи не выполняются здесь: новой записью в потоке их заберет пул
+        воркеров, а цикл обслуживания не блокируется долгими задачами.
+        Падение воркера считается попыткой, чтобы задача, роняющая процесс,
+        в итоге ушла в dead-letter.
+        """
+        result = await self.redis.xautoclaim(
+            self.stream, settings.WEBHOOK_QUEUE_GROUP, consumer,
+            min_idle_time=int(settings.WEBHOOK_JOB_VISIBILITY_TIMEOUT * 1000),
+            start_id="0-0", count=DELAYED_BATCH
+        )
+        messages = result[1] if result and len(result) > 1 else []
+        for message_id, fields in messages:
+            job = Job.from_fields(fields or {}, _decode(message_id))
+            if fields:
+                self.reclaimed += 1
+                if job.attempt < settings.WEBHOOK_JOB_MAX_ATTEMPTS:
+                    retry = Job(job.type, job.payload, job.attempt + 1, job.job_id)
+                    await self.redis.xadd(
+                        self.stream, retry.fields(), maxlen=settings.WEBHOOK_QUEUE_MAXLEN, approximate=True
+                    )
+                else:
+                    await self._dead_letter_redis(job, "Worker stopped before acknowledging the job")
+            # Записи без полей (удалены из потока) просто подтверждаем
+            await self._ack_redis(job)
+
+    async def _redis_maintenance(self):
+        consumer = f"{self.consumer_prefix}:maintenance"
+        while True:
+            try:
+                await self._promote_delayed()
+                await self._flush_debounced()
+                await self._reclaim_stale(consumer)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job queue maintenance error: {e}")
+            await asyncio.sleep(settings.WEBHOOK_QUEUE_POLL_INTERVAL)
+
+    def _schedule_local_retry(self, job: Job, delay: float):
+        def put():
+            self._local_delayed.pop(job.job_id, None)
+            self._local_queue().put_nowait(job)
+
+        self._local_delayed[job.job_id] = (asyncio.get_running_loop().call_later(delay, put), job)
+
+    async def _local_worker(self):
+        queue = self._local_queue()
+        while True:
+            job = await queue.get()
+            try:
+                error = await self._run(job)
+                if error is None:
+                    continue
+                if job.type in self._handlers and job.attempt < settings.WEBHOOK_JOB_MAX_ATTEMPTS:
+                    self.retried += 1
+                    self._schedule_local_retry(Job(job.type, job.payload, job.attempt + 1, job.job_id),
+                                               self._backoff(job.attempt))
+                else:
+                    self.dead_lettered += 1
+                    self._local_dead.append({**job.fields(), "error": error, "failed_at": str(time.time())})
+                    print(f"Job {job.type} {job.job_id} moved to dead-letter queue: {error}")
+                    await self._notify_dead_letter(job, error)
+            finally:
+                queue.task_done()
+
+    # --- Жизненный цикл ---
+
+    async def _ensure_group(self) -> bool:
+        if not self.redis:
+            return False
+        try:
+            await self.redis.xgroup_create(self.stream, settings.WEBHOOK_QUEUE_GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                print(f"Job queue: Redis Streams unavailable, using local queue: {e}")
+                return False
+        return True
+
+    async def start(self):
+        """Запускает пул воркеров (вызывается при старте приложения)"""
+        if self._workers:
+            return
+        self.backend = "redis" if await self._ensure_group() else "local"
+        concurrency = max(1, settings.WEBHOOK_WORKER_CONCURRENCY)
+        if self.backend == "redis":
+            self._workers = [
+                asyncio.create_task(self._redis_worker(f"{self.consumer_prefix}:{index}"))
+                for index in range(concurrency)
+            ]
+            self._maintenance = asyncio.create_task(self._redis_maintenance())
+        # Локальные воркеры есть всегда: в них выполняются задачи, если Redis отказал при постановке
+        self._workers += [asyncio.create_task(self._local_worker()) for _ in range(concurrency)]
+
+    async def stop(self):
+        tasks = self._workers + ([self._maintenance] if self._maintenance else [])
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        # Задачи, которые еще ждут в этом процессе: окна склейки, отложенные повторы и очередь
+        remaining = []
+        for _, timer, job in self._local_debounce.values():
+            timer.cancel()
+            remaining.append(job)
+        for timer, job in self._local_delayed.values():
+            timer.cancel()
+            remaining.append(job)
+        while self._local is not None and not self._local.empty():
+            remaining.append(self._local.get_nowait())
+        await self._hand_over(remaining)
+        self._local_debounce.clear()
+        self._local_delayed.clear()
+        self._workers = []
+        self._maintenance = None
+        self._local = None
+        self.backend = "local"
+
+    async def _hand_over(self, jobs: List[Job]):
+        """Локальные задачи при остановке: в поток Redis, если он доступен, иначе - в лог"""
+        redis_available = bool(self.redis)
+        moved = 0
+        for job in jobs:
+            if redis_available:
+                try:
+                    await self.redis.xadd(
+                        self.stream, job.fields(), maxlen=settings.WEBHOOK_QUEUE_MAXLEN, approximate=True
+                    )
+                    moved += 1
+                    continue
+                except Exception as e:
+                    redis_available = False
+                    print(f"Job queue: failed to move local jobs to Redis on shutdown: {e}")
+            print(f"Job {job.type} {job.job_id} dropped on shutdown (attempt {job.attempt}): {job.payload}")
+        if moved:
+            print(f"Job queue: moved {moved} local job(s) to the Redis stream on shutdown")
+
+    async def stats(self) -> dict:
+        """Глубина очереди и счетчики обработки"""
+        stats = {
+            "backend": self.backend,
+            "workers": sum(1 for task in self._workers if not task.done()),
+            "in_flight": self._in_flight,
+            "local_depth": self._local.qsize() if self._local is not None else 0,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+            "reclaimed": self.reclaimed,
+            "enqueue_fallbacks": self.enqueue_fallbacks,
+            "debounced_events": self.debounced_events,
+            "coalesced_events": self.coalesced_events,
+        }
+        if self.backend == "redis":
+            try:
+                pending = await self.redis.xpending(self.stream, settings.WEBHOOK_QUEUE_GROUP)
+                stats.update({
+                    # Подтвержденные сообщения удаляются: длина потока = ждут + в работе
+                    "depth": await self.redis.xlen(self.stream),
+                    "pending": (pending or {}).get("pending", 0),
+                    "delayed": await self.redis.zcard(self.delayed_key),
+                    "dead_letter": await self.redis.xlen(self.dead_letter_stream),
+                    "debouncing": await self.redis.zcard(self._debounce_keys()[0]),
+                })
+            except Exception as e:
+                stats["error"] = str(e)
+        else:
+            stats.update({
+                "depth": stats["local_depth"],
+                "pending": self._in_flight,
+                "delayed": len(self._local_delayed),
+                "dead_letter": len(self._local_dead),
+                "debouncing": len(self._local_debounce),
+            })
+        return stats
+
+job_queue = JobQueue()
@@ -1,85 +1,347 @@
 from decimal import Decimal
-from typing import Dict, Optional
+from typing import Dict, Iterable, Optional
+import asyncio
 import json
+import time
+import uuid
 from app.core.config import settings
-from app.saleor.api import get_channel, update_channel_metadata
+from app.core.cache import TTLCache
+from app.saleor.singleflight import SingleFlight
+from app.saleor.api import get_channel, get_channels_by_ids, update_channel_metadata
+
+# Канал Redis pub/sub для инвалидации L1-кэшей всех воркеров
+MARKUP_INVALIDATION_CHANNEL = "price_manager:markup_invalidate"
+
+# Значение в кэше для канала без наценки в метаданных (негативное кэширование)
+NO_MARKUP = "none"
+
+# Как часто проверять Redis, пока ключ пересчитывает другой воркер
+MARKUP_LOCK_POLL_INTERVAL = 0.05
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+def _decode_markup(cached: str) -> Decimal:
+    return Decimal('0') if cached == NO_MARKUP else Decimal(cached)
+
+def _markup_from_channel(channel: Optional[dict]) -> Optional[str]:
+    """Наценка из метаданных канала; NO_MARKUP, если ключа нет; None, если канала нет"""
+    if not channel:
+        return None
+    for item in channel.get("metadata") or []:
+        if item["key"] == "price_markup_percent":
+            return str(Decimal(item["value"]))
+    return NO_MARKUP
 
 class MarkupService:
     def __init__(self):
-        # Временно отключаем Redis для demo-режима
-        self._cache = {}  # Простой in-memory кэш
+        # L1: LRU с TTL в памяти процесса, L2: Redis (общий для всех воркеров)
+        self._local = TTLCache(maxsize=settings.MARKUP_L1_MAX_SIZE, ttl=settings.MARKUP_L1_TTL)
+        # Поколение инвалидаций: не кладем в L1 значение, прочитанное до инвалидации
+        self._generation = 0
+        self._worker_id = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+        self._single_flight = SingleFlight()
+        self.invalidations_received = 0
+        self.lock_wait_timeouts = 0
         try:
             import redis.asyncio as redis
             self.redis = redis.from_url(settings.REDIS_URL)
         except:
             print("Redis not available, using in-memory cache")
             self.redis = None
-        
+            
     async def get_channel_markup(self, channel_id: str) -> Optional[Decimal]:
         """Получить процент наценки для канала"""
         cache_key = f"channel_markup:{channel_id}"
         
-        # Пробуем получить из кэша
+        # L1: без сетевых вызовов
+        cached = self._local.get(cache_key)
+        if cached is not None:
+            return _decode_markup(cached)
+            
+        generation = self._generation
+        
+        # L2: Redis
         if self.redis:
             try:
                 cached = await self.redis.get(cache_key)
                 if cached:
-                    return Decimal(cached.decode())
+                    cached = cached.decode()
+                    self._store_local(cache_key, cached, generation)
+                    return _decode_markup(cached)
             except:
                 pass
-        else:
-            # Используем in-memory кэш
-            if cache_key in self._cache:
-                return Decimal(self._cache[cache_key])
+                
+        # Если нет в кэше, получаем из Saleor: один запрос на процесс (single-flight)
+        # и одна блокировка в Redis на все воркеры
+        return await self._single_flight.do(
+            channel_id, lambda: self._load_channel_markup(channel_id, generation)
+        )
+        
+    async def _load_channel_markup(self, channel_id: str, generation: int) -> Decimal:
+        cache_key = f"channel_markup:{channel_id}"
+        lock_token = await self._acquire_lock(cache_key)
+        if lock_token is None:
+            # Значение пересчитывает другой воркер - ждем его результат в Redis
+            cached = await self._wait_for_value(cache_key)
+            if cached is not None:
+                self._store_local(cache_key, cached, generation)
+                return _decode_markup(cached)
+                
+        try:
+            if lock_token:
+                # Предыдущий владелец блокировки мог только что заполнить кэш - перечитываем Redis
+                try:
+                    cached = await self.redis.get(cache_key)
+                except:
+                    cached = None
+                if cached:
+                    cached = cached.decode()
+                    self._store_local(cache_key, cached, generation)
+                    return _decode_markup(cached)
+                    
+            channel = await get_channel(channel_id)
+            cached = _markup_from_channel(channel)
+            if cached is None:
+                # Канал не найден или Saleor вернул ошибку - не кэшируем
+                return Decimal('0')
+                
+            # Кэшируем результат (отсутствие наценки - с отдельным TTL)
+            ttl = 3600 if cached != NO_MARKUP else settings.MARKUP_NEGATIVE_TTL
+            if self.redis:
+                try:
+                    await self.redis.set(cache_key, cached, ex=ttl)
+                except:
+                    pass
+            self._store_local(cache_key, cached, generation, ttl)
+            return _decode_markup(cached)
+        finally:
+            if lock_token is not None:
+                await self._release_lock(cache_key, lock_token)
+                
+    async def _acquire_lock(self, cache_key: str) -> Optional[str]:
+        """Блокировка на пересчет ключа; без Redis блокировать нечего"""
+        if not self.redis:
+            return ""
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis.set(
+                f"lock:{cache_key}", token, nx=True, ex=settings.MARKUP_LOCK_TTL
+            )
+        except:
+            # Redis недоступен - идем в Saleor сами
+            return ""
+        return token if acquired else None
+        
+    async def _release_lock(self, cache_key: str, token: str):
+        if not token:
+            return
+        try:
+            # Удаляем только свою блокировку: чужую могли взять после истечения нашей
+            await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:{cache_key}", token)
+        except:
+            pass
             
-        # Если нет в кэше, получаем из Saleor
-        channel = await get_channel(channel_id)
-        if channel and "metadata" in channel:
-            for item in channel["metadata"]:
-                if item["key"] == "price_markup_percent":
-                    markup = Decimal(item["value"])
-                    # Кэшируем результат
-                    if self.redis:
-                        try:
-                            await self.redis.set(cache_key, str(markup), ex=3600)
-                        except:
-                            pass
-                    else:
-                        self._cache[cache_key] = str(markup)
-                    return markup
+    async def _wait_for_value(self, cache_key: str) -> Optional[str]:
+        deadline = time.monotonic() + settings.MARKUP_LOCK_WAIT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(MARKUP_LOCK_POLL_INTERVAL)
+            try:
+                cached = await self.redis.get(cache_key)
+            except:
+                return None
+            if cached:
+                return cached.decode()
+        self.lock_wait_timeouts += 1
+        return None
+        
+    async def get_cached_markups(self, channel_ids: Iterable[str]) -> Dict[str, Decimal]:
+        """Наценки каналов из кэша: L1, затем один MGET в Redis для остальных.
+        Каналы, которых нет ни в одном кэше, в результат не попадают."""
+        result = {}
+        missing = []
+        for channel_id in dict.fromkeys(channel_ids):
+            cached = self._local.get(f"channel_markup:{channel_id}")
+            if cached is not None:
+                result[channel_id] = _decode_markup(cached)
+            else:
+                missing.append(channel_id)
+                
+        if missing and self.redis:
+            generation = self._generation
+            keys = [f"channel_markup:{channel_id}" for channel_id in missing]
+            try:
+                values = await self.redis.mget(keys)
+            except:
+                values = []
+            for channel_id, cache_key, cached in zip(missing, keys, values):
+                if cached:
+                    cached = cached.decode()
+                    self._store_local(cache_key, cached, generation)
+                    result[channel_id] = _decode_markup(cached)
                     
-        return Decimal('0')
+        return result
+        
+    async def get_channel_markups(self, channel_ids: Iterable[str]) -> Dict[str, Decimal]:
+        """Наценки нескольких каналов: L1 + один MGET, промахи - одним пакетным
+        запросом в Saleor и одной записью в Redis через pipeline"""
+        channel_ids = list(dict.fromkeys(channel_ids))
+        result = await self.get_cached_markups(channel_ids)
+        
+        missing = [channel_id for channel_id in channel_ids if channel_id not in result]
+        if not missing:
+            return result
+            
+        generation = self._generation
+        channels = await get_channels_by_ids(missing)
+        fetched = {}
+        for channel_id in missing:
+            cached = _markup_from_channel(channels.get(channel_id))
+            result[channel_id] = Decimal('0') if cached is None else _decode_markup(cached)
+            if cached is not None:
+                fetched[channel_id] = cached
+                
+        # Кэшируем результат (отсутствие наценки - с отдельным TTL)
+        if fetched and self.redis:
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for channel_id, cached in fetched.items():
+                    ttl = 3600 if cached != NO_MARKUP else settings.MARKUP_NEGATIVE_TTL
+                    pipe.set(f"channel_markup:{channel_id}", cached, ex=ttl)
+                await pipe.execute()
+            except:
+                pass
+        for channel_id, cached in fetched.items():
+            ttl = None if cached != NO_MARKUP else settings.MARKUP_NEGATIVE_TTL
+            self._store_local(f"channel_markup:{channel_id}", cached, generation, ttl)
+            
+        return result
+        
+    def remember_markups(self, markups: Dict[str, Decimal]):
+        """Кладет в L1 наценки, только что прочитанные из метаданных каналов Saleor"""
+        generation = self._generation
+        for channel_id, markup in markups.items():
+            self._store_local(f"channel_markup:{channel_id}", str(markup), generation)
         
     async def set_channel_markup(self, channel_id: str, markup_percent: Decimal) -> bool:
         """Установить процент наценки для канала"""
         # Обновляем в Saleor
         success = await update_channel_metadata(
-            channel_id, 
+            channel_id,
             [{"key": "price_markup_percent", "value": str(markup_percent)}]
         )
         
         if success:
             # Обновляем кэш
             cache_key = f"channel_markup:{channel_id}"
+            self._generation += 1
             if self.redis:
                 try:
                     await self.redis.set(cache_key, str(markup_percent), ex=3600)
                 except:
                     pass
-            else:
-                self._cache[cache_key] = str(markup_percent)
+            self._local.set(cache_key, str(markup_percent))
+            await self._publish_invalidation(channel_id)
             
         return success
         
     async def invalidate_cache(self, channel_id: str):
         """Инвалидировать кэш для канала"""
         cache_key = f"channel_markup:{channel_id}"
+        self._drop_local(cache_key)
         if self.redis:
             try:
                 await self.redis.delete(cache_key)
             except:
                 pass
-        else:
-            self._cache.pop(cache_key, None)
+        await self._publish_invalidation(channel_id)
+        
+    def _store_local(self, cache_key: str, value: str, generation: int, ttl: Optional[float] = None):
+        """Кладет значение в L1, если за время чтения не пришла инвалидация"""
+        if generation == self._generation:
+            if ttl is not None:
+                ttl = min(ttl, self._local.ttl)
+            self._local.set(cache_key, value, ttl)
+            
+    def _drop_local(self, cache_key: str):
+        self._generation += 1
+        self._local.pop(cache_key)
+        
+    async def _publish_invalidation(self, channel_id: str):
+        """Сообщает остальным воркерам, что их L1-запись для канала устарела"""
+        if not self.redis:
+            return
+        message = json.dumps({"channel_id": channel_id, "origin": self._worker_id})
+        try:
+            await self.redis.publish(MARKUP_INVALIDATION_CHANNEL, message)
+        except Exception as e:
+            print(f"Failed to publish markup invalidation: {e}")
+            
+    def _handle_invalidation(self, data) -> None:
+        if isinstance(data, bytes):
+            data = data.decode()
+        try:
+            message = json.loads(data)
+        except (TypeError, ValueError):
+            return
+        # Свое сообщение пропускаем: локальный L1 уже обновлен
+        if message.get("origin") == self._worker_id:
+            return
+        self.invalidations_received += 1
+        self._drop_local(f"channel_markup:{message.get('channel_id')}")
+        
+    async def _listen_invalidations(self):
+        """Подписка на инвалидации с переподключением при обрыве"""
+        delay = 1.0
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(MARKUP_INVALIDATION_CHANNEL)
+                # Пока подписки не было, сообщения могли потеряться - сбрасываем L1
+                self._generation += 1
+                self._local.clear()
+                delay = 1.0
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self._handle_invalidation(message.get("data"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Markup invalidation listener error: {e}")
+            finally:
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+            
+    def start_invalidation_listener(self):
+        """Запускает фоновую подписку на инвалидации (вызывается при старте приложения)"""
+        if self.redis and self._listener is None:
+            self._listener = asyncio.create_task(self._listen_invalidations())
+            
+    async def stop_invalidation_listener(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listener = None
+            
+    def stats(self) -> dict:
+        return {
+            "l1": self._local.stats(),
+            "invalidations_received": self.invalidations_received,
+            "lock_wait_timeouts": self.lock_wait_timeouts,
+            "single_flight": self._single_flight.stats(),
+            "listening": self._listener is not None and not self._listener.done(),
+        }
 
 markup_service = MarkupService()
@@ -1,9 +1,11 @@
 # Это файл-обертка Python, который будет вызывать Rust-библиотеку
+from array import array
 from decimal import Decimal
+from typing import List, Optional, Sequence
 import asyncio
-from app.services.markup_service import markup_service
-from app.services.discount_service import discount_service
-from app.saleor.api import get_product
+from app.core.config import settings
+from app.services.discount_service import CompiledDiscount
+from app.services.pricing_context import PricingContext
 
 # Импортируем Rust-модуль
 try:
@@ -31,87 +33,158 @@ def _python_calculate_price(base_price: str, markup_percent: str) -> str:
     # Round to 2 decimal places and format consistently
     return "{:.2f}".format(final_price.quantize(Decimal('0.01')))
 
-async def calculate_price_with_markup(product_id: str, channel_id: str, base_price: Decimal) -> Decimal:
+def _python_calculate_final_price(base_price: str, markup_percent: str, discount_percent: str,
+                                  discount_cap: str, discount_active: bool) -> str:
     """
-    Рассчитывает итоговую цену продукта с учетом наценки канала и активных скидок
-    Использует Rust для высокой производительности или Python fallback
+    Pure Python fallback for the Rust calculate_final_price: markup, then discount with cap
     """
-    # Получаем наценку для канала
-    markup_percent = await markup_service.get_channel_markup(channel_id)
+    final_price = Decimal(_python_calculate_price(base_price, markup_percent))
     
-    # Получаем данные продукта и его скидки
-    product = await get_product(product_id)
-    discounts_json = ""
-    if product and product.get("metadata"):
-        discounts_json = next(
-            (meta["value"] for meta in product["metadata"] if meta["key"] == "discounts"),
-            ""
-        )
+    if discount_active:
+        final_price = _python_apply_discount(final_price, Decimal(discount_percent), Decimal(discount_cap))
     
-    discounts = discount_service.parse_discounts(discounts_json)
-    active_discount = discount_service.get_active_discount(discounts)
+    return "{:.2f}".format(final_price.quantize(Decimal('0.01')))
+
+def _python_apply_discount(price: Decimal, percent: Decimal, cap: Decimal) -> Decimal:
+    """
+    Apply discount percent and cap to an already marked-up, rounded price
+    """
+    # Apply percentage discount/markup
+    final_price = price * (Decimal('1') + (percent / Decimal('100')))
+    
+    # Apply cap (maximum/minimum price limit)
+    if cap > 0:
+        if percent > 0:  # Markup - cap is maximum
+            final_price = min(final_price, cap)
+        elif percent < 0:  # Discount - cap is minimum
+            final_price = max(final_price, cap)
     
-    # Рассчитываем цену с наценкой
-    if price_calculator:
-        final_price = price_calculator.calculate_price(
-            str(base_price), 
-            str(markup_percent)
-        )
-        # Normalize Rust output format to 2 decimal places
-        final_price = "{:.2f}".format(Decimal(final_price))
+    return final_price.quantize(Decimal('0.01'))
+
+def apply_compiled_discount(marked_price: Decimal, discount: Optional[CompiledDiscount]) -> Decimal:
+    """
+    Применяет активную скидку к цене, уже посчитанной с наценкой (например, колоночным
+    расчетом). Результат совпадает с calculate_final_price для тех же входных данных.
+    """
+    if discount is None:
+        return marked_price
+    return apply_discount(marked_price, *discount.pricing())
+
+def apply_discount(marked_price: Decimal, percent: Optional[Decimal], cap: Optional[Decimal]) -> Decimal:
+    """То же, что apply_compiled_discount, по уже извлеченным процентам и cap скидки"""
+    if percent is None:
+        return marked_price
+    return _python_apply_discount(marked_price, percent, cap or Decimal('0'))
+
+def calculate_final_price(base_price: Decimal, markup_percent: Decimal, discount: Optional[CompiledDiscount] = None) -> Decimal:
+    """
+    Полный расчет цены: наценка канала, активная скидка и ее cap.
+    Строковые параметры уходят в Rust одним вызовом, без промежуточных Decimal.
+    """
+    if discount is not None:
+        percent, cap = discount.pricing()
+        discount_args = (str(percent), str(cap), True)
+    else:
+        discount_args = ("0", "0", False)
+    
+    rust_calculate = getattr(price_calculator, "calculate_final_price", None) if price_calculator else None
+    if rust_calculate:
+        final_price = rust_calculate(str(base_price), str(markup_percent), *discount_args)
     else:
-        final_price = _python_calculate_price(
-            str(base_price),
-            str(markup_percent)
-        )
+        final_price = _python_calculate_final_price(str(base_price), str(markup_percent), *discount_args)
     
-    final_price = Decimal(final_price)
+    return Decimal(final_price)
+
+# Колоночный формат: цены в минорных единицах, наценка в сотых долях процента
+PRICE_SCALE = 100
+MARKUP_SCALE = 10000
+
+def _python_calculate_columnar(base_minor, markup_scaled, out, parallel_threshold=None):
+    """
+    Pure Python fallback for the Rust calculate_columnar (same integer math and banker's rounding)
+    """
+    prices = array('q')
+    for price, markup in zip(base_minor, markup_scaled):
+        quotient, remainder = divmod(price * (MARKUP_SCALE + markup), MARKUP_SCALE)
+        twice_remainder = 2 * remainder
+        if twice_remainder > MARKUP_SCALE or (twice_remainder == MARKUP_SCALE and quotient % 2):
+            quotient += 1
+        prices.append(quotient)
+    # Как и в Rust: при переполнении `out` не трогается
+    out[:] = prices
+
+def calculate_columnar(base_minor: array, markup_scaled: array, out: Optional[array] = None) -> array:
+    """
+    Колоночный расчет цен: int64-буферы на входе, предвыделенный int64-буфер на выходе.
+    Rust пишет результат прямо в `out`, не создавая Python-объектов на строку.
+    """
+    if out is None:
+        out = array('q', bytes(8 * len(base_minor)))
+    columnar = getattr(price_calculator, "calculate_columnar", None) if price_calculator else None
+    if columnar:
+        # Rust считает без GIL, большие пакеты - параллельно (rayon)
+        columnar(base_minor, markup_scaled, out, parallel_threshold=settings.RUST_PARALLEL_THRESHOLD)
+    else:
+        _python_calculate_columnar(base_minor, markup_scaled, out)
+    return out
+
+def _to_scaled_int(value: Decimal, scale: int) -> Optional[int]:
+    """Переводит Decimal в целое в заданном масштабе, если это возможно без потери точности"""
+    scaled = Decimal(value) * scale
+    if scaled != scaled.to_integral_value():
+        return None
+    return int(scaled)
+
+def calculate_prices_columnar(base_prices: Sequence[Decimal], markups: Sequence[Decimal]) -> List[Decimal]:
+    """
+    Рассчитывает base * (1 + markup/100) для колонок цен и наценок.
+    Если цены или наценки не укладываются в копейки / сотые доли процента,
+    используется точный Decimal-расчет.
+    """
+    base_scaled = [_to_scaled_int(price, PRICE_SCALE) for price in base_prices]
+    # 15.25% -> 1525
+    markup_scaled = [_to_scaled_int(markup, MARKUP_SCALE // 100) for markup in markups]
     
-    # Применяем скидку, если она активна
-    if active_discount:
-        final_price = discount_service.apply_discount(final_price, active_discount)
+    if None not in base_scaled and None not in markup_scaled:
+        try:
+            out = calculate_columnar(array('q', base_scaled), array('q', markup_scaled))
+            return [Decimal(value).scaleb(-2) for value in out]
+        except (OverflowError, ValueError):
+            pass
     
-    return final_price
+    return [
+        Decimal(_python_calculate_price(str(price), str(markup)))
+        for price, markup in zip(base_prices, markups)
+    ]
 
-def _python_batch_calculate(batch_data):
-    """
-    Pure Python fallback for batch price calculation
-    """
-    results = []
-    for item in batch_data:
-        final_price = _python_calculate_price(
-            item["base_price"], 
-            item["markup_percent"]
-        )
-        results.append({
-            "product_id": item["product_id"],
-            "final_price": final_price
-        })
-    return results
+async def calculate_prices_columnar_async(base_prices: Sequence[Decimal], markups: Sequence[Decimal]) -> List[Decimal]:
+    """
+    Асинхронная обертка над calculate_prices_columnar: крупные пакеты считаются
+    в отдельном потоке, чтобы event loop продолжал обслуживать другие запросы,
+    пока Rust работает без GIL.
+    """
+    if len(base_prices) >= settings.PRICE_BATCH_THREAD_THRESHOLD:
+        return await asyncio.to_thread(calculate_prices_columnar, base_prices, markups)
+    return calculate_prices_columnar(base_prices, markups)
 
-async def batch_calculate_prices(items):
+async def calculate_price_with_markup(product_id: str, channel_id: str, base_price: Decimal,
+                                      context: Optional[PricingContext] = None) -> Decimal:
     """
-    Массовый расчет цен для нескольких продуктов
+    Рассчитывает итоговую цену продукта с учетом наценки канала и активных скидок
     Использует Rust для высокой производительности или Python fallback
-    """
-    # Подготавливаем данные с наценками
-    batch_data = []
-    for item in items:
-        markup = await markup_service.get_channel_markup(item["channel_id"])
-        batch_data.append({
-            "product_id": item["product_id"],
-            "base_price": str(item["base_price"]),
-            "markup_percent": str(markup)
-        })
     
-    # Используем Rust модуль если доступен, иначе Python
-    if price_calculator:
-        results = price_calculator.batch_calculate(batch_data)
-    else:
-        results = _python_batch_calculate(batch_data)
+    context - контекст запроса: наценка и продукт, уже полученные в этом запросе,
+    повторно не запрашиваются
+    """
+    if context is None:
+        context = PricingContext()
     
-    # Преобразуем результаты обратно в Decimal
-    for i, result in enumerate(results):
-        results[i]["final_price"] = Decimal(result["final_price"])
+    # Получаем наценку канала и активную скидку продукта параллельно, чтобы запросы
+    # к Saleor попадали в один пакет загрузчика (см. app.saleor.loader)
+    markup_percent, active_discount = await asyncio.gather(
+        context.get_markup(channel_id),
+        context.get_active_discount(product_id)
+    )
     
-    return results
+    # Наценка, скидка и ограничение cap - одним вызовом
+    return calculate_final_price(base_price, markup_percent, active_discount)
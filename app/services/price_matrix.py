@@ -0,0 +1,111 @@
+import asyncio
+from contextlib import aclosing
+from decimal import Decimal
+from typing import List, Optional
+from app.core.config import settings
+from app.models.schemas import PriceMatrixRequest, PriceMatrixResponse, PriceMatrixRow
+from app.saleor.api import iter_product_pages
+from app.saleor.loader import use_loader
+from app.services.batch_pricing import prefetch_discounts
+from app.services.channel_registry import channel_registry
+from app.services.price_calculator import calculate_prices_columnar_async, apply_compiled_discount
+from app.services.pricing_context import PricingContext
+
+class PriceMatrixTooLarge(ValueError):
+    """Матрица больше PRICE_MATRIX_MAX_CELLS ячеек"""
+
+async def _load_product_page(request: PriceMatrixRequest, context: PricingContext):
+    """Одна страница каталога (с фильтром по каналу) и курсор следующей"""
+    async with aclosing(iter_product_pages(
+        request.channel_slug, page_size=request.first, after=request.after, prefetch=False
+    )) as pages:
+        async for products, end_cursor in pages:
+            # Метаданные со скидками уже в странице - повторно продукты не запрашиваем
+            context.remember_products(products)
+            return [product["id"] for product in products], end_cursor
+    return [], None
+
+async def calculate_price_matrix(request: PriceMatrixRequest,
+                                 context: Optional[PricingContext] = None) -> PriceMatrixResponse:
+    """
+    Матрица цен продукты x каналы:
+    - скидки каждого продукта разбираются один раз на строку;
+    - наценка применяется ко всем ячейкам одним колоночным вызовом (Rust, если доступен);
+    - скидка и cap - к ячейкам строк с активной скидкой.
+    Продукт без базовой цены, с ошибкой загрузки или с некорректной скидкой
+    возвращается строкой с error; остальные строки считаются как обычно.
+    """
+    if context is None:
+        context = PricingContext()
+
+    next_cursor = None
+    if request.product_ids is not None:
+        product_ids = list(dict.fromkeys(request.product_ids))
+    else:
+        product_ids, next_cursor = await _load_product_page(request, context)
+
+    if request.channel_ids is not None:
+        channel_ids = list(dict.fromkeys(request.channel_ids))
+    else:
+        snapshot = await channel_registry.get_snapshot()
+        channel_ids = [channel["id"] for channel in snapshot.channels if channel.get("id")]
+
+    if len(product_ids) * len(channel_ids) > settings.PRICE_MATRIX_MAX_CELLS:
+        raise PriceMatrixTooLarge(
+            f"Matrix of {len(product_ids)}x{len(channel_ids)} exceeds {settings.PRICE_MATRIX_MAX_CELLS} cells"
+        )
+
+    # Запросы get_product, сделанные в одном тике event loop, уходят в Saleor одним пакетом
+    with use_loader():
+        markups, discounts = await asyncio.gather(
+            context.get_markups(channel_ids),
+            prefetch_discounts(context, product_ids)
+        )
+    channel_markups = [markups[channel_id] for channel_id in channel_ids]
+
+    rows: List[PriceMatrixRow] = []
+    priced = []
+    for product_id, discount in zip(product_ids, discounts):
+        base_price = request.base_prices.get(product_id, request.default_base_price)
+        if isinstance(discount, Exception):
+            rows.append(PriceMatrixRow(product_id=product_id, error=f"Product lookup failed: {discount}"))
+        elif base_price is None:
+            rows.append(PriceMatrixRow(product_id=product_id, error="Base price is not set"))
+        else:
+            row = PriceMatrixRow(product_id=product_id, base_price=str(base_price))
+            rows.append(row)
+            try:
+                # Некорректная скидка продукта портит только его строку
+                row.discount_percent = str(discount.pricing()[0]) if discount is not None else None
+            except Exception as e:
+                row.error = f"Discount calculation failed: {e}"
+                continue
+            priced.append((row, Decimal(str(base_price)), discount))
+
+    # Наценка для всех ячеек матрицы одним колоночным вызовом
+    try:
+        marked_prices = await calculate_prices_columnar_async(
+            [base_price for _, base_price, _ in priced for _ in channel_ids],
+            channel_markups * len(priced)
+        )
+    except Exception as e:
+        for row, _, _ in priced:
+            row.error = f"Price calculation failed: {e}"
+        priced = []
+
+    width = len(channel_ids)
+    for index, (row, _, discount) in enumerate(priced):
+        try:
+            row.prices = [
+                str(apply_compiled_discount(marked_price, discount))
+                for marked_price in marked_prices[index * width:(index + 1) * width]
+            ]
+        except Exception as e:
+            row.error = f"Discount calculation failed: {e}"
+
+    return PriceMatrixResponse(
+        channels=channel_ids,
+        markups=[str(markup) for markup in channel_markups],
+        rows=rows,
+        next_cursor=next_cursor
+    )
@@ -0,0 +1,297 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence
+import json
+import time
+import pytz
+from app.core.config import settings
+from app.services.discount_service import CompiledDiscounts
+from app.services.markup_service import markup_service
+from app.services.price_calculator import calculate_prices_columnar_async, apply_discount
+
+# Сколько продуктов читается из таблицы одним HMGET
+PRICE_TABLE_CHUNK = 500
+
+class PriceEntry:
+    """Готовая цена продукта в канале, входные данные, из которых она посчитана, и срок ее действия"""
+
+    __slots__ = ("base_price", "markup_percent", "discount_percent", "discount_cap", "final_price", "valid_until")
+
+    def __init__(self, base_price: Decimal, markup_percent: Decimal, final_price: Decimal,
+                 discount_percent: Optional[Decimal], discount_cap: Optional[Decimal], valid_until: float):
+        self.base_price = base_price
+        self.markup_percent = markup_percent
+        self.final_price = final_price
+        self.discount_percent = discount_percent
+        self.discount_cap = discount_cap
+        self.valid_until = valid_until
+
+    @classmethod
+    def build(cls, base_price: Decimal, markup_percent: Decimal, final_price: Decimal,
+              discounts: CompiledDiscounts, current_time: datetime) -> "PriceEntry":
+        """Запись для цены, посчитанной со скидкой, активной в `current_time`.
+
+        Запись действует не дольше PRICE_TABLE_MAX_AGE и не дольше ближайшей
+        смены активности скидок продукта (граница минуты для скидок с
+        расписанием, начало или конец периода).
+        """
+        discount = discounts.get_active_compiled(current_time)
+        percent, cap = discount.pricing() if discount is not None else (None, None)
+        valid_until = current_time.timestamp() + settings.PRICE_TABLE_MAX_AGE
+        change = discounts.next_change(current_time)
+        if change is not None:
+            valid_until = min(valid_until, change)
+        return cls(Decimal(str(base_price)), markup_percent, final_price, percent, cap, valid_until)
+
+    def encode(self) -> str:
+        return json.dumps({
+            "b": str(self.base_price),
+            "m": str(self.markup_percent),
+            "d": None if self.discount_percent is None else str(self.discount_percent),
+            "c": None if self.discount_cap is None else str(self.discount_cap),
+            "p": str(self.final_price),
+            "v": self.valid_until,
+        })
+
+    @classmethod
+    def decode(cls, raw) -> Optional["PriceEntry"]:
+        try:
+            data = json.loads(raw)
+            return cls(
+                Decimal(data["b"]), Decimal(data["m"]), Decimal(data["p"]),
+                None if data.get("d") is None else Decimal(data["d"]),
+                None if data.get("c") is None else Decimal(data["c"]),
+                float(data["v"])
+            )
+        except (TypeError, ValueError, KeyError, ArithmeticError):
+            return None
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.valid_until
+
+
+class PriceTable:
+    """Материализованная таблица (продукт, канал) -> итоговая цена в Redis.
+
+    Один хэш на канал: price_table:{channel_id}, поле - id продукта.
+    Чтение горячей цены - один HGET. Запись используется, только если базовая
+    цена совпадает с запрошенной и срок записи (valid_until) не истек;
+    иначе вызывающий считает цену сам и записывает результат обратно.
+
+    Вариант в ключ не входит (запрос /calculate его не знает), поэтому на
+    (продукт, канал) хранится одна цена. Для продукта с вариантами разной цены
+    запись выдается только для той базовой цены, от которой посчитана, а
+    store_results такие продукты не записывает.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    @property
+    def redis(self):
+        # Общее подключение с кэшем наценок
+        return markup_service.redis if settings.PRICE_TABLE_ENABLED else None
+
+    @staticmethod
+    def _key(channel_id: str) -> str:
+        return f"price_table:{channel_id}"
+
+    async def get(self, product_id: str, channel_id: str, base_price: Decimal) -> Optional[PriceEntry]:
+        """Готовая цена, если она посчитана от той же базовой цены и не устарела"""
+        if not self.redis:
+            return None
+        try:
+            raw = await self.redis.hget(self._key(channel_id), product_id)
+        except Exception:
+            self.errors += 1
+            return None
+        entry = PriceEntry.decode(raw) if raw else None
+        if entry is None or not entry.fresh or entry.base_price != Decimal(str(base_price)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    async def store(self, product_id: str, channel_id: str, entry: PriceEntry):
+        await self.store_many({channel_id: {product_id: entry}})
+
+    async def store_many(self, entries: Dict[str, Dict[str, PriceEntry]]):
+        """Записать цены {канал: {продукт: запись}} одним pipeline"""
+        if not self.redis or not entries:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for channel_id, products in entries.items():
+                if products:
+                    pipe.hset(self._key(channel_id), mapping={
+                        product_id: entry.encode() for product_id, entry in products.items()
+                    })
+            await pipe.execute()
+            self.writes += sum(len(products) for products in entries.values())
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to store prices in price table: {e}")
+
+    async def store_results(self, results: Sequence, context) -> None:
+        """Записать результаты пакетного расчета.
+
+        Позиции с ошибкой пропускаются, как и продукты, у которых в одном канале
+        несколько вариантов с разной базовой ценой (одна запись на продукт).
+        """
+        entries: Dict[str, Dict[str, PriceEntry]] = {}
+        ambiguous = set()
+        for result in results:
+            if result.error or result.final_price is None:
+                continue
+            entry = PriceEntry.build(
+                Decimal(result.base_price), Decimal(result.markup_percent), Decimal(result.final_price),
+                await context.get_discounts(result.product_id), context.now
+            )
+            products = entries.setdefault(result.channel_id, {})
+            previous = products.get(result.product_id)
+            if previous is not None and previous.base_price != entry.base_price:
+                ambiguous.add((result.channel_id, result.product_id))
+            products[result.product_id] = entry
+        for channel_id, product_id in ambiguous:
+            del entries[channel_id][product_id]
+        await self.store_many(entries)
+
+    async def _reprice(self, entries: Dict[str, Dict[str, PriceEntry]], markup_percent: Optional[Decimal] = None):
+        """Пересчитать записи одним колоночным вызовом и записать их обратно"""
+        rows = [entry for products in entries.values() for entry in products.values()]
+        if not rows:
+            return
+        if markup_percent is not None:
+            for entry in rows:
+                entry.markup_percent = markup_percent
+        marked_prices = await calculate_prices_columnar_async(
+            [entry.base_price for entry in rows], [entry.markup_percent for entry in rows]
+        )
+        for entry, marked_price in zip(rows, marked_prices):
+            entry.final_price = apply_discount(marked_price, entry.discount_percent, entry.discount_cap)
+        await self.store_many(entries)
+
+    async def reprice_channel(self, channel_id: str, markup_percent: Decimal) -> int:
+        """Пересчитать все цены канала с новой наценкой по сохраненным базовым ценам и скидкам.
+
+        Хэш обходится HSCAN порциями по PRICE_TABLE_CHUNK записей; срок записей
+        не меняется - активность скидки проверялась при их расчете.
+        """
+        if not self.redis:
+            return 0
+        key = self._key(channel_id)
+        repriced = 0
+        cursor = 0
+        try:
+            while True:
+                cursor, raw_entries = await self.redis.hscan(key, cursor, count=PRICE_TABLE_CHUNK)
+                products = {}
+                for product_id, raw in raw_entries.items():
+                    entry = PriceEntry.decode(raw)
+                    if entry is not None:
+                        products[product_id.decode() if isinstance(product_id, bytes) else product_id] = entry
+                await self._reprice({channel_id: products}, markup_percent)
+                repriced += len(products)
+                if not cursor:
+                    break
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to reprice price table for channel {channel_id}: {e}")
+            # Недопересчитанный канал не должен отдавать цены со старой наценкой
+            await self.drop_channel(channel_id)
+            return 0
+        return repriced
+
+    async def refresh_channel(self, channel_id: str):
+        """Фоновая задача: перечитать наценку канала и пересчитать его цены"""
+        try:
+            markup_percent = await markup_service.get_channel_markup(channel_id)
+            repriced = await self.reprice_channel(channel_id, markup_percent or Decimal('0'))
+            if repriced:
+                print(f"Repriced {repriced} product(s) in channel {channel_id} price table")
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to reprice channel {channel_id}: {e}")
+            await self.drop_channel(channel_id)
+
+    async def drop_channel(self, channel_id: str):
+        if not self.redis:
+            return
+        try:
+            await self.redis.delete(self._key(channel_id))
+        except Exception:
+            self.errors += 1
+
+    async def _channel_ids(self) -> List[str]:
+        from app.services.channel_registry import channel_registry
+        snapshot = await channel_registry.get_snapshot()
+        return [channel["id"] for channel in snapshot.channels if channel.get("id")]
+
+    async def reprice_products(self, product_ids: Iterable[str], discounts: CompiledDiscounts,
+                               channel_ids: Optional[Iterable[str]] = None) -> int:
+        """Пересчитать цены продуктов во всех каналах после смены их скидок (`discounts` - новые скидки).
+
+        Базовая цена и наценка берутся из уже сохраненных записей, поэтому
+        обращений к Saleor нет; продукты, которых в таблице нет, пропускаются.
+        """
+        product_ids = list(dict.fromkeys(product_ids))
+        if not self.redis or not product_ids:
+            return 0
+        channel_ids = list(channel_ids) if channel_ids is not None else await self._channel_ids()
+        current_time = datetime.now(pytz.UTC)
+        repriced = 0
+        for start in range(0, len(product_ids), PRICE_TABLE_CHUNK):
+            chunk = product_ids[start:start + PRICE_TABLE_CHUNK]
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for channel_id in channel_ids:
+                    pipe.hmget(self._key(channel_id), chunk)
+                rows = await pipe.execute()
+            except Exception as e:
+                self.errors += 1
+                print(f"Failed to read price table: {e}")
+                await self.drop_products(chunk, channel_ids)
+                continue
+
+            updated: Dict[str, Dict[str, PriceEntry]] = {}
+            for channel_id, values in zip(channel_ids, rows):
+                for product_id, raw in zip(chunk, values or []):
+                    entry = PriceEntry.decode(raw) if raw else None
+                    if entry is not None:
+                        # Скидка проверена сейчас - срок записи отсчитывается заново
+                        updated.setdefault(channel_id, {})[product_id] = PriceEntry.build(
+                            entry.base_price, entry.markup_percent, entry.final_price, discounts, current_time
+                        )
+            await self._reprice(updated)
+            repriced += sum(len(products) for products in updated.values())
+        return repriced
+
+    async def drop_products(self, product_ids: Iterable[str], channel_ids: Optional[Iterable[str]] = None):
+        """Удалить цены продуктов во всех каналах"""
+        product_ids = list(product_ids)
+        if not self.redis or not product_ids:
+            return
+        channel_ids = list(channel_ids) if channel_ids is not None else await self._channel_ids()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for channel_id in channel_ids:
+                pipe.hdel(self._key(channel_id), *product_ids)
+            await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to drop prices from price table: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.PRICE_TABLE_ENABLED,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "errors": self.errors,
+        }
+
+price_table = PriceTable()
@@ -0,0 +1,226 @@
+from contextlib import asynccontextmanager
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional, Sequence, Tuple
+import asyncio
+import json
+import time
+import uuid
+import weakref
+from app.core.config import settings
+from app.saleor.api import get_variants_metadata, update_variant_channel_prices
+from app.services.markup_service import markup_service, RELEASE_LOCK_SCRIPT
+
+# Ключ метаданных варианта: {"channel_id": {"base": базовая цена, "price": записанная итоговая цена}}
+BASE_PRICES_KEY = "base_prices"
+
+WRITEBACK_LOCK_POLL_INTERVAL = 0.05
+
+class RecordedPrice:
+    """Базовая цена листинга и итоговая цена, которую мы в него записали"""
+
+    __slots__ = ("base_price", "written_price")
+
+    def __init__(self, base_price: Decimal, written_price: Optional[Decimal]):
+        self.base_price = base_price
+        self.written_price = written_price
+
+    def encode(self) -> dict:
+        return {"base": str(self.base_price), "price": None if self.written_price is None else str(self.written_price)}
+
+def variant_base_prices(variant: dict) -> Dict[str, RecordedPrice]:
+    """Базовые цены варианта, сохраненные при прошлой записи в Saleor"""
+    for item in variant.get("metadata") or []:
+        if item.get("key") != BASE_PRICES_KEY:
+            continue
+        try:
+            recorded = {}
+            for channel_id, value in json.loads(item["value"]).items():
+                recorded[channel_id] = RecordedPrice(
+                    Decimal(str(value["base"])),
+                    None if value.get("price") is None else Decimal(str(value["price"]))
+                )
+            return recorded
+        except (TypeError, ValueError, AttributeError, KeyError, InvalidOperation):
+            print(f"Invalid {BASE_PRICES_KEY} metadata on variant {variant.get('id')}")
+            return {}
+    return {}
+
+class ListingPrice:
+    """Листинг варианта в канале: от какой цены считать и какая цена стоит сейчас"""
+
+    __slots__ = ("variant_id", "channel_id", "base_price", "current_price", "recorded")
+
+    def __init__(self, variant_id: str, channel_id: str, base_price: Decimal, current_price: Decimal,
+                 recorded: Dict[str, RecordedPrice]):
+        self.variant_id = variant_id
+        self.channel_id = channel_id
+        self.base_price = base_price
+        self.current_price = current_price
+        # Все записи варианта из метаданных (общий словарь для листингов варианта)
+        self.recorded = recorded
+
+def collect_listings(product_data: dict, channel_id: Optional[str] = None) -> List[ListingPrice]:
+    """Листинги вариантов с ценой (только канала `channel_id`, если он задан).
+
+    После записи в листинге стоит итоговая цена, поэтому базовая берется из
+    метаданных варианта - но только пока в листинге стоит цена, которую мы туда
+    записали. Если цена листинга другая (ее поменяли в дашборде Saleor или наша
+    запись листинга не прошла), она и есть новая базовая.
+    """
+    listings = []
+    for variant in product_data.get("variants") or []:
+        recorded = variant_base_prices(variant)
+        for channel_listing in variant.get("channelListings") or []:
+            listing_channel = channel_listing["channel"]["id"]
+            if not channel_listing.get("price") or channel_id not in (None, listing_channel):
+                continue
+            current_price = Decimal(str(channel_listing["price"]["amount"]))
+            record = recorded.get(listing_channel)
+            base_price = current_price
+            if record is not None and record.written_price == current_price:
+                base_price = record.base_price
+            listings.append(ListingPrice(variant["id"], listing_channel, base_price, current_price, recorded))
+    return listings
+
+class PriceWriteback:
+    """Запись пересчитанных цен обратно в листинги каналов Saleor"""
+
+    def __init__(self):
+        self.checked = 0
+        self.unchanged = 0
+        self.written = 0
+        self.failed = 0
+        self.lock_wait_timeouts = 0
+        # Блокировки продуктов в процессе (запись живет, пока блокировку держат или ждут)
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    async def _acquire_lock(self, product_id: str) -> str:
+        """Блокировка записи продукта в Redis (между процессами); без Redis - пустой токен"""
+        redis = markup_service.redis
+        if not redis:
+            return ""
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + settings.PRICE_WRITEBACK_LOCK_WAIT
+        while True:
+            try:
+                acquired = await redis.set(
+                    f"lock:price_writeback:{product_id}", token, nx=True, ex=settings.PRICE_WRITEBACK_LOCK_TTL
+                )
+            except Exception:
+                # Redis недоступен - остается блокировка в процессе
+                return ""
+            if acquired:
+                return token
+            if time.monotonic() >= deadline:
+                self.lock_wait_timeouts += 1
+                raise RuntimeError(f"Price write-back of product {product_id} is locked by another worker")
+            await asyncio.sleep(WRITEBACK_LOCK_POLL_INTERVAL)
+
+    async def _release_lock(self, product_id: str, token: str):
+        if not token:
+            return
+        try:
+            await markup_service.redis.eval(RELEASE_LOCK_SCRIPT, 1, f"lock:price_writeback:{product_id}", token)
+        except Exception:
+            pass
+
+    @asynccontextmanager
+    async def _product_lock(self, product_id: str):
+        """Записи цен одного продукта идут по одной - в процессе и между процессами"""
+        lock = self._locks.get(product_id)
+        if lock is None:
+            lock = self._locks[product_id] = asyncio.Lock()
+        async with lock:
+            token = await self._acquire_lock(product_id)
+            try:
+                yield
+            finally:
+                await self._release_lock(product_id, token)
+
+    def _plan(self, listings: Sequence[ListingPrice], results: Sequence
+              ) -> List[Tuple[str, Dict[str, Decimal], Dict[str, RecordedPrice], Dict[str, RecordedPrice]]]:
+        """Изменения по вариантам: только листинги, у которых итоговая цена отличается от текущей.
+
+        Для каждого варианта - (variant_id, новые цены, записи измененных каналов,
+        записи варианта на момент чтения продукта).
+        """
+        changes: Dict[str, Dict[str, Decimal]] = {}
+        by_variant: Dict[str, List[ListingPrice]] = {}
+        for listing, result in zip(listings, results):
+            by_variant.setdefault(listing.variant_id, []).append(listing)
+            if result.error or result.final_price is None:
+                continue
+            self.checked += 1
+            final_price = Decimal(result.final_price)
+            if final_price == listing.current_price:
+                self.unchanged += 1
+                continue
+            changes.setdefault(listing.variant_id, {})[listing.channel_id] = final_price
+
+        plan = []
+        for variant_id, prices in changes.items():
+            variant_listings = by_variant[variant_id]
+            touched = {
+                listing.channel_id: RecordedPrice(listing.base_price, prices[listing.channel_id])
+                for listing in variant_listings if listing.channel_id in prices
+            }
+            plan.append((variant_id, prices, touched, variant_listings[0].recorded))
+        return plan
+
+    async def write_back(self, product_id: str, listings: Sequence[ListingPrice], results: Sequence) -> int:
+        """Записать измененные цены продукта в Saleor.
+
+        `results` - результаты calculate_batch в порядке `listings`. Базовая и
+        записываемая цены сначала сохраняются в метаданных вариантов, затем
+        листинги обновляются одним документом на продукт. Возвращает число записанных
+        листингов; если часть вариантов не записалась - RuntimeError, чтобы
+        задача очереди повторилась (повтор запишет только оставшиеся расхождения).
+
+        Записи одного продукта идут по одной (блокировка в процессе и в Redis), и
+        под блокировкой метаданные перечитываются: в них меняются только каналы
+        этого вызова, записи остальных каналов (их мог только что записать пересчет
+        канала или вебхук продукта) сохраняются.
+        """
+        if not settings.PRICE_WRITEBACK_ENABLED:
+            return 0
+        plan = self._plan(listings, results)
+        if not plan:
+            return 0
+
+        async with self._product_lock(product_id):
+            fresh = await get_variants_metadata([variant_id for variant_id, *_ in plan])
+            updates = []
+            unread = []
+            for variant_id, prices, touched, recorded in plan:
+                if fresh is not None:
+                    variant = fresh.get(variant_id)
+                    if variant is None:
+                        # Без свежих метаданных записи других каналов можно затереть
+                        unread.append(variant_id)
+                        continue
+                    recorded = variant_base_prices(variant)
+                merged = {channel_id: record.encode() for channel_id, record in recorded.items()}
+                merged.update((channel_id, record.encode()) for channel_id, record in touched.items())
+                metadata = [{"key": BASE_PRICES_KEY, "value": json.dumps(merged)}]
+                updates.append({"variant_id": variant_id, "prices": prices, "metadata": metadata})
+            outcome = await update_variant_channel_prices(updates) if updates else {}
+
+        written = sum(len(update["prices"]) for update in updates if outcome.get(update["variant_id"]))
+        failed = [update["variant_id"] for update in updates if not outcome.get(update["variant_id"])] + unread
+        self.written += written
+        self.failed += len(failed)
+        if failed:
+            raise RuntimeError(f"Failed to write prices of {len(failed)} variant(s) of product {product_id}")
+        return written
+
+    def stats(self) -> dict:
+        return {
+            "enabled": settings.PRICE_WRITEBACK_ENABLED,
+            "checked": self.checked,
+            "unchanged": self.unchanged,
+            "written": self.written,
+            "failed": self.failed,
+            "lock_wait_timeouts": self.lock_wait_timeouts,
+        }
+
+price_writeback = PriceWriteback()
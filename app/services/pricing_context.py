@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+import pytz
+from app.services.markup_service import markup_service
+from app.services.discount_service import discount_service, CompiledDiscount, CompiledDiscounts
+from app.saleor.api import get_product, get_channel_by_subdomain
+
+class PricingContext:
+    """Данные для расчета цен, запомненные на время одного запроса.
+
+    Канал, продукт, наценка и активная скидка запрашиваются не больше одного
+    раза на запрос, даже если их просят несколько мест одновременно.
+    Экземпляр создается на каждый запрос зависимостью get_pricing_context.
+    Активность скидок проверяется на один момент - время создания контекста.
+    """
+
+    def __init__(self):
+        self.now = datetime.now(pytz.UTC)
+        self._markups: Dict[str, asyncio.Future] = {}
+        self._products: Dict[str, asyncio.Future] = {}
+        self._channels: Dict[str, asyncio.Future] = {}
+        self._discounts: Dict[str, Optional[CompiledDiscount]] = {}
+
+    @staticmethod
+    async def _memo(cache: Dict[Hashable, asyncio.Future], key: Hashable,
+                    fn: Callable[[], Awaitable[Any]]) -> Any:
+        # В кэше лежит сама задача: одновременные вызовы ждут один и тот же запрос
+        future = cache.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            cache[key] = future
+        return await future
+
+    async def get_markup(self, channel_id: str) -> Decimal:
+        return await self._memo(
+            self._markups, channel_id, lambda: markup_service.get_channel_markup(channel_id)
+        )
+
+    async def get_markups(self, channel_ids: Iterable[str]) -> Dict[str, Decimal]:
+        """Наценки нескольких каналов; незапомненные - одним пакетом через MarkupService"""
+        channel_ids = list(dict.fromkeys(channel_ids))
+        missing = [channel_id for channel_id in channel_ids if channel_id not in self._markups]
+        if missing:
+            batch = asyncio.ensure_future(markup_service.get_channel_markups(missing))
+            for channel_id in missing:
+                self._markups[channel_id] = asyncio.ensure_future(_pick(batch, channel_id))
+        # Ждем все задачи, даже если одна упала: иначе ошибки остальных теряются с предупреждением
+        markups = await asyncio.gather(
+            *(self._markups[channel_id] for channel_id in channel_ids), return_exceptions=True
+        )
+        for markup in markups:
+            if isinstance(markup, BaseException):
+                raise markup
+        return dict(zip(channel_ids, markups))
+
+    def remember_products(self, products: Iterable[dict]):
+        """Запомнить уже загруженные продукты (например, страницу каталога)"""
+        loop = asyncio.get_running_loop()
+        for product in products:
+            if product.get("id") and product["id"] not in self._products:
+                future = loop.create_future()
+                future.set_result(product)
+                self._products[product["id"]] = future
+
+    async def get_product(self, product_id: str) -> Optional[dict]:
+        return await self._memo(self._products, product_id, lambda: get_product(product_id))
+
+    async def get_channel_by_subdomain(self, subdomain: str) -> Optional[dict]:
+        return await self._memo(
+            self._channels, subdomain, lambda: get_channel_by_subdomain(subdomain)
+        )
+
+    async def get_discounts(self, product_id: str) -> CompiledDiscounts:
+        """Все скидки продукта (скомпилированные скидки кэшируются по строке метаданных)"""
+        product = await self.get_product(product_id)
+        return discount_service.compile_discounts(discount_service.extract_discounts_json(product))
+
+    async def get_active_discount(self, product_id: str) -> Optional[CompiledDiscount]:
+        """Активная скидка продукта на момент создания контекста (self.now)"""
+        if product_id not in self._discounts:
+            self._discounts[product_id] = (await self.get_discounts(product_id)).get_active_compiled(self.now)
+        return self._discounts[product_id]
+
+
+async def _pick(batch: "asyncio.Future[Dict[str, Decimal]]", channel_id: str) -> Decimal:
+    return (await batch)[channel_id]
+
+
+def get_pricing_context() -> PricingContext:
+    """FastAPI-зависимость: новый контекст на каждый запрос"""
+    return PricingContext()
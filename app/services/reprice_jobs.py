@@ -0,0 +1,285 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import aclosing
+from decimal import Decimal
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.models.schemas import PriceCalculationRequest
+from app.saleor.api import iter_product_pages
+from app.services.batch_pricing import calculate_batch
+from app.services.channel_registry import channel_registry
+from app.services.job_queue import job_queue
+from app.services.markup_service import markup_service
+from app.services.price_table import price_table
+from app.services.price_writeback import price_writeback, collect_listings
+from app.services.pricing_context import PricingContext
+
+# Тип задачи очереди: один шаг пересчета канала (до REPRICE_JOB_PAGES_PER_STEP страниц)
+REPRICE_CHANNEL_JOB = "reprice_channel"
+
+# Задачи, которые больше не выполняются
+FINISHED_STATUSES = ("completed", "failed", "superseded")
+
+# Сколько задач держится в памяти процесса (копия состояния из Redis)
+LOCAL_JOBS_LIMIT = 100
+
+# Числовые поля состояния задачи
+_INT_FIELDS = ("pages", "products", "listings_written", "failed_products")
+_TIME_FIELDS = ("started_at", "updated_at", "finished_at")
+
+class RepriceJobs:
+    """Пересчет всех цен канала после смены наценки.
+
+    Каталог канала обходится страницами; каждая страница считается пакетным
+    движком и записывается в Saleor (только изменившиеся листинги). После
+    каждой страницы ее курсор фиксируется в состоянии задачи (хэш
+    reprice_job:{job_id} в Redis), поэтому задача после падения процесса
+    продолжается с последней зафиксированной страницы, а не с начала.
+
+    Задача выполняется шагами через очередь задач: шаг обрабатывает не больше
+    REPRICE_JOB_PAGES_PER_STEP страниц и ставит в очередь следующий шаг, так
+    что сообщение очереди не висит дольше таймаута видимости. Новая наценка
+    того же канала отменяет незаконченную задачу (статус superseded).
+    """
+
+    def __init__(self):
+        # Копия состояний в памяти: статус виден и без Redis
+        self._local: "OrderedDict[str, dict]" = OrderedDict()
+        self._latest: Dict[str, str] = {}
+        self.errors = 0
+
+    @property
+    def redis(self):
+        # Общее подключение с кэшем наценок
+        return markup_service.redis
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"reprice_job:{job_id}"
+
+    @staticmethod
+    def _channel_key(channel_id: str) -> str:
+        return f"reprice_job:channel:{channel_id}"
+
+    def _remember(self, state: dict):
+        self._local[state["job_id"]] = state
+        self._local.move_to_end(state["job_id"])
+        while len(self._local) > LOCAL_JOBS_LIMIT:
+            self._local.popitem(last=False)
+
+    async def _save(self, state: dict, latest: bool = False):
+        """Зафиксировать состояние задачи (и сделать ее текущей для канала при `latest`)"""
+        self._remember(state)
+        if latest:
+            self._latest[state["channel_id"]] = state["job_id"]
+        if not self.redis:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(self._key(state["job_id"]), mapping={
+                field: "" if value is None else str(value) for field, value in state.items()
+            })
+            pipe.expire(self._key(state["job_id"]), settings.REPRICE_JOB_TTL)
+            if latest:
+                pipe.set(self._channel_key(state["channel_id"]), state["job_id"], ex=settings.REPRICE_JOB_TTL)
+            await pipe.execute()
+        except Exception as e:
+            self.errors += 1
+            print(f"Failed to save repricing job {state['job_id']}: {e}")
+
+    @staticmethod
+    def _parse(raw: dict) -> dict:
+        state = {}
+        for field, value in raw.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            value = value.decode() if isinstance(value, bytes) else value
+            state[field] = value or None
+        for field in _INT_FIELDS:
+            state[field] = int(state.get(field) or 0)
+        for field in _TIME_FIELDS:
+            state[field] = float(state[field]) if state.get(field) else None
+        return state
+
+    async def load(self, job_id: str) -> Optional[dict]:
+        """Состояние задачи: из Redis (видно всем процессам), иначе из памяти процесса"""
+        if self.redis:
+            try:
+                raw = await self.redis.hgetall(self._key(job_id))
+                if raw:
+                    return self._parse(raw)
+            except Exception as e:
+                self.errors += 1
+                print(f"Failed to load repricing job {job_id}: {e}")
+        state = self._local.get(job_id)
+        return dict(state) if state is not None else None
+
+    async def _latest_job_id(self, channel_id: str) -> Optional[str]:
+        if self.redis:
+            try:
+                job_id = await self.redis.get(self._channel_key(channel_id))
+                if job_id:
+                    return job_id.decode() if isinstance(job_id, bytes) else job_id
+            except Exception:
+                self.errors += 1
+        return self._latest.get(channel_id)
+
+    async def start(self, channel_id: str, markup_percent: Decimal) -> str:
+        """Создать задачу пересчета канала и поставить первый шаг в очередь"""
+        job_id = uuid.uuid4().hex
+        state = {
+            "job_id": job_id,
+            "channel_id": channel_id,
+            "markup_percent": str(markup_percent),
+            "status": "queued",
+            "cursor": None,
+            "pages": 0,
+            "products": 0,
+            "listings_written": 0,
+            "failed_products": 0,
+            "started_at": None,
+            "updated_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+        await self._save(state, latest=True)
+        await job_queue.enqueue(REPRICE_CHANNEL_JOB, job_id=job_id)
+        return job_id
+
+    async def resume(self, job_id: str) -> Optional[dict]:
+        """Поставить в очередь шаг задачи, начиная с последнего зафиксированного курсора"""
+        state = await self.load(job_id)
+        if state is None or state["status"] in ("completed", "superseded"):
+            return state
+        state["status"] = "queued"
+        state["error"] = None
+        await self._save(state)
+        await job_queue.enqueue(REPRICE_CHANNEL_JOB, job_id=job_id)
+        return state
+
+    async def _channel_slug(self, channel_id: str) -> Optional[str]:
+        snapshot = await channel_registry.get_snapshot()
+        channel = snapshot.by_id.get(channel_id)
+        return channel.get("slug") if channel else None
+
+    async def _write_product(self, product_id: str, listings, results) -> int:
+        try:
+            return await price_writeback.write_back(product_id, listings, results)
+        except Exception as e:
+            print(f"Failed to write prices of product {product_id}: {e}")
+            return -1
+
+    async def _reprice_page(self, state: dict, products: List[dict]):
+        """Пересчитать страницу продуктов одним пакетом и записать изменившиеся цены"""
+        channel_id = state["channel_id"]
+        page = [(product["id"], collect_listings(product, channel_id)) for product in products]
+        items = [
+            PriceCalculationRequest(product_id=product_id, channel_id=channel_id, base_price=listing.base_price)
+            for product_id, listings in page for listing in listings
+        ]
+        if items:
+            context = PricingContext()
+            # Скидки уже в метаданных страницы - продукты повторно не запрашиваем
+            context.remember_products(products)
+            results = await calculate_batch(items, context)
+            await price_table.store_results(results, context)
+
+            writes = []
+            offset = 0
+            for product_id, listings in page:
+                if listings:
+                    writes.append(self._write_product(product_id, listings, results[offset:offset + len(listings)]))
+                    offset += len(listings)
+            # Записи ограничены общим семафором SALEOR_WRITE_CONCURRENCY
+            for written in await asyncio.gather(*writes):
+                if written < 0:
+                    state["failed_products"] += 1
+                else:
+                    state["listings_written"] += written
+        state["products"] += len(products)
+
+    async def run_step(self, job_id: str):
+        """Шаг задачи для очереди: до REPRICE_JOB_PAGES_PER_STEP страниц с зафиксированного курсора"""
+        state = await self.load(job_id)
+        if state is None or state["status"] in FINISHED_STATUSES:
+            return
+        if await self._latest_job_id(state["channel_id"]) not in (None, job_id):
+            state["status"] = "superseded"
+            state["finished_at"] = time.time()
+            await self._save(state)
+            return
+
+        channel_slug = await self._channel_slug(state["channel_id"])
+        if channel_slug is None:
+            state["status"] = "failed"
+            state["error"] = f"Channel {state['channel_id']} not found"
+            state["finished_at"] = time.time()
+            await self._save(state)
+            return
+
+        state["status"] = "running"
+        state["started_at"] = state["started_at"] or time.time()
+        await self._save(state)
+        pages = 0
+        try:
+            async with aclosing(iter_product_pages(
+                channel_slug, page_size=settings.REPRICE_JOB_PAGE_SIZE, after=state["cursor"], with_variants=True
+            )) as stream:
+                async for products, end_cursor in stream:
+                    await self._reprice_page(state, products)
+                    # Пустая страница после последней не сбрасывает курсор в начало каталога
+                    state["cursor"] = end_cursor or state["cursor"]
+                    state["pages"] += 1
+                    state["updated_at"] = time.time()
+                    await self._save(state)
+                    pages += 1
+                    if pages >= settings.REPRICE_JOB_PAGES_PER_STEP:
+                        break
+                else:
+                    state["status"] = "completed"
+                    state["finished_at"] = time.time()
+                    await self._save(state)
+                    print(f"Repriced {state['products']} product(s) in channel {state['channel_id']}")
+                    return
+        except Exception as e:
+            # Очередь повторит шаг с последнего зафиксированного курсора (после последней попытки - fail)
+            state["error"] = str(e)
+            await self._save(state)
+            raise
+
+        await job_queue.enqueue(REPRICE_CHANNEL_JOB, job_id=job_id)
+
+    async def fail(self, error: str, job_id: str):
+        """Задача ушла в dead-letter очереди: шаг больше не повторится, задача завершена с ошибкой"""
+        state = await self.load(job_id)
+        if state is None or state["status"] in FINISHED_STATUSES:
+            return
+        state["status"] = "failed"
+        state["error"] = error
+        state["finished_at"] = time.time()
+        await self._save(state)
+        print(f"Repricing job {job_id} of channel {state['channel_id']} failed: {error}")
+
+    @staticmethod
+    def progress(state: dict) -> dict:
+        """Состояние задачи с временем выполнения и пропускной способностью"""
+        started_at = state.get("started_at")
+        elapsed = 0.0
+        if started_at:
+            elapsed = max(0.0, (state.get("finished_at") or time.time()) - started_at)
+        return {
+            **state,
+            "elapsed_seconds": round(elapsed, 3),
+            "products_per_second": round(state["products"] / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def stats(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for state in self._local.values():
+            statuses[state["status"]] = statuses.get(state["status"], 0) + 1
+        return {"jobs": statuses, "errors": self.errors}
+
+reprice_jobs = RepriceJobs()
+
+job_queue.register(REPRICE_CHANNEL_JOB, reprice_jobs.run_step, on_dead_letter=reprice_jobs.fail)
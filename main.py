@@ -8,15 +8,30 @@ from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from app.api import channels, prices, webhooks, products
 from app.core.config import settings
-from app.saleor.client import init_saleor_client
+from app.saleor.client import init_saleor_client, close_saleor_client, saleor_client
+from app.services.markup_service import markup_service
+from app.services.channel_registry import channel_registry
+from app.services.price_table import price_table
+from app.services.job_queue import job_queue
+from app.services.price_writeback import price_writeback
+from app.services.reprice_jobs import reprice_jobs
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
+    # Startup: общий пул соединений к Saleor
     await init_saleor_client()
+    # Подписка на инвалидации кэша наценок от других воркеров
+    markup_service.start_invalidation_listener()
+    # Снимок каналов для поиска по поддомену, обновляется в фоне
+    channel_registry.start()
+    # Пул воркеров очереди задач вебхуков
+    await job_queue.start()
     yield
-    # Shutdown - можно добавить cleanup логику если нужно
-    pass
+    # Shutdown: останавливаем фоновые задачи, закрываем keep-alive соединения
+    await job_queue.stop()
+    await channel_registry.stop()
+    await markup_service.stop_invalidation_listener()
+    await close_saleor_client()
 
 app = FastAPI(
   title='Saleor Price Manager',
@@ -53,3 +68,16 @@ app.include_router(webhooks.router, prefix='/webhooks',     tags=['webhooks'])
 @app.get('/health')
 async def health_check():
   return {'status': 'ok'}
+
+@app.get('/metrics')
+async def metrics():
+  """Внутренние счетчики сервиса (пул Saleor, склейка запросов, кэш наценок, реестр каналов, таблица цен, очередь задач, вебхуки)"""
+  return {
+    'saleor': saleor_client.stats(),
+    'markup_cache': markup_service.stats(),
+    'channel_registry': channel_registry.stats(),
+    'price_table': price_table.stats(),
+    'job_queue': await job_queue.stats(),
+    'price_writeback': price_writeback.stats(),
+    'reprice_jobs': reprice_jobs.stats(),
+    'webhooks': webhooks.payload_usage.stats()}
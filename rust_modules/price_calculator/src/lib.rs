@@ -1,33 +1,89 @@
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
 use pyo3::types::{PyDict, PyList};
+use rayon::prelude::*;
 use rust_decimal::Decimal;
 use rust_decimal::prelude::*;
 
+/// Начиная с этого размера пакет считается без GIL и параллельно на пуле rayon
+const PARALLEL_THRESHOLD: usize = 50_000;
+
+/// Формула расчета: base_price * (1 + markup_percent/100), округление до 2 знаков
+fn markup_price(base_price: &str, markup_percent: &str) -> String {
+    let base = Decimal::from_str(base_price).unwrap_or(Decimal::ZERO);
+    let markup = Decimal::from_str(markup_percent).unwrap_or(Decimal::ZERO);
+    
+    let markup_factor = Decimal::ONE + (markup / Decimal::from(100));
+    let final_price = base * markup_factor;
+    
+    final_price.round_dp(2).to_string()
+}
+
 /// Рассчитывает цену с учетом наценки
 #[pyfunction]
 fn calculate_price(base_price: String, markup_percent: String) -> PyResult<String> {
-    let base = Decimal::from_str(&base_price).unwrap_or(Decimal::ZERO);
-    let markup = Decimal::from_str(&markup_percent).unwrap_or(Decimal::ZERO);
+    Ok(markup_price(&base_price, &markup_percent))
+}
+
+fn parse_decimal(value: &str, name: &str) -> PyResult<Decimal> {
+    Decimal::from_str(value).map_err(|_| PyValueError::new_err(format!("Invalid {}: {}", name, value)))
+}
+
+/// Полный расчет цены за один вызов: наценка канала, затем активная скидка
+/// с ограничением cap (для скидки cap - минимум цены, для наценки - максимум).
+/// Округление банковское до 2 знаков, как у Python Decimal.quantize.
+#[pyfunction]
+fn calculate_final_price(
+    base_price: &str,
+    markup_percent: &str,
+    discount_percent: &str,
+    discount_cap: &str,
+    discount_active: bool,
+) -> PyResult<String> {
+    // Некорректная строка - ошибка, как InvalidOperation у Python-расчета, а не цена 0
+    let base = parse_decimal(base_price, "base price")?;
+    let markup = parse_decimal(markup_percent, "markup percent")?;
     
-    // Формула расчета: base_price * (1 + markup_percent/100)
-    let markup_factor = Decimal::ONE + (markup / Decimal::from(100));
-    let final_price = base * markup_factor;
+    let mut final_price = (base * (Decimal::ONE + markup / Decimal::from(100))).round_dp(2);
     
-    // Округляем до 2 знаков после запятой
-    let rounded = final_price.round_dp(2);
+    if discount_active {
+        let percent = parse_decimal(discount_percent, "discount percent")?;
+        let cap = parse_decimal(discount_cap, "discount cap")?;
+        
+        final_price *= Decimal::ONE + percent / Decimal::from(100);
+        
+        if cap > Decimal::ZERO {
+            if percent > Decimal::ZERO {
+                final_price = final_price.min(cap);
+            } else if percent < Decimal::ZERO {
+                final_price = final_price.max(cap);
+            }
+        }
+        
+        final_price = final_price.round_dp(2);
+    }
     
-    Ok(rounded.to_string())
+    final_price.rescale(2);
+    Ok(final_price.to_string())
 }
 
-/// Массовый расчет цен
+/// Массовый расчет цен (совместимый API со словарями)
+///
+/// Строки извлекаются под GIL, сам расчет идет без GIL, а для больших
+/// пакетов - параллельно на пуле rayon.
 #[pyfunction]
-fn batch_calculate<'py>(py: Python<'py>, items: Bound<'py, PyList>) -> PyResult<Bound<'py, PyList>> {
-    let result = PyList::empty(py);
-    
+#[pyo3(signature = (items, parallel_threshold=PARALLEL_THRESHOLD))]
+fn batch_calculate<'py>(
+    py: Python<'py>,
+    items: Bound<'py, PyList>,
+    parallel_threshold: usize,
+) -> PyResult<Bound<'py, PyList>> {
+    // Извлекаем значения и преобразуем их в String
+    let mut rows: Vec<(String, String, String)> = Vec::with_capacity(items.len());
     for item_obj in items.iter() {
         let item = item_obj.downcast::<PyDict>()?;
         
-        // Извлекаем значения и преобразуем их в String
         let product_id = item
             .get_item("product_id")?
             .expect("Missing product_id")
@@ -41,25 +97,108 @@ fn batch_calculate<'py>(py: Python<'py>, items: Bound<'py, PyList>) -> PyResult<
             .expect("Missing markup_percent")
             .extract::<String>()?;
         
-        // Расчет цены
-        let final_price = calculate_price(base_price, markup_percent)?;
-        
-        // Создаем словарь с результатом
+        rows.push((product_id, base_price, markup_percent));
+    }
+    
+    // Расчет цен без GIL
+    let final_prices: Vec<String> = py.detach(|| {
+        if rows.len() >= parallel_threshold {
+            rows.par_iter()
+                .map(|(_, base_price, markup_percent)| markup_price(base_price, markup_percent))
+                .collect()
+        } else {
+            rows.iter()
+                .map(|(_, base_price, markup_percent)| markup_price(base_price, markup_percent))
+                .collect()
+        }
+    });
+    
+    // Создаем словари с результатами
+    let result = PyList::empty(py);
+    for ((product_id, _, _), final_price) in rows.into_iter().zip(final_prices) {
         let result_dict = PyDict::new(py);
         result_dict.set_item("product_id", product_id)?;
         result_dict.set_item("final_price", final_price)?;
-        
-        // Добавляем в список результатов
         result.append(result_dict)?;
     }
     
     Ok(result)
 }
 
+/// Масштаб колоночной наценки: 1500 = 15.00%
+const MARKUP_SCALE: i128 = 10_000;
+
+/// Наценка на цену в минорных единицах (копейках) с банковским округлением,
+/// как у Decimal::round_dp и Python Decimal.quantize
+fn apply_markup_minor(base_minor: i64, markup_scaled: i64) -> Option<i64> {
+    let numerator = base_minor as i128 * (MARKUP_SCALE + markup_scaled as i128);
+    let quotient = numerator.div_euclid(MARKUP_SCALE);
+    let twice_remainder = 2 * numerator.rem_euclid(MARKUP_SCALE);
+    let rounded = if twice_remainder > MARKUP_SCALE
+        || (twice_remainder == MARKUP_SCALE && quotient % 2 != 0)
+    {
+        quotient + 1
+    } else {
+        quotient
+    };
+    i64::try_from(rounded).ok()
+}
+
+fn overflow_error() -> PyErr {
+    PyValueError::new_err("price overflows int64")
+}
+
+/// Колоночный расчет цен без создания Python-объектов на строку.
+///
+/// base_minor - цены в минорных единицах (int64), markup_scaled - наценка
+/// в сотых долях процента (int64), out - предвыделенный буфер int64 той же длины.
+///
+/// Входы копируются в память Rust, расчет всегда идет без GIL: пакеты от
+/// `parallel_threshold` строк - параллельно на пуле rayon (work-stealing),
+/// меньшие - последовательно. Результат записывается в `out` целиком и
+/// только если ни одна строка не переполнилась.
+#[pyfunction]
+#[pyo3(signature = (base_minor, markup_scaled, out, parallel_threshold=PARALLEL_THRESHOLD))]
+fn calculate_columnar(
+    py: Python<'_>,
+    base_minor: PyBuffer<i64>,
+    markup_scaled: PyBuffer<i64>,
+    out: PyBuffer<i64>,
+    parallel_threshold: usize,
+) -> PyResult<()> {
+    let len = base_minor.item_count();
+    if markup_scaled.item_count() != len || out.item_count() != len {
+        return Err(PyValueError::new_err("base_minor, markup_scaled and out must have the same length"));
+    }
+    if out.readonly() {
+        return Err(PyValueError::new_err("out buffer must be writable"));
+    }
+
+    let base = base_minor.to_vec(py)?;
+    let markup = markup_scaled.to_vec(py)?;
+    let prices: Option<Vec<i64>> = py.detach(|| {
+        if len >= parallel_threshold {
+            base.par_iter()
+                .zip(markup.par_iter())
+                .map(|(&price, &markup)| apply_markup_minor(price, markup))
+                .collect()
+        } else {
+            base.iter()
+                .zip(markup.iter())
+                .map(|(&price, &markup)| apply_markup_minor(price, markup))
+                .collect()
+        }
+    });
+    out.copy_from_slice(py, &prices.ok_or_else(overflow_error)?)
+}
+
 /// Регистрация модуля Python
 #[pymodule]
 fn price_calculator(m: &Bound<'_, PyModule>) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(calculate_price, m)?)?;
     m.add_function(wrap_pyfunction!(batch_calculate, m)?)?;
+    m.add_function(wrap_pyfunction!(calculate_columnar, m)?)?;
+    m.add_function(wrap_pyfunction!(calculate_final_price, m)?)?;
+    m.add("PARALLEL_THRESHOLD", PARALLEL_THRESHOLD)?;
     Ok(())
 }
\ No newline at end of file
@@ -46,6 +46,20 @@ def test_rust_module():
         assert results[1]['final_price'] == '230.00', f"Product 2: expected 230.00, got {results[1]['final_price']}"
         
         print("✅ Rust batch calculation works correctly")
+        
+        # Test columnar calculation (int64 buffers, result written in place)
+        from array import array
+        out = array('q', [0, 0])
+        price_calculator.calculate_columnar(array('q', [10000, 20000]), array('q', [1000, 1500]), out)
+        assert list(out) == [11000, 23000], f"Columnar: expected [11000, 23000], got {list(out)}"
+        
+        print("✅ Rust columnar calculation works correctly")
+        
+        # Test full pipeline: markup, then discount limited by cap
+        result = price_calculator.calculate_final_price("100.00", "15.00", "-20", "100", True)
+        assert result == "100.00", f"Final price: expected 100.00, got {result}"
+        
+        print("✅ Rust final price calculation works correctly")
         return True
         
     except ImportError:
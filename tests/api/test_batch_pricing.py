@@ -0,0 +1,202 @@
+import pytest
+import asyncio
+import json
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+from app.core.config import settings
+from app.models.schemas import PriceCalculationRequest
+from app.services.batch_pricing import calculate_batch
+from app.services.discount_service import discount_service
+from app.services.price_calculator import calculate_final_price
+
+
+DISCOUNTED = {
+    "id": "p-discounted",
+    "metadata": [{"key": "discounts", "value": '[{"percent": -10, "cap": "0"}]'}]
+}
+
+
+def _request(product_id, channel_id, base_price):
+    return PriceCalculationRequest(product_id=product_id, channel_id=channel_id, base_price=base_price)
+
+
+@pytest.mark.unit
+class TestBatchPricing:
+    """Test the concurrent batch pricing engine"""
+
+    @pytest.mark.asyncio
+    async def test_order_and_per_item_errors(self, mock_rust_module, monkeypatch):
+        """Results keep request order; failed items carry an error without failing the batch"""
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markups",
+            AsyncMock(return_value={"ch1": Decimal('15'), "ch2": Decimal('5')})
+        )
+
+        async def get_product(product_id):
+            if product_id == "p-broken":
+                raise RuntimeError("Saleor timeout")
+            return DISCOUNTED if product_id == "p-discounted" else {"id": product_id, "metadata": []}
+
+        monkeypatch.setattr("app.services.pricing_context.get_product", get_product)
+        items = [
+            _request("p-discounted", "ch1", Decimal('100')),
+            _request("p-broken", "ch1", Decimal('10')),
+            _request("p-plain", None, Decimal('10')),
+            _request("p-plain", "ch2", Decimal('19.99')),
+        ]
+
+        results = await calculate_batch(items)
+
+        assert [result.product_id for result in results] == ["p-discounted", "p-broken", "p-plain", "p-plain"]
+        assert results[0].final_price == "103.50"
+        assert results[0].discount_applied is True
+        assert results[0].discount_percent == "-10"
+        assert "Saleor timeout" in results[1].error and results[1].final_price is None
+        assert results[2].error == "channel_id is required"
+        assert results[3].final_price == "20.99"
+        assert results[3].error is None
+
+        # Same result as the per-item path
+        discount = discount_service.compile_discounts(
+            discount_service.extract_discounts_json(DISCOUNTED)
+        ).get_active_compiled()
+        assert results[0].final_price == str(calculate_final_price(Decimal('100'), Decimal('15'), discount))
+
+    @pytest.mark.asyncio
+    async def test_single_columnar_call_and_bounded_fetches(self, mock_rust_module, monkeypatch):
+        """Markups are applied in one columnar call; product fetches respect the concurrency limit"""
+        monkeypatch.setattr(settings, "PRICE_BATCH_CONCURRENCY", 3)
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markups",
+            AsyncMock(return_value={"ch1": Decimal('10')})
+        )
+        in_flight = peak = 0
+
+        async def get_product(product_id):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+            return {"id": product_id, "metadata": []}
+
+        monkeypatch.setattr("app.services.pricing_context.get_product", get_product)
+        columnar = AsyncMock(side_effect=lambda prices, markups: [
+            (price * (1 + markup / 100)).quantize(Decimal('0.01')) for price, markup in zip(prices, markups)
+        ])
+        monkeypatch.setattr("app.services.batch_pricing.calculate_prices_columnar_async", columnar)
+
+        results = await calculate_batch([_request(f"p{i}", "ch1", Decimal('10')) for i in range(20)])
+
+        assert [result.final_price for result in results] == ["11.00"] * 20
+        columnar.assert_awaited_once()
+        assert peak <= 3
+
+    def test_batch_endpoint_reports_item_errors(self, client, mock_rust_module, monkeypatch):
+        """The endpoint returns 200 with per-item errors"""
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markups",
+            AsyncMock(return_value={"ch1": Decimal('15')})
+        )
+
+        response = client.post("/api/prices/batch-calculate", json=[
+            {"product_id": "UHJvZHVjdDox", "channel_id": "ch1", "base_price": 100},
+            {"product_id": "UHJvZHVjdDox", "base_price": 100},
+        ])
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data[0]["final_price"] == "115.00"
+        assert data[1]["error"] == "channel_id is required"
+
+
+async def _byte_chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.unit
+class TestStreamingBatchPricing:
+    """Test NDJSON streaming batch pricing"""
+
+    @pytest.mark.asyncio
+    async def test_lines_split_across_chunks(self):
+        """Lines are reassembled across body chunks; blank lines are skipped"""
+        from app.services.batch_pricing import iter_ndjson_lines
+
+        lines = [line async for line in iter_ndjson_lines(_byte_chunks(b'{"a": 1}\n{"b"', b': 2}\n\n', b'{"c": 3}'))]
+
+        assert lines == ['{"a": 1}', '{"b": 2}', '{"c": 3}']
+
+    @pytest.mark.asyncio
+    async def test_oversized_lines_are_dropped(self):
+        """A line over the limit yields one marker and its rest is discarded, even across chunks"""
+        from app.services.batch_pricing import iter_ndjson_lines
+
+        chunks = _byte_chunks(b'{"a": 1}\n' + b"x" * 8, b"x" * 8, b"x" * 8 + b'\n{"b": 2}\n', b"y" * 20)
+        lines = [line async for line in iter_ndjson_lines(chunks, max_line_bytes=10)]
+
+        assert lines == ['{"a": 1}', None, '{"b": 2}', None]
+
+    @pytest.mark.asyncio
+    async def test_oversized_line_gets_error_result(self, monkeypatch):
+        """The stream answers an oversized line with a per-line error"""
+        from app.services import batch_pricing
+        monkeypatch.setattr(settings, "PRICE_STREAM_MAX_LINE_BYTES", 16)
+
+        outputs = [out async for out in batch_pricing.stream_batch(_byte_chunks(b"z" * 100 + b"\n"))]
+
+        assert json.loads(outputs[0])["error"] == "Line exceeds 16 bytes"
+
+    @pytest.mark.asyncio
+    async def test_stream_is_priced_in_chunks(self, mock_rust_module, monkeypatch):
+        """Each chunk goes through the batch engine; invalid lines keep their position"""
+        from app.services import batch_pricing
+
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markups",
+            AsyncMock(return_value={"ch1": Decimal('10')})
+        )
+        engine = AsyncMock(wraps=batch_pricing.calculate_batch)
+        monkeypatch.setattr(batch_pricing, "calculate_batch", engine)
+        body = (
+            b'{"product_id": "p1", "channel_id": "ch1", "base_price": 10}\n'
+            b'not json\n'
+            b'{"product_id": "p2", "channel_id": "ch1", "base_price": -1}\n'
+            b'{"product_id": "p3", "channel_id": "ch1", "base_price": 20}\n'
+            b'{"product_id": "p4", "channel_id": "ch1", "base_price": 30}\n'
+        )
+
+        outputs = [out async for out in batch_pricing.stream_batch(_byte_chunks(body), chunk_size=2)]
+        results = [json.loads(line) for out in outputs for line in out.splitlines()]
+
+        assert len(outputs) == 3
+        assert engine.await_count == 3
+        assert [result["product_id"] for result in results] == ["p1", "", "p2", "p3", "p4"]
+        assert [result["final_price"] for result in results] == ["11.00", None, None, "22.00", "33.00"]
+        assert results[1]["error"].startswith("Invalid JSON")
+        assert results[2]["error"].startswith("Invalid request")
+
+    def test_stream_endpoint(self, client, mock_rust_module, monkeypatch):
+        """The endpoint accepts and returns NDJSON"""
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markups",
+            AsyncMock(return_value={"ch1": Decimal('15')})
+        )
+        body = "".join(
+            json.dumps({"product_id": f"p{i}", "channel_id": "ch1", "base_price": 100}) + "\n"
+            for i in range(5)
+        )
+
+        response = client.post(
+            "/api/prices/batch-calculate/stream",
+            content=body,
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [result["product_id"] for result in results] == [f"p{i}" for i in range(5)]
+        assert all(result["final_price"] == "115.00" for result in results)
@@ -0,0 +1,208 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock
+
+from app.api.channels import ChannelsUnavailable
+from app.core.config import settings
+from app.services.channel_registry import ChannelRegistry, ChannelSnapshot, channel_registry
+
+
+CHANNELS = [
+    {
+        "id": "c1", "name": "Moscow", "slug": "moscow",
+        "metadata": [{"key": "subdomains", "value": "msk, moscow-city"}]
+    },
+    {
+        "id": "c2", "name": "Spb", "slug": "spb",
+        "metadata": [{"key": "subdomain", "value": "piter"}, {"key": "subdomains", "value": "msk,spb2"}]
+    },
+    {
+        "id": "c3", "name": "Kazan", "slug": "msk-slug",
+        "metadata": []
+    },
+]
+
+
+@pytest.mark.unit
+class TestChannelRegistry:
+    """Test the in-memory channel registry"""
+
+    def test_snapshot_index(self):
+        """Index lookups follow the old linear scan: subdomains first, then slug"""
+        snapshot = ChannelSnapshot(CHANNELS)
+
+        assert snapshot.find("moscow-city")["id"] == "c1"
+        assert snapshot.find("msk")["id"] == "c1"  # first channel wins
+        assert snapshot.find("piter")["id"] == "c2"
+        assert snapshot.find("spb2")["id"] == "c2"
+        assert snapshot.find("spb")["id"] == "c2"  # slug fallback
+        assert snapshot.find("msk-slug")["id"] == "c3"
+        assert snapshot.find("unknown") is None
+        assert snapshot.by_id["c3"]["name"] == "Kazan"
+
+    @pytest.mark.asyncio
+    async def test_lookups_do_not_refetch(self, monkeypatch):
+        """Channels are loaded once; later lookups are served from the index"""
+        fetch = AsyncMock(return_value=CHANNELS)
+        monkeypatch.setattr("app.api.channels.fetch_saleor_channels", fetch)
+        registry = ChannelRegistry()
+
+        for _ in range(5):
+            assert (await registry.get_by_subdomain("piter"))["id"] == "c2"
+
+        fetch.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_refreshes_are_coalesced(self, monkeypatch):
+        """Concurrent refreshes share one Saleor load"""
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return CHANNELS
+
+        monkeypatch.setattr("app.api.channels.fetch_saleor_channels", fetch)
+        registry = ChannelRegistry()
+
+        snapshots = await asyncio.gather(*(registry.refresh() for _ in range(10)))
+
+        assert calls == 1
+        assert all(snapshot is snapshots[0] for snapshot in snapshots)
+
+    @pytest.mark.asyncio
+    async def test_refresh_does_not_join_stale_load(self, monkeypatch):
+        """A refresh requested while an older load is reading Saleor gets a second load"""
+        channels = [CHANNELS[0]]
+        reading = asyncio.Event()
+        release = asyncio.Event()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            seen = list(channels)
+            reading.set()
+            await release.wait()
+            return seen
+
+        monkeypatch.setattr("app.api.channels.fetch_saleor_channels", fetch)
+        registry = ChannelRegistry()
+
+        first = asyncio.create_task(registry.refresh())
+        await reading.wait()
+        # The channel changes after the first load has already read Saleor
+        channels.append(CHANNELS[1])
+        second = asyncio.create_task(registry.refresh())
+        await asyncio.sleep(0)
+        release.set()
+
+        assert len((await first).channels) == 1
+        assert len((await second).channels) == 2
+        assert calls == 2
+        assert registry.snapshot.by_id.keys() == {"c1", "c2"}
+
+    def test_calculate_by_subdomain_uses_registry(self, client, monkeypatch, sample_channels):
+        """Subdomain pricing resolves the channel from the registry snapshot"""
+        fetch = AsyncMock(return_value=sample_channels)
+        monkeypatch.setattr("app.api.channels.fetch_saleor_channels", fetch)
+
+        for _ in range(3):
+            response = client.post(
+                "/api/prices/calculate-by-subdomain",
+                params={"product_id": "UHJvZHVjdDox", "base_price": 100, "subdomain": "business"}
+            )
+            assert response.status_code == 200
+            assert response.json()["channel_id"] == "demo-pool-2"
+            assert response.json()["final_price"] == "110.00"
+
+        # Startup refresh plus at most one on-demand load
+        assert fetch.await_count <= 2
+
+    def test_channel_webhook_refreshes_registry(self, client, monkeypatch, sample_channels):
+        """Channel webhooks refresh the registry snapshot"""
+        fetch = AsyncMock(return_value=sample_channels)
+        monkeypatch.setattr("app.api.channels.fetch_saleor_channels", fetch)
+        refreshes = channel_registry.refreshes
+
+        response = client.post(
+            "/webhooks/channel-updated",
+            json={"event_type": "CHANNEL_UPDATED", "channel_id": "demo-pool-2", "data": {}}
+        )
+
+        assert response.status_code == 200
+        assert channel_registry.refreshes > refreshes
+
+    def test_channel_webhook_invalid_event(self, client):
+        """Channel updated webhook rejects unrelated events"""
+        response = client.post(
+            "/webhooks/channel-updated",
+            json={"event_type": "PRODUCT_UPDATED", "channel_id": "demo-pool-2", "data": {}}
+        )
+
+        assert response.status_code == 400
+
+
+@pytest.mark.unit
+class TestChannelListCaching:
+    """Test stale-while-revalidate caching of the channel list"""
+
+    @pytest.mark.asyncio
+    async def test_stale_if_error_keeps_last_good_snapshot(self, monkeypatch):
+        """A failed refresh keeps serving live channels instead of demo data"""
+        fetch = AsyncMock(return_value=CHANNELS)
+        monkeypatch.setattr("app.api.channels.fetch_saleor_channels", fetch)
+        registry = ChannelRegistry()
+        good = await registry.refresh()
+
+        fetch.side_effect = ChannelsUnavailable("timeout", "Offline")
+        snapshot = await registry.refresh()
+
+        assert snapshot is good
+        assert snapshot.channels == CHANNELS
+        assert registry.last_error == "timeout"
+
+    @pytest.mark.asyncio
+    async def test_demo_data_without_previous_snapshot(self, monkeypatch):
+        """Without any good snapshot the registry still falls back to demo channels"""
+        monkeypatch.setattr(
+            "app.api.channels.fetch_saleor_channels",
+            AsyncMock(side_effect=ChannelsUnavailable("timeout", "Offline"))
+        )
+        registry = ChannelRegistry()
+
+        snapshot = await registry.refresh()
+
+        assert not snapshot.live
+        assert snapshot.find("pool1")["id"] == "demo-pool-1"
+
+    def test_fresh_response_headers(self, client):
+        """Responses report snapshot age and freshness"""
+        response = client.get("/api/channels/")
+
+        assert response.status_code == 200
+        assert response.headers["X-Cache-Status"] == "fresh"
+        assert int(response.headers["Age"]) >= 0
+
+    def test_stale_snapshot_is_served_and_revalidated(self, client, monkeypatch):
+        """Past the soft TTL the stale snapshot is served while refreshing in the background"""
+        fetch = AsyncMock(return_value=CHANNELS)
+        monkeypatch.setattr("app.api.channels.fetch_saleor_channels", fetch)
+        monkeypatch.setattr(settings, "CHANNEL_LIST_SOFT_TTL", 0.0)
+        client.get("/metrics")  # wait for the startup refresh
+        calls = fetch.await_count
+
+        response = client.get("/api/channels/")
+
+        assert response.status_code == 200
+        assert response.headers["X-Cache-Status"] == "stale-while-revalidate"
+        client.get("/metrics")
+        assert fetch.await_count > calls
+
+    def test_subdomain_filter(self, client):
+        """Subdomain filter uses the snapshot index"""
+        response = client.get("/api/channels/", params={"subdomain": "gold"})
+
+        assert response.status_code == 200
+        assert [channel["id"] for channel in response.json()] == ["demo-pool-3"]
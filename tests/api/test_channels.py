@@ -1,5 +1,5 @@
 import pytest
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 
 
 @pytest.mark.unit
@@ -76,4 +76,44 @@ class TestChannelsEndpoint:
         )
         
         assert response.status_code == 400
-        assert "Failed to update channel markup" in response.json()["detail"]
\ No newline at end of file
+        assert "Failed to update channel markup" in response.json()["detail"]
+        
+    @pytest.mark.asyncio
+    async def test_channel_markups_from_metadata(self, mock_redis, monkeypatch):
+        """Markups come from the channels response; only channels without one hit Redis, in one MGET"""
+        from app.api.channels import _load_saleor_channels
+        
+        
+        def response(payload):
+            mock_response = MagicMock()
+            mock_response.is_success = True
+            mock_response.json.return_value = payload
+            return mock_response
+        
+        channels = [
+            {"id": f"ch{i}", "name": f"Store {i}", "slug": f"store-{i}",
+             "metadata": [{"key": "price_markup_percent", "value": str(i)}]}
+            for i in range(1, 60)
+        ]
+        channels.append({"id": "ch-bare", "name": "Bare", "slug": "bare", "metadata": []})
+        mock_post = AsyncMock(side_effect=[
+            response({"data": {"shop": {"name": "Shop"}}}),
+            response({"data": {"channels": channels}}),
+        ])
+        monkeypatch.setattr("app.saleor.client.saleor_client.post", mock_post)
+        mock_redis.mget.side_effect = None
+        mock_redis.mget.return_value = [b'7.5']
+        mock_get_markup = AsyncMock()
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markup",
+            mock_get_markup
+        )
+        
+        result = await _load_saleor_channels()
+        
+        assert len(result) == 60
+        assert result[0]["markup_percent"] == "1"
+        assert result[-1]["markup_percent"] == "7.5"
+        mock_get_markup.assert_not_called()
+        mock_redis.mget.assert_awaited_once_with(["channel_markup:ch-bare"])
+        assert mock_post.await_count == 2
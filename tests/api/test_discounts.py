@@ -0,0 +1,101 @@
+import pytest
+import random
+from datetime import datetime, timedelta
+import pytz
+
+from app.services.discount_service import (
+    discount_service,
+    CompiledSchedule,
+    _croniter_matches,
+)
+
+
+CRON_EXPRESSIONS = [
+    "* * * * *",
+    "0 9-17 * * 1-5",
+    "5 4 * * *",
+    "*/15 * * * *",
+    "5/20 */3 * * *",
+    "0,30 8-20/2 1-15 * *",
+    "0 0 1 * 1",
+    "0 12 * jan-mar sun,sat",
+    "30 18 * * 7",
+    "15 10 13 * 5",
+]
+
+
+@pytest.mark.unit
+class TestCompiledDiscounts:
+    """Test compiled discount schedules against croniter"""
+    
+    @pytest.mark.parametrize("schedule", CRON_EXPRESSIONS)
+    def test_bitset_matches_croniter(self, schedule):
+        """Bitset evaluation agrees with the croniter-based check"""
+        compiled = CompiledSchedule(schedule)
+        assert not compiled.fallback
+        
+        rng = random.Random(schedule)
+        start = datetime(2025, 1, 1, tzinfo=pytz.UTC)
+        for _ in range(300):
+            moment = start + timedelta(minutes=rng.randrange(0, 366 * 24 * 60), seconds=rng.randrange(60))
+            assert compiled.matches(moment) == _croniter_matches(schedule, moment), moment
+            
+    @pytest.mark.parametrize("schedule", CRON_EXPRESSIONS)
+    def test_bitset_matches_every_croniter_fire_time(self, schedule):
+        """Every run time produced by croniter is active in the compiled form"""
+        from croniter import croniter
+        compiled = CompiledSchedule(schedule)
+        
+        runs = croniter(schedule, datetime(2025, 2, 27, tzinfo=pytz.UTC))
+        for _ in range(200):
+            fire_time = runs.get_next(datetime)
+            assert compiled.matches(fire_time), fire_time
+            assert compiled.matches(fire_time + timedelta(seconds=59))
+            
+    def test_unsupported_syntax_falls_back_to_croniter(self):
+        """Expressions outside the bitset grammar still evaluate"""
+        compiled = CompiledSchedule("0 0 L * *")
+        assert compiled.fallback
+        assert compiled.matches(datetime(2025, 1, 31, 0, 0, tzinfo=pytz.UTC))
+        assert not compiled.matches(datetime(2025, 1, 30, 0, 0, tzinfo=pytz.UTC))
+        
+    def test_invalid_schedule_defaults_to_active(self):
+        """Invalid cron keeps the old 'always active' behaviour"""
+        assert CompiledSchedule("not a cron").matches(datetime.now(pytz.UTC))
+        
+    def test_period_bounds(self):
+        """Period is evaluated against epoch bounds, invalid period disables discount"""
+        discounts_json = (
+            '[{"percent": 10, "cap": "0", "shedule": "* * * * *", '
+            '"period": {"datetime_start": "01-06-2025T00:00:00Z", "datetime_end": "30-06-2025T23:59:59Z"}}]'
+        )
+        inside = datetime(2025, 6, 15, 12, 0, tzinfo=pytz.UTC)
+        outside = datetime(2025, 7, 1, 0, 0, tzinfo=pytz.UTC)
+        
+        assert discount_service.get_active_discount_from_json(discounts_json, inside)["percent"] == 10
+        assert discount_service.get_active_discount_from_json(discounts_json, outside) is None
+        
+        broken = '[{"percent": 10, "cap": "0", "period": {"datetime_start": "2025-06-01", "datetime_end": "x"}}]'
+        assert discount_service.get_active_discount_from_json(broken, inside) is None
+        
+    def test_compiled_discounts_cached_by_metadata_string(self):
+        """Same metadata string yields the same compiled object"""
+        discounts_json = '[{"percent": -5, "cap": "10", "shedule": "0 9-17 * * 1-5"}]'
+        
+        first = discount_service.compile_discounts(discounts_json)
+        second = discount_service.compile_discounts(discounts_json)
+        
+        assert first is second
+        assert first.discounts == [{"percent": -5, "cap": "10", "shedule": "0 9-17 * * 1-5"}]
+        
+    def test_first_active_discount_wins(self):
+        """Order of discounts in metadata is preserved"""
+        discounts_json = (
+            '[{"percent": 5, "cap": "0", "shedule": "0 9-17 * * 1-5"}, '
+            '{"percent": 1, "cap": "0", "shedule": "* * * * *"}]'
+        )
+        weekday_noon = datetime(2025, 6, 4, 12, 0, tzinfo=pytz.UTC)
+        sunday_noon = datetime(2025, 6, 8, 12, 0, tzinfo=pytz.UTC)
+        
+        assert discount_service.get_active_discount_from_json(discounts_json, weekday_noon)["percent"] == 5
+        assert discount_service.get_active_discount_from_json(discounts_json, sunday_noon)["percent"] == 1
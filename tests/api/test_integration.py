@@ -161,8 +161,8 @@ class TestIntegrationWorkflows:
         
         # Mock Rust module to return expected calculation
         mock_rust = monkeypatch.setattr(
-            "app.services.price_calculator.price_calculator.calculate_price",
-            lambda base, markup: str(calculation_data["expected"]["final_price"])
+            "app.services.price_calculator.price_calculator.calculate_final_price",
+            lambda base, markup, percent, cap, active: str(calculation_data["expected"]["final_price"])
         )
         
         request_data = {
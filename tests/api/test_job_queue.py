@@ -0,0 +1,332 @@
+import pytest
+import asyncio
+import json
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+from app.core.config import settings
+from app.services.job_queue import JobQueue, Job
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_RETRY_BACKOFF", 0.001)
+    monkeypatch.setattr(settings, "WEBHOOK_JOB_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "WEBHOOK_WORKER_CONCURRENCY", 2)
+
+
+def _streams_redis():
+    """Redis mock with the stream commands the queue uses"""
+    redis = MagicMock()
+    for command in ("xgroup_create", "xadd", "xack", "xdel", "zadd", "zrem", "zrangebyscore", "xlen", "zcard"):
+        setattr(redis, command, AsyncMock())
+    redis.xpending = AsyncMock(return_value={"pending": 0})
+    return redis
+
+
+async def _wait_for(condition, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        await asyncio.sleep(0.005)
+
+
+@pytest.mark.unit
+class TestLocalJobQueue:
+    """Test the in-process stand-in queue (no Redis Streams)"""
+
+    @pytest.mark.asyncio
+    async def test_jobs_run_with_bounded_concurrency(self, fast_retries):
+        """Jobs run on the worker pool, never more than WEBHOOK_WORKER_CONCURRENCY at once"""
+        queue = JobQueue()
+        running = peak = done = 0
+
+        async def handler(product_id):
+            nonlocal running, peak, done
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+            done += 1
+
+        queue.register("recalc", handler)
+        await queue.start()
+        try:
+            for i in range(10):
+                await queue.enqueue("recalc", product_id=f"p{i}")
+            await _wait_for(lambda: done == 10)
+        finally:
+            await queue.stop()
+
+        assert peak <= 2
+        assert queue.processed == 10
+
+    @pytest.mark.asyncio
+    async def test_retries_then_dead_letter(self, fast_retries):
+        """A failing job is retried with backoff and then dead-lettered"""
+        queue = JobQueue()
+        handler = AsyncMock(side_effect=RuntimeError("Saleor down"))
+        on_dead_letter = AsyncMock()
+        queue.register("recalc", handler, on_dead_letter=on_dead_letter)
+        await queue.start()
+        try:
+            await queue.enqueue("recalc", product_id="p1")
+            await _wait_for(lambda: queue.dead_lettered == 1)
+            stats = await queue.stats()
+        finally:
+            await queue.stop()
+
+        assert handler.await_count == 3
+        assert queue.retried == 2
+        on_dead_letter.assert_awaited_once_with("Saleor down", product_id="p1")
+        assert stats["backend"] == "local"
+        assert stats["dead_letter"] == 1
+        assert stats["depth"] == 0
+
+
+@pytest.mark.unit
+class TestDebouncing:
+    """Test per-key coalescing of jobs"""
+
+    @pytest.mark.asyncio
+    async def test_events_in_window_collapse_into_one_job(self, fast_retries):
+        """Events for one key inside the window run once, with the latest payload"""
+        queue = JobQueue()
+        handler = AsyncMock()
+        queue.register("recalc", handler)
+        await queue.start()
+        try:
+            for version in range(3):
+                await queue.enqueue_debounced("recalc", "p1", 0.02, 1.0, product_id="p1", version=version)
+            await queue.enqueue_debounced("recalc", "p2", 0.02, 1.0, product_id="p2", version=0)
+            await _wait_for(lambda: handler.await_count == 2)
+            await asyncio.sleep(0.05)
+        finally:
+            await queue.stop()
+
+        assert handler.await_count == 2
+        handler.assert_any_await(product_id="p1", version=2)
+        assert queue.coalesced_events == 2
+
+    @pytest.mark.asyncio
+    async def test_max_delay_bounds_the_window(self, fast_retries):
+        """A steady stream of events still runs once max_delay after the first event"""
+        queue = JobQueue()
+        handler = AsyncMock()
+        queue.register("recalc", handler)
+        await queue.start()
+        try:
+            started = time.monotonic()
+            while not handler.await_count:
+                assert time.monotonic() - started < 1.0
+                await queue.enqueue_debounced("recalc", "p1", 0.05, 0.1, product_id="p1")
+                await asyncio.sleep(0.01)
+        finally:
+            await queue.stop()
+
+        assert time.monotonic() - started < 0.5
+
+    @pytest.mark.asyncio
+    async def test_redis_window_is_extended_atomically(self, monkeypatch):
+        """With Redis the window lives in a sorted set updated by one script call"""
+        redis = _streams_redis()
+        redis.eval = AsyncMock(side_effect=[1, 0])
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        queue = JobQueue()
+        queue.backend = "redis"
+
+        await queue.enqueue_debounced("recalc", "p1", 2.0, 10.0, product_id="p1")
+        await queue.enqueue_debounced("recalc", "p1", 2.0, 10.0, product_id="p1")
+
+        args = redis.eval.call_args.args
+        assert args[1:5] == (3, *queue._debounce_keys())
+        assert args[5] == "recalc:p1"
+        assert args[7:9] == (2.0, 10.0)
+        assert queue.coalesced_events == 1
+        redis.xadd.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_redis_flush_enqueues_closed_windows(self, monkeypatch):
+        """Closed windows are moved to the stream inside the pop script, by whichever process pops them"""
+        redis = _streams_redis()
+        redis.zrangebyscore.return_value = [b"recalc:p1", b"recalc:p2"]
+        redis.eval = AsyncMock(side_effect=[1, 0])
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        queue = JobQueue()
+
+        await queue._flush_debounced()
+
+        args = redis.eval.call_args_list[0].args
+        assert args[1:6] == (4, *queue._debounce_keys(), settings.WEBHOOK_QUEUE_STREAM)
+        assert args[6] == b"recalc:p1"
+        # Popping the window and XADD are one script call - no separate round trip
+        redis.xadd.assert_not_called()
+        assert queue.enqueued == 1
+
+
+@pytest.mark.unit
+class TestRedisJobQueue:
+    """Test the Redis Streams backend"""
+
+    @pytest.mark.asyncio
+    async def test_failed_job_is_scheduled_for_retry(self, fast_retries, monkeypatch):
+        """A failure schedules the next attempt in the delayed set and acks the message"""
+        redis = _streams_redis()
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        queue = JobQueue()
+        queue.register("recalc", AsyncMock(side_effect=RuntimeError("boom")))
+
+        await queue._process_redis(Job("recalc", {"product_id": "p1"}, attempt=1, message_id="1-0"))
+
+        member, due = next(iter(redis.zadd.call_args.args[1].items()))
+        assert json.loads(member)["attempt"] == "2"
+        assert due > time.time() - 1
+        redis.xack.assert_awaited_once_with(settings.WEBHOOK_QUEUE_STREAM, settings.WEBHOOK_QUEUE_GROUP, "1-0")
+        redis.xdel.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_last_attempt_goes_to_dead_letter(self, fast_retries, monkeypatch):
+        """The last failed attempt lands in the dead-letter stream"""
+        redis = _streams_redis()
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        queue = JobQueue()
+        queue.register("recalc", AsyncMock(side_effect=RuntimeError("boom")))
+
+        await queue._process_redis(Job("recalc", {"product_id": "p1"}, attempt=3, message_id="1-0"))
+
+        stream, fields = redis.xadd.call_args.args
+        assert stream == f"{settings.WEBHOOK_QUEUE_STREAM}:dead"
+        assert fields["error"] == "boom"
+        redis.zadd.assert_not_called()
+        redis.xack.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_due_retries_are_promoted_once(self, monkeypatch):
+        """Due retries move back to the stream only for the process whose ZREM wins"""
+        redis = _streams_redis()
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        won = json.dumps(Job("recalc", {"product_id": "p1"}, attempt=2).fields())
+        lost = json.dumps(Job("recalc", {"product_id": "p2"}, attempt=2).fields())
+        redis.zrangebyscore.return_value = [won, lost]
+        redis.zrem.side_effect = [1, 0]
+
+        await JobQueue()._promote_delayed()
+
+        redis.xadd.assert_awaited_once()
+        assert json.loads(redis.xadd.call_args.args[1]["payload"]) == {"product_id": "p1"}
+
+    @pytest.mark.asyncio
+    async def test_stale_jobs_are_handed_back_to_workers(self, fast_retries, monkeypatch):
+        """Reclaimed messages are re-queued for the worker pool, not run in the maintenance task"""
+        redis = _streams_redis()
+        stale = Job("recalc", {"product_id": "p1"}, attempt=1).fields()
+        exhausted = Job("recalc", {"product_id": "p2"}, attempt=3).fields()
+        redis.xautoclaim = AsyncMock(return_value=["0-0", [(b"1-0", stale), (b"2-0", exhausted)], []])
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        queue = JobQueue()
+        handler = AsyncMock()
+        queue.register("recalc", handler)
+
+        await queue._reclaim_stale("maintenance")
+
+        handler.assert_not_called()
+        (requeued_stream, requeued), (dead_stream, dead) = [call.args for call in redis.xadd.call_args_list]
+        assert requeued_stream == settings.WEBHOOK_QUEUE_STREAM
+        assert (requeued["job_id"], requeued["attempt"]) == (stale["job_id"], "2")
+        assert dead_stream == f"{settings.WEBHOOK_QUEUE_STREAM}:dead"
+        assert dead["job_id"] == exhausted["job_id"]
+        assert [call.args[2] for call in redis.xack.call_args_list] == ["1-0", "2-0"]
+
+    @pytest.mark.asyncio
+    async def test_enqueue_falls_back_to_local_queue(self, monkeypatch):
+        """If XADD fails the job still runs in this process"""
+        redis = _streams_redis()
+        redis.xadd.side_effect = ConnectionError("redis down")
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        queue = JobQueue()
+        queue.backend = "redis"
+
+        await queue.enqueue("recalc", product_id="p1")
+
+        assert queue.enqueue_fallbacks == 1
+        assert queue._local.qsize() == 1
+
+    @pytest.mark.asyncio
+    async def test_running_job_keeps_its_message_claimed(self, monkeypatch):
+        """A job running past the visibility timeout renews its message instead of being reclaimed"""
+        monkeypatch.setattr(settings, "WEBHOOK_JOB_VISIBILITY_TIMEOUT", 0.03)
+        redis = _streams_redis()
+        redis.xclaim = AsyncMock(return_value=[b"1-0"])
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        queue = JobQueue()
+
+        async def slow_handler(product_id):
+            await asyncio.sleep(0.05)
+
+        queue.register("recalc", slow_handler)
+
+        await queue._process_redis(Job("recalc", {"product_id": "p1"}, message_id="1-0"), "host:1:0")
+
+        redis.xclaim.assert_awaited_with(
+            settings.WEBHOOK_QUEUE_STREAM, settings.WEBHOOK_QUEUE_GROUP, "host:1:0", 0, ["1-0"], justid=True
+        )
+        assert redis.xclaim.await_count >= 2
+        await asyncio.sleep(0.03)
+        count = redis.xclaim.await_count
+        await asyncio.sleep(0.03)
+        assert redis.xclaim.await_count == count  # renewal stops with the job
+
+    @pytest.mark.asyncio
+    async def test_stop_hands_local_jobs_to_redis(self, fast_retries, monkeypatch):
+        """Jobs still waiting in the local fallback queue move to the stream on shutdown"""
+        redis = _streams_redis()
+        redis.xadd.side_effect = [ConnectionError("redis down"), None, None]
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+        queue = JobQueue()
+        queue.backend = "redis"
+        await queue.enqueue("recalc", product_id="p1")
+        queue._schedule_local_retry(Job("recalc", {"product_id": "p2"}, attempt=2), 60)
+
+        await queue.stop()
+
+        handed_over = [call.args[1] for call in redis.xadd.call_args_list[1:]]
+        assert [json.loads(fields["payload"])["product_id"] for fields in handed_over] == ["p2", "p1"]
+        assert handed_over[0]["attempt"] == "2"
+
+    @pytest.mark.asyncio
+    async def test_stop_logs_dropped_local_jobs(self, monkeypatch, capsys):
+        """Without Redis the jobs left at shutdown are logged instead of silently lost"""
+        monkeypatch.setattr("app.services.markup_service.markup_service.redis", None)
+        queue = JobQueue()
+        await queue.enqueue("recalc", product_id="p1")
+
+        await queue.stop()
+
+        assert "dropped on shutdown" in capsys.readouterr().out
+
+
+@pytest.mark.unit
+class TestProductWebhookQueue:
+    """Test that product webhooks go through the job queue"""
+
+    def test_webhook_enqueues_recalculation(self, client, monkeypatch):
+        """The webhook only enqueues; a queue worker runs the recalculation"""
+        mock_recalculate = AsyncMock()
+        monkeypatch.setattr("app.api.webhooks.recalculate_product_prices", mock_recalculate)
+        monkeypatch.setattr(settings, "PRODUCT_WEBHOOK_DEBOUNCE_WINDOW", 0.01)
+
+        for _ in range(3):
+            response = client.post(
+                "/webhooks/product-updated",
+                json={"event_type": "PRODUCT_UPDATED", "product_id": "UHJvZHVjdDox", "data": {}}
+            )
+            assert response.status_code == 200
+
+        for _ in range(50):
+            if mock_recalculate.await_count:
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+        # Three events inside the window collapse into one recalculation
+        mock_recalculate.assert_awaited_once_with("UHJvZHVjdDox", None)
+        assert client.get("/metrics").json()["job_queue"]["processed"] >= 1
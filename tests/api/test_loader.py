@@ -0,0 +1,75 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock
+
+from app.saleor.loader import BatchLoader, use_loader, current_loader
+from app.saleor import api as saleor_api
+
+
+@pytest.mark.unit
+class TestBatchLoader:
+    """Test DataLoader-style batching of Saleor lookups"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_loads_resolved_in_one_batch(self):
+        """Keys requested in the same tick go to the batch function together"""
+        batch_fn = AsyncMock(side_effect=lambda keys: {key: f"value-{key}" for key in keys})
+        loader = BatchLoader(batch_fn)
+        
+        results = await asyncio.gather(*(loader.load(key) for key in ["a", "b", "a", "c"]))
+        
+        assert results == ["value-a", "value-b", "value-a", "value-c"]
+        batch_fn.assert_called_once_with(["a", "b", "c"])
+        assert loader.dispatches == 1
+        
+    @pytest.mark.asyncio
+    async def test_loaded_keys_are_memoized(self):
+        """A key loaded earlier in the request is not fetched again"""
+        batch_fn = AsyncMock(side_effect=lambda keys: {key: key.upper() for key in keys})
+        loader = BatchLoader(batch_fn)
+        
+        assert await loader.load("x") == "X"
+        assert await loader.load("x") == "X"
+        
+        batch_fn.assert_called_once_with(["x"])
+        
+    @pytest.mark.asyncio
+    async def test_batch_errors_propagate_to_every_waiter(self):
+        """A failed batch fails all pending loads"""
+        loader = BatchLoader(AsyncMock(side_effect=RuntimeError("Saleor down")))
+        
+        results = await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+        
+        assert all(isinstance(result, RuntimeError) for result in results)
+        
+    @pytest.mark.asyncio
+    async def test_products_by_ids_uses_single_aliased_query(self, monkeypatch):
+        """Product IDs are resolved with one aliased GraphQL document"""
+        execute = AsyncMock(return_value={"data": {
+            "n0": {"id": "UHJvZHVjdDox", "metadata": []},
+            "n1": None
+        }})
+        monkeypatch.setattr("app.saleor.api.saleor_client.execute", execute)
+        
+        result = await saleor_api.get_products_by_ids(["UHJvZHVjdDox", "UHJvZHVjdDoy", "UHJvZHVjdDox"])
+        
+        assert result == {"UHJvZHVjdDox": {"id": "UHJvZHVjdDox", "metadata": []}, "UHJvZHVjdDoy": None}
+        execute.assert_called_once()
+        query, variables = execute.call_args.args
+        assert "n0: product(id: $id0)" in query
+        assert "n1: product(id: $id1)" in query
+        assert variables == {"id0": "UHJvZHVjdDox", "id1": "UHJvZHVjdDoy"}
+        
+    @pytest.mark.asyncio
+    async def test_get_product_routes_through_active_loader(self, monkeypatch):
+        """get_product uses the request loader inside use_loader()"""
+        batch = AsyncMock(side_effect=lambda ids: {product_id: {"id": product_id} for product_id in ids})
+        monkeypatch.setattr("app.saleor.api.get_products_by_ids", batch)
+        
+        with use_loader():
+            assert current_loader() is not None
+            products = await asyncio.gather(*(saleor_api.get_product(f"p{i}") for i in range(50)))
+        
+        assert current_loader() is None
+        assert [product["id"] for product in products] == [f"p{i}" for i in range(50)]
+        batch.assert_called_once()
@@ -0,0 +1,126 @@
+import pytest
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+from app.core.config import settings
+from app.models.schemas import PriceMatrixRequest
+from app.services.channel_registry import ChannelSnapshot
+from app.services.discount_service import discount_service
+from app.services.price_calculator import calculate_final_price, calculate_prices_columnar_async
+from app.services.price_matrix import calculate_price_matrix, PriceMatrixTooLarge
+
+
+DISCOUNTED = {
+    "id": "p1",
+    "metadata": [{"key": "discounts", "value": '[{"percent": -10, "cap": "0"}]'}]
+}
+PLAIN = {"id": "p2", "metadata": []}
+
+
+@pytest.mark.unit
+class TestPriceMatrix:
+    """Test the products x channels price matrix"""
+
+    @pytest.fixture
+    def markups(self, monkeypatch):
+        mock = AsyncMock(return_value={"ch1": Decimal('15'), "ch2": Decimal('5')})
+        monkeypatch.setattr("app.services.markup_service.markup_service.get_channel_markups", mock)
+        return mock
+
+    @pytest.mark.asyncio
+    async def test_matrix_by_product_ids(self, mock_rust_module, markups, monkeypatch):
+        """Each product is fetched once and priced across all channels in one columnar call"""
+        get_product = AsyncMock(side_effect=lambda product_id: {"p1": DISCOUNTED, "p2": PLAIN}.get(product_id))
+        monkeypatch.setattr("app.services.pricing_context.get_product", get_product)
+        columnar = AsyncMock(wraps=calculate_prices_columnar_async)
+        monkeypatch.setattr("app.services.price_matrix.calculate_prices_columnar_async", columnar)
+
+        matrix = await calculate_price_matrix(PriceMatrixRequest(
+            product_ids=["p1", "p2", "p3"],
+            channel_ids=["ch1", "ch2"],
+            base_prices={"p1": Decimal('100'), "p2": Decimal('19.99')}
+        ))
+
+        assert matrix.channels == ["ch1", "ch2"]
+        assert matrix.markups == ["15", "5"]
+        assert matrix.rows[0].prices == ["103.50", "94.50"]
+        assert matrix.rows[0].discount_percent == "-10"
+        assert matrix.rows[1].prices == ["22.99", "20.99"]
+        assert matrix.rows[2].error == "Base price is not set"
+        assert get_product.await_count == 3
+        columnar.assert_awaited_once()
+
+        discount = discount_service.compile_discounts(
+            discount_service.extract_discounts_json(DISCOUNTED)
+        ).get_active_compiled()
+        assert matrix.rows[0].prices[1] == str(calculate_final_price(Decimal('100'), Decimal('5'), discount))
+
+    @pytest.mark.asyncio
+    async def test_bad_discount_fails_only_its_row(self, mock_rust_module, markups, monkeypatch):
+        """A malformed discount sets the error of its row; the other rows are priced"""
+        broken = {"id": "p3", "metadata": [{"key": "discounts", "value": '[{"percent": "ten", "cap": "0"}]'}]}
+        bad_cron = {"id": "p4", "metadata": [
+            {"key": "discounts", "value": '[{"percent": -10, "cap": "0", "shedule": "every day"}]'}
+        ]}
+        products = {"p1": DISCOUNTED, "p2": PLAIN, "p3": broken, "p4": bad_cron}
+        monkeypatch.setattr(
+            "app.services.pricing_context.get_product", AsyncMock(side_effect=lambda product_id: products[product_id])
+        )
+
+        matrix = await calculate_price_matrix(PriceMatrixRequest(
+            product_ids=["p1", "p3", "p2", "p4"], channel_ids=["ch1"], default_base_price=Decimal('100')
+        ))
+
+        assert [row.prices for row in matrix.rows] == [["103.50"], [], ["115.00"], ["103.50"]]
+        assert matrix.rows[1].error.startswith("Discount calculation failed")
+        assert [row.error for row in matrix.rows if row.product_id != "p3"] == [None, None, None]
+
+    @pytest.mark.asyncio
+    async def test_matrix_from_product_page(self, mock_rust_module, markups, monkeypatch):
+        """A product page is priced without refetching products"""
+        async def pages(channel_slug=None, page_size=None, after=None, prefetch=None):
+            assert (channel_slug, page_size, after) == ("ch-one", 2, "cursor-1")
+            yield [DISCOUNTED, PLAIN], "cursor-2"
+
+        get_product = AsyncMock()
+        monkeypatch.setattr("app.services.price_matrix.iter_product_pages", pages)
+        monkeypatch.setattr("app.services.pricing_context.get_product", get_product)
+
+        matrix = await calculate_price_matrix(PriceMatrixRequest(
+            channel_slug="ch-one", first=2, after="cursor-1",
+            channel_ids=["ch1"], default_base_price=Decimal('10')
+        ))
+
+        assert [row.product_id for row in matrix.rows] == ["p1", "p2"]
+        assert [row.prices for row in matrix.rows] == [["10.35"], ["11.50"]]
+        assert matrix.next_cursor == "cursor-2"
+        get_product.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_matrix_size_limit(self, monkeypatch):
+        """Oversized matrices are rejected before any pricing"""
+        monkeypatch.setattr(settings, "PRICE_MATRIX_MAX_CELLS", 3)
+
+        with pytest.raises(PriceMatrixTooLarge):
+            await calculate_price_matrix(PriceMatrixRequest(
+                product_ids=["p1", "p2"], channel_ids=["ch1", "ch2"], default_base_price=Decimal('10')
+            ))
+
+    def test_matrix_endpoint_uses_registry_channels(self, client, mock_rust_module, monkeypatch):
+        """Without channel_ids the columns are the registry channels"""
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markups",
+            AsyncMock(side_effect=lambda ids: {channel_id: Decimal('10') for channel_id in ids})
+        )
+        monkeypatch.setattr("app.services.pricing_context.get_product", AsyncMock(return_value=PLAIN))
+        monkeypatch.setattr(
+            "app.services.price_matrix.channel_registry.get_snapshot",
+            AsyncMock(return_value=ChannelSnapshot([{"id": "ch1", "slug": "one"}, {"id": "ch2", "slug": "two"}]))
+        )
+
+        response = client.post("/api/prices/matrix", json={"product_ids": ["p2"], "default_base_price": 100})
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["channels"] == ["ch1", "ch2"]
+        assert data["rows"][0]["prices"] == ["110.00", "110.00"]
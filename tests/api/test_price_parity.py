@@ -0,0 +1,106 @@
+import pytest
+import random
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+from app.services.discount_service import discount_service, CompiledDiscount
+from app.services.price_calculator import (
+    _python_calculate_price,
+    _python_calculate_final_price,
+    calculate_final_price,
+    calculate_price_with_markup,
+)
+
+try:
+    import price_calculator as rust_price_calculator
+except ImportError:
+    rust_price_calculator = None
+
+
+# (base_price, markup_percent, discount_percent, cap)
+EDGE_CASES = [
+    ("100", "15", "-10", "0"),
+    ("100", "15", "-50", "80"),      # cap is the minimum price for a discount
+    ("100", "15", "20", "130"),      # cap is the maximum price for a markup
+    ("100", "15", "20", "200"),      # cap not reached
+    ("100", "15", "0", "50"),        # zero percent ignores the cap
+    ("0.01", "50", "-50", "0"),      # half-even tie on the final rounding
+    ("0.05", "50", "0", "0"),        # half-even tie on the markup rounding
+    ("10.005", "0.125", "-33.333", "0"),
+    ("999999.99", "250", "-99.99", "1"),
+    ("19.99", "-15", "12.5", "0"),
+    ("0", "15", "-10", "5"),
+]
+
+
+def _legacy_final_price(base: str, markup: str, percent: str, cap: str) -> Decimal:
+    """The original composition: markup, then DiscountService.apply_discount"""
+    marked = Decimal(_python_calculate_price(base, markup))
+    return discount_service.apply_discount(marked, {"percent": percent, "cap": cap})
+
+
+def _random_cases(count: int):
+    rng = random.Random(20250101)
+    for _ in range(count):
+        base = "{}.{:02d}".format(rng.randrange(0, 100000), rng.randrange(100))
+        markup = "{}.{:02d}".format(rng.randrange(-50, 300), rng.randrange(100))
+        percent = "{}.{:03d}".format(rng.randrange(-99, 100), rng.randrange(1000))
+        cap = rng.choice(["0", str(rng.randrange(1, 200000))])
+        yield base, markup, percent, cap
+
+
+@pytest.mark.unit
+class TestFinalPriceParity:
+    """The single-call pipeline must price exactly like markup + apply_discount"""
+
+    @pytest.mark.parametrize("base,markup,percent,cap", EDGE_CASES)
+    def test_python_pipeline_matches_legacy(self, base, markup, percent, cap):
+        result = _python_calculate_final_price(base, markup, percent, cap, True)
+        assert Decimal(result) == _legacy_final_price(base, markup, percent, cap)
+
+    def test_python_pipeline_matches_legacy_random(self):
+        for base, markup, percent, cap in _random_cases(2000):
+            result = _python_calculate_final_price(base, markup, percent, cap, True)
+            assert Decimal(result) == _legacy_final_price(base, markup, percent, cap), (base, markup, percent, cap)
+
+    def test_inactive_discount_is_markup_only(self):
+        for base, markup, percent, cap in _random_cases(200):
+            result = _python_calculate_final_price(base, markup, percent, cap, False)
+            assert result == _python_calculate_price(base, markup)
+
+    @pytest.mark.skipif(rust_price_calculator is None or not hasattr(rust_price_calculator, "calculate_final_price"),
+                        reason="Rust module not built")
+    def test_rust_matches_python(self):
+        cases = list(EDGE_CASES) + list(_random_cases(2000))
+        for base, markup, percent, cap in cases:
+            for active in (True, False):
+                expected = _python_calculate_final_price(base, markup, percent, cap, active)
+                assert rust_price_calculator.calculate_final_price(base, markup, percent, cap, active) == expected
+
+    def test_wrapper_passes_compiled_discount(self, mock_rust_module):
+        discount = CompiledDiscount({"percent": -20, "cap": "100"})
+
+        result = calculate_final_price(Decimal("100"), Decimal("15"), discount)
+
+        assert result == Decimal("100.00")
+        mock_rust_module.calculate_final_price.assert_called_once_with("100", "15", "-20", "100", True)
+
+    @pytest.mark.asyncio
+    async def test_calculate_price_with_active_discount(self, mock_rust_module, monkeypatch):
+        """Active product discount is applied inside the single pipeline call"""
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markup",
+            AsyncMock(return_value=Decimal('15'))
+        )
+        monkeypatch.setattr(
+            "app.services.pricing_context.get_product",
+            AsyncMock(return_value={
+                "id": "UHJvZHVjdDox",
+                "metadata": [{"key": "discounts", "value": '[{"percent": -10, "cap": "0"}]'}]
+            })
+        )
+
+        result = await calculate_price_with_markup("UHJvZHVjdDox", "Q2hhbm5lbDox", Decimal('100'))
+
+        assert result == Decimal("103.50")
+        mock_rust_module.calculate_final_price.assert_called_once_with("100", "15", "-10", "0", True)
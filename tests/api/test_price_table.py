@@ -0,0 +1,177 @@
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest.mock import AsyncMock
+import pytz
+
+from app.core.config import settings
+from app.models.schemas import BatchPriceCalculationResult
+from app.services.discount_service import discount_service
+from app.services.price_table import PriceTable, PriceEntry
+from app.services.pricing_context import PricingContext
+
+
+class FakeHashRedis:
+    """Just enough of Redis hashes for the price table"""
+
+    def __init__(self):
+        self.hashes = {}
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    async def hscan(self, key, cursor, count=None):
+        return 0, dict(self.hashes.get(key, {}))
+
+    async def delete(self, key):
+        return 1 if self.hashes.pop(key, None) is not None else 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def hset(self, key, mapping):
+        self.commands.append(lambda: self.redis.hashes.setdefault(key, {}).update(mapping))
+
+    def hmget(self, key, fields):
+        self.commands.append(lambda: [self.redis.hashes.get(key, {}).get(field) for field in fields])
+
+    def hdel(self, key, *fields):
+        self.commands.append(lambda: [self.redis.hashes.get(key, {}).pop(field, None) for field in fields])
+
+    async def execute(self):
+        return [command() for command in self.commands]
+
+
+def _discounts(percent, cap="0"):
+    return discount_service.compile_discounts(f'[{{"percent": {percent}, "cap": "{cap}"}}]')
+
+
+NO_DISCOUNTS = discount_service.compile_discounts("")
+
+
+def _entry(base_price, markup_percent, final_price, discounts=NO_DISCOUNTS, current_time=None):
+    return PriceEntry.build(
+        Decimal(base_price), Decimal(markup_percent), Decimal(final_price),
+        discounts, current_time or datetime.now(pytz.UTC)
+    )
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = FakeHashRedis()
+    monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+    return redis
+
+
+@pytest.mark.unit
+class TestPriceTable:
+    """Test the materialized price table"""
+
+    @pytest.mark.asyncio
+    async def test_read_requires_matching_base_price(self, fake_redis):
+        """Entries are served only for the same base price and while fresh"""
+        table = PriceTable()
+        await table.store("p1", "ch1", _entry('100', '15', '103.50', _discounts(-10)))
+
+        entry = await table.get("p1", "ch1", Decimal('100.00'))
+        assert entry.final_price == Decimal('103.50')
+        assert entry.discount_percent == Decimal('-10')
+        assert await table.get("p1", "ch1", Decimal('99')) is None
+        assert await table.get("p1", "ch2", Decimal('100')) is None
+
+        old = datetime.now(pytz.UTC) - timedelta(seconds=settings.PRICE_TABLE_MAX_AGE + 1)
+        await table.store("p1", "ch1", _entry('100', '15', '103.50', _discounts(-10), old))
+        assert await table.get("p1", "ch1", Decimal('100')) is None
+        assert (table.hits, table.misses) == (1, 3)
+
+    def test_entry_expires_at_next_discount_change(self):
+        """Validity ends at the next minute for schedules and at period bounds, whichever is first"""
+        noon = datetime(2026, 5, 4, 12, 0, 0, tzinfo=pytz.UTC)
+        scheduled = discount_service.compile_discounts('[{"percent": -10, "cap": "0", "shedule": "0 12 * * *"}]')
+        ending = discount_service.compile_discounts(
+            '[{"percent": -10, "cap": "0", "period": '
+            '{"datetime_start": "01-05-2026T00:00:00Z", "datetime_end": "04-05-2026T12:00:10Z"}}]'
+        )
+        upcoming = discount_service.compile_discounts(
+            '[{"percent": -10, "cap": "0", "period": '
+            '{"datetime_start": "04-05-2026T12:00:05Z", "datetime_end": "05-05-2026T00:00:00Z"}}]'
+        )
+
+        before_noon = _entry('100', '0', '100.00', scheduled, noon - timedelta(seconds=30))
+        assert (before_noon.discount_percent, before_noon.valid_until) == (None, noon.timestamp())
+        at_noon = _entry('100', '0', '90.00', scheduled, noon)
+        assert (at_noon.discount_percent, at_noon.valid_until) == (Decimal('-10'), noon.timestamp() + 60)
+        assert _entry('100', '0', '90.00', ending, noon).valid_until == noon.timestamp() + 10
+        assert _entry('100', '0', '100.00', upcoming, noon).valid_until == noon.timestamp() + 5
+        assert _entry('100', '0', '100.00', NO_DISCOUNTS, noon).valid_until == (
+            noon.timestamp() + settings.PRICE_TABLE_MAX_AGE
+        )
+
+    @pytest.mark.asyncio
+    async def test_products_with_variant_prices_are_not_stored(self, fake_redis):
+        """One entry per (product, channel): variants with different base prices are skipped"""
+        table = PriceTable()
+        context = PricingContext()
+        context.remember_products([{"id": "p1", "metadata": []}, {"id": "p2", "metadata": []}])
+
+        def result(product_id, base_price):
+            return BatchPriceCalculationResult(
+                product_id=product_id, channel_id="ch1", base_price=base_price,
+                markup_percent="10", final_price=str(Decimal(base_price) * Decimal('1.1'))
+            )
+
+        await table.store_results([result("p1", "100"), result("p1", "200"), result("p2", "50")], context)
+
+        assert await table.get("p1", "ch1", Decimal('100')) is None
+        assert await table.get("p1", "ch1", Decimal('200')) is None
+        assert (await table.get("p2", "ch1", Decimal('50'))).final_price == Decimal('55.0')
+
+    @pytest.mark.asyncio
+    async def test_reprice_channel_keeps_discounts(self, fake_redis, mock_rust_module):
+        """A markup change reprices the channel from stored base prices and discounts"""
+        table = PriceTable()
+        await table.store_many({"ch1": {
+            "p1": _entry('100', '15', '103.50', _discounts(-10)),
+            "p2": _entry('19.99', '15', '22.99'),
+        }})
+
+        assert await table.reprice_channel("ch1", Decimal('5')) == 2
+
+        assert (await table.get("p1", "ch1", Decimal('100'))).final_price == Decimal('94.50')
+        p2 = await table.get("p2", "ch1", Decimal('19.99'))
+        assert (p2.final_price, p2.markup_percent) == (Decimal('20.99'), Decimal('5'))
+
+    @pytest.mark.asyncio
+    async def test_reprice_products_applies_new_discount(self, fake_redis, mock_rust_module):
+        """A discount change reprices the product in every channel it is stored for"""
+        table = PriceTable()
+        await table.store_many({
+            "ch1": {"p1": _entry('100', '15', '115.00')},
+            "ch2": {"p1": _entry('100', '5', '105.00')},
+        })
+
+        assert await table.reprice_products(["p1", "p-missing"], _discounts(-10), ["ch1", "ch2", "ch3"]) == 2
+
+        assert (await table.get("p1", "ch1", Decimal('100'))).final_price == Decimal('103.50')
+        assert (await table.get("p1", "ch2", Decimal('100'))).final_price == Decimal('94.50')
+
+    def test_calculate_is_served_from_table(self, client, fake_redis, mock_rust_module, monkeypatch):
+        """The second read for the same base price is served from the table"""
+        mock_markup = AsyncMock(return_value=Decimal('15'))
+        monkeypatch.setattr("app.services.markup_service.markup_service.get_channel_markup", mock_markup)
+        request = {"product_id": "UHJvZHVjdDox", "channel_id": "Q2hhbm5lbDoy", "base_price": 100}
+
+        first = client.post("/api/prices/calculate", json=request)
+        second = client.post("/api/prices/calculate", json=request)
+        other = client.post("/api/prices/calculate", json={**request, "base_price": 200})
+
+        assert first.json()["final_price"] == second.json()["final_price"] == "115.00"
+        assert second.json()["markup_percent"] == "15"
+        assert other.json()["final_price"] == "230.00"
+        assert mock_markup.await_count == 2
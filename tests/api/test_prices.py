@@ -32,7 +32,7 @@ class TestPricesEndpoint:
         )
         
         # Mock rust calculation
-        mock_rust_module.calculate_price.return_value = "115.00"
+        mock_rust_module.calculate_final_price.return_value = "115.00"
         
         request_data = {
             "product_id": "UHJvZHVjdDox",
@@ -48,7 +48,7 @@ class TestPricesEndpoint:
         assert data["markup_percent"] == "15"
         
         # Verify rust module was called correctly
-        mock_rust_module.calculate_price.assert_called_once_with("100.0", "15")
+        mock_rust_module.calculate_final_price.assert_called_once_with("100.0", "15", "0", "0", False)
         
     def test_calculate_price_invalid_data(self, client):
         """Test price calculation with invalid data"""
@@ -0,0 +1,117 @@
+import pytest
+import asyncio
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+from app.services.pricing_context import PricingContext
+
+
+PRODUCT = {
+    "id": "UHJvZHVjdDox",
+    "metadata": [{"key": "discounts", "value": '[{"percent": -10, "cap": "0"}]'}]
+}
+
+
+@pytest.mark.unit
+class TestPricingContext:
+    """Test request-scoped memoization of pricing data"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_lookups_are_memoized(self, monkeypatch):
+        """Concurrent and repeated lookups share one fetch per key"""
+        mock_markup = AsyncMock(return_value=Decimal('15'))
+        mock_product = AsyncMock(return_value=PRODUCT)
+        monkeypatch.setattr("app.services.markup_service.markup_service.get_channel_markup", mock_markup)
+        monkeypatch.setattr("app.services.pricing_context.get_product", mock_product)
+        context = PricingContext()
+
+        markups = await asyncio.gather(*(context.get_markup("ch1") for _ in range(5)))
+        products = await asyncio.gather(*(context.get_product("UHJvZHVjdDox") for _ in range(5)))
+        discount = await context.get_active_discount("UHJvZHVjdDox")
+
+        assert markups == [Decimal('15')] * 5
+        assert all(product is PRODUCT for product in products)
+        assert discount.pricing() == (Decimal('-10'), Decimal('0'))
+        mock_markup.assert_awaited_once_with("ch1")
+        mock_product.assert_awaited_once_with("UHJvZHVjdDox")
+
+    @pytest.mark.asyncio
+    async def test_bulk_markups_are_memoized(self, monkeypatch):
+        """Bulk markups are fetched once and reused by single lookups"""
+        mock_markups = AsyncMock(return_value={"ch1": Decimal('5'), "ch2": Decimal('10')})
+        mock_markup = AsyncMock()
+        monkeypatch.setattr("app.services.markup_service.markup_service.get_channel_markups", mock_markups)
+        monkeypatch.setattr("app.services.markup_service.markup_service.get_channel_markup", mock_markup)
+        context = PricingContext()
+
+        assert await context.get_markups(["ch1", "ch2", "ch1"]) == {"ch1": Decimal('5'), "ch2": Decimal('10')}
+        assert await context.get_markup("ch2") == Decimal('10')
+        assert await context.get_markups(["ch2"]) == {"ch2": Decimal('10')}
+
+        mock_markups.assert_awaited_once_with(["ch1", "ch2"])
+        mock_markup.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_failed_bulk_markups_are_all_retrieved(self, monkeypatch):
+        """A failed batch raises once and leaves no unretrieved sibling futures"""
+        async def get_channel_markups(channel_ids):
+            raise RuntimeError("Saleor down")
+
+        monkeypatch.setattr("app.services.markup_service.markup_service.get_channel_markups", get_channel_markups)
+        context = PricingContext()
+
+        with pytest.raises(RuntimeError):
+            await context.get_markups(["ch1", "ch2", "ch3"])
+
+        # asyncio logs "Future exception was never retrieved" for futures with this flag set
+        assert not any(future._log_traceback for future in context._markups.values())
+
+    @pytest.mark.asyncio
+    async def test_discounts_are_checked_at_one_moment(self, monkeypatch):
+        """Every discount lookup of a request uses the time the context was created"""
+        scheduled = {"id": "p1", "metadata": [
+            {"key": "discounts", "value": '[{"percent": -10, "cap": "0", "shedule": "0 12 * * *"}]'}
+        ]}
+        always = {**PRODUCT, "id": "p2"}
+        monkeypatch.setattr(
+            "app.services.pricing_context.get_product",
+            AsyncMock(side_effect=lambda product_id: scheduled if product_id == "p1" else always)
+        )
+        context = PricingContext()
+        context.now = context.now.replace(hour=12, minute=0)
+
+        assert await context.get_active_discount("p1") is not None
+        assert await context.get_active_discount("p2") is not None
+
+    def test_calculate_with_discounts_fetches_once(self, client, mock_rust_module, monkeypatch):
+        """The discounts endpoint fetches the product and the markup once per request"""
+        mock_markup = AsyncMock(return_value=Decimal('15'))
+        mock_product = AsyncMock(return_value=PRODUCT)
+        monkeypatch.setattr("app.services.markup_service.markup_service.get_channel_markup", mock_markup)
+        monkeypatch.setattr("app.services.pricing_context.get_product", mock_product)
+
+        response = client.post(
+            "/api/prices/calculate-with-discounts",
+            json={"product_id": "UHJvZHVjdDox", "channel_id": "Q2hhbm5lbDoy", "base_price": 100}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["final_price"] == "103.50"
+        assert data["discount_applied"] is True
+        assert data["discount_percent"] == "-10"
+        mock_product.assert_awaited_once()
+        mock_markup.assert_awaited_once()
+
+    def test_calculate_fetches_markup_once(self, client, monkeypatch):
+        """The calculate endpoint resolves the markup once per request"""
+        mock_markup = AsyncMock(return_value=Decimal('15'))
+        monkeypatch.setattr("app.services.markup_service.markup_service.get_channel_markup", mock_markup)
+
+        response = client.post(
+            "/api/prices/calculate",
+            json={"product_id": "UHJvZHVjdDox", "channel_id": "Q2hhbm5lbDoy", "base_price": 100}
+        )
+
+        assert response.status_code == 200
+        mock_markup.assert_awaited_once()
@@ -0,0 +1,214 @@
+import pytest
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+from app.core.config import settings
+from app.services.channel_registry import ChannelSnapshot
+from app.services.job_queue import JobQueue, Job
+from app.services.reprice_jobs import RepriceJobs, REPRICE_CHANNEL_JOB
+
+
+class FakeStateRedis:
+    """Just enough of Redis for repricing job state"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.values = {}
+
+    async def hgetall(self, key):
+        return {field.encode(): value.encode() for field, value in self.hashes.get(key, {}).items()}
+
+    async def get(self, key):
+        value = self.values.get(key)
+        return value.encode() if value is not None else None
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def hset(self, key, mapping):
+        self.commands.append(lambda: self.redis.hashes.setdefault(key, {}).update(mapping))
+
+    def expire(self, key, ttl):
+        self.commands.append(lambda: None)
+
+    def set(self, key, value, ex=None):
+        self.commands.append(lambda: self.redis.values.__setitem__(key, value))
+
+    async def execute(self):
+        return [command() for command in self.commands]
+
+
+def _product(index, price, base_prices=None):
+    metadata = [{"key": "base_prices", "value": base_prices}] if base_prices else []
+    return {"id": f"p{index}", "metadata": [], "variants": [
+        {"id": f"v{index}", "metadata": metadata, "channelListings": [
+            {"channel": {"id": "ch1"}, "price": {"amount": price}},
+            {"channel": {"id": "ch2"}, "price": {"amount": price}},
+        ]}
+    ]}
+
+
+# Three pages of the ch1 catalog: cursor -> (products, end cursor)
+PAGES = {
+    None: ([_product(0, 100), _product(1, 115, '{"ch1": {"base": "100", "price": "115"}}')], "c1"),
+    "c1": ([_product(2, 10)], "c2"),
+    "c2": ([_product(3, 20)], "c3"),
+}
+
+
+@pytest.fixture
+def catalog(monkeypatch, mock_rust_module, variant_metadata):
+    """A ch1 catalog with a 15% markup and a recorded write-back"""
+    requested = []
+
+    async def iter_product_pages(channel_slug, page_size=None, after=None, with_variants=False):
+        assert (channel_slug, with_variants) == ("one", True)
+        cursor = after
+        while cursor in PAGES:
+            requested.append(cursor)
+            products, cursor = PAGES[cursor]
+            yield products, cursor
+
+    monkeypatch.setattr("app.services.reprice_jobs.iter_product_pages", iter_product_pages)
+    monkeypatch.setattr(
+        "app.services.reprice_jobs.channel_registry.get_snapshot",
+        AsyncMock(return_value=ChannelSnapshot([{"id": "ch1", "slug": "one"}]))
+    )
+    monkeypatch.setattr(
+        "app.services.markup_service.markup_service.get_channel_markups",
+        AsyncMock(return_value={"ch1": Decimal('15')})
+    )
+    write = AsyncMock(side_effect=lambda updates: {update["variant_id"]: True for update in updates})
+    monkeypatch.setattr("app.services.price_writeback.update_variant_channel_prices", write)
+    variant_metadata(*(product for products, _ in PAGES.values() for product in products))
+    enqueue = AsyncMock()
+    monkeypatch.setattr("app.services.reprice_jobs.job_queue.enqueue", enqueue)
+    return requested, write, enqueue
+
+
+@pytest.fixture
+def state_redis(monkeypatch):
+    redis = FakeStateRedis()
+    monkeypatch.setattr("app.services.markup_service.markup_service.redis", redis)
+    return redis
+
+
+@pytest.mark.unit
+class TestRepriceJobs:
+    """Test the catalog-wide channel repricing job"""
+
+    @pytest.mark.asyncio
+    async def test_job_walks_the_channel_catalog(self, catalog, state_redis):
+        """Every page is priced and only changed listings of the channel are written"""
+        requested, write, enqueue = catalog
+        jobs = RepriceJobs()
+
+        job_id = await jobs.start("ch1", Decimal('15'))
+        enqueue.assert_awaited_once_with(REPRICE_CHANNEL_JOB, job_id=job_id)
+        await jobs.run_step(job_id)
+
+        state = await jobs.load(job_id)
+        assert state["status"] == "completed"
+        assert (state["pages"], state["products"], state["listings_written"]) == (3, 4, 3)
+        assert state["cursor"] == "c3"
+        assert requested == [None, "c1", "c2"]
+        written = [update for call in write.call_args_list for update in call.args[0]]
+        assert [update["variant_id"] for update in written] == ["v0", "v2", "v3"]
+        assert all(list(update["prices"]) == ["ch1"] for update in written)
+        progress = jobs.progress(state)
+        assert progress["elapsed_seconds"] >= 0
+        assert progress["products_per_second"] >= 0
+
+    @pytest.mark.asyncio
+    async def test_steps_resume_from_committed_cursor(self, catalog, state_redis, monkeypatch):
+        """A step stops after its page budget; the next one (in any process) continues from the cursor"""
+        requested, _, enqueue = catalog
+        monkeypatch.setattr(settings, "REPRICE_JOB_PAGES_PER_STEP", 2)
+        job_id = await RepriceJobs().start("ch1", Decimal('15'))
+
+        await RepriceJobs().run_step(job_id)
+        assert enqueue.await_count == 2
+        assert (await RepriceJobs().load(job_id))["cursor"] == "c2"
+
+        await RepriceJobs().run_step(job_id)
+        assert requested == [None, "c1", "c2"]
+        assert (await RepriceJobs().load(job_id))["status"] == "completed"
+
+    @pytest.mark.asyncio
+    async def test_failed_page_keeps_last_cursor(self, catalog, state_redis, monkeypatch):
+        """A crash mid-catalog fails the step; the retry starts after the last committed page"""
+        requested, write, _ = catalog
+        jobs = RepriceJobs()
+        job_id = await jobs.start("ch1", Decimal('15'))
+        reprice_page = jobs._reprice_page
+        calls = 0
+
+        async def flaky(state, products):
+            nonlocal calls
+            calls += 1
+            if calls == 2:
+                raise RuntimeError("Saleor down")
+            await reprice_page(state, products)
+
+        monkeypatch.setattr(jobs, "_reprice_page", flaky)
+        with pytest.raises(RuntimeError):
+            await jobs.run_step(job_id)
+        state = await jobs.load(job_id)
+        assert (state["cursor"], state["error"]) == ("c1", "Saleor down")
+
+        await jobs.run_step(job_id)
+        assert requested == [None, "c1", "c1", "c2"]
+        assert (await jobs.load(job_id))["products"] == 4
+
+    @pytest.mark.asyncio
+    async def test_dead_lettered_step_fails_job(self, catalog, state_redis, monkeypatch):
+        """Once the queue gives up on a step the job is marked failed instead of staying running"""
+        monkeypatch.setattr(settings, "WEBHOOK_JOB_MAX_ATTEMPTS", 2)
+        for command in ("xadd", "xack", "xdel"):
+            setattr(state_redis, command, AsyncMock())
+        jobs = RepriceJobs()
+        job_id = await jobs.start("ch1", Decimal('15'))
+        monkeypatch.setattr(jobs, "_reprice_page", AsyncMock(side_effect=RuntimeError("Saleor down")))
+        queue = JobQueue()
+        queue.register(REPRICE_CHANNEL_JOB, jobs.run_step, on_dead_letter=jobs.fail)
+
+        await queue._process_redis(Job(REPRICE_CHANNEL_JOB, {"job_id": job_id}, attempt=2, message_id="1-0"))
+
+        state = await jobs.load(job_id)
+        assert (state["status"], state["error"]) == ("failed", "Saleor down")
+        assert state["finished_at"] is not None
+        assert state["cursor"] is None
+
+    @pytest.mark.asyncio
+    async def test_newer_markup_supersedes_job(self, catalog, state_redis):
+        """An unfinished job stops once a newer job exists for its channel"""
+        requested, _, _ = catalog
+        jobs = RepriceJobs()
+        old_job = await jobs.start("ch1", Decimal('15'))
+        await jobs.start("ch1", Decimal('20'))
+
+        await jobs.run_step(old_job)
+
+        assert (await jobs.load(old_job))["status"] == "superseded"
+        assert requested == []
+
+    def test_markup_endpoint_starts_job(self, client, monkeypatch):
+        """Setting a markup returns a job whose status can be polled"""
+        enqueue = AsyncMock()
+        monkeypatch.setattr("app.services.reprice_jobs.job_queue.enqueue", enqueue)
+
+        response = client.post("/api/channels/markup", json={"channel_id": "Q2hhbm5lbDox", "markup_percent": 25})
+        job_id = response.json()["reprice_job_id"]
+        status = client.get(f"/api/channels/reprice-jobs/{job_id}")
+
+        assert status.status_code == 200
+        assert status.json()["status"] == "queued"
+        assert status.json()["channel_id"] == "Q2hhbm5lbDox"
+        assert enqueue.call_args.kwargs == {"job_id": job_id}
+        assert client.get("/api/channels/reprice-jobs/missing").status_code == 404
@@ -0,0 +1,201 @@
+import pytest
+import asyncio
+from decimal import Decimal
+from unittest.mock import AsyncMock, MagicMock
+
+from app.saleor.client import SaleorClient
+from app.saleor.singleflight import SingleFlight
+
+
+@pytest.mark.unit
+class TestSingleFlight:
+    """Test coalescing of concurrent identical Saleor requests"""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_calls_execute_once(self):
+        """Concurrent callers with one key share a single execution"""
+        flight = SingleFlight()
+        calls = 0
+        
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "product"
+        
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(100)))
+        
+        assert results == ["product"] * 100
+        assert calls == 1
+        assert flight.stats() == {"calls": 100, "executions": 1, "coalesced": 99, "in_flight": 0}
+        
+    @pytest.mark.asyncio
+    async def test_sequential_calls_are_not_coalesced(self):
+        """Once a request completes the next caller fetches fresh data"""
+        flight = SingleFlight()
+        fetch = AsyncMock(return_value="product")
+        
+        await flight.do("key", fetch)
+        await flight.do("key", fetch)
+        
+        assert fetch.call_count == 2
+        assert flight.coalesced == 0
+        
+    @pytest.mark.asyncio
+    async def test_client_coalesces_queries_but_not_mutations(self):
+        """SaleorClient.execute shares in-flight reads and always sends mutations"""
+        client = SaleorClient()
+        response = MagicMock()
+        response.json.return_value = {"data": {}}
+        
+        async def post(payload, authenticated=True):
+            await asyncio.sleep(0.01)
+            return response
+        
+        client.post = AsyncMock(side_effect=post)
+        
+        await asyncio.gather(*(client.execute("query GetProduct($id: ID!) { product(id: $id) { id } }", {"id": "1"}) for _ in range(10)))
+        assert client.post.call_count == 1
+        
+        await asyncio.gather(*(client.execute("mutation { updateMetadata { item { id } } }") for _ in range(3)))
+        assert client.post.call_count == 4
+        
+    def test_metrics_endpoint_reports_coalescing(self, client):
+        """Single-flight counters are exposed on /metrics"""
+        response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert "coalesced" in response.json()["saleor"]["single_flight"]
+
+
+def _product_pages(total, page_size):
+    """Build fake Saleor responses for a catalog of `total` products"""
+    pages = {}
+    cursor = None
+    for start in range(0, total, page_size):
+        end = min(start + page_size, total)
+        end_cursor = f"cursor-{end}"
+        pages[cursor] = {"data": {"products": {
+            "edges": [{"node": {"id": f"p{i}", "name": f"P{i}", "slug": f"p{i}", "metadata": []}} for i in range(start, end)],
+            "pageInfo": {"hasNextPage": end < total, "endCursor": end_cursor}
+        }}}
+        cursor = end_cursor
+    return pages
+
+
+@pytest.mark.unit
+class TestProductPagination:
+    """Test cursor-paginated streaming of the product catalog"""
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("prefetch", [True, False])
+    async def test_iter_product_pages_walks_all_cursors(self, monkeypatch, prefetch):
+        """Every page is fetched once, following endCursor"""
+        from app.saleor.api import iter_product_pages
+        pages = _product_pages(250, 100)
+        execute = AsyncMock(side_effect=lambda query, variables: pages[variables["after"]])
+        monkeypatch.setattr("app.saleor.api.saleor_client.execute", execute)
+        
+        seen = []
+        cursors = []
+        async for products, cursor in iter_product_pages(page_size=100, prefetch=prefetch):
+            seen.extend(product["id"] for product in products)
+            cursors.append(cursor)
+        
+        assert seen == [f"p{i}" for i in range(250)]
+        assert cursors == ["cursor-100", "cursor-200", "cursor-250"]
+        assert [call.args[1]["after"] for call in execute.call_args_list] == [None, "cursor-100", "cursor-200"]
+        
+    @pytest.mark.asyncio
+    async def test_get_products_reads_past_first_page(self, monkeypatch):
+        """get_products(first=150) spans two Saleor pages"""
+        from app.saleor.api import get_products
+        pages = _product_pages(1000, 100)
+        execute = AsyncMock(side_effect=lambda query, variables: pages[variables["after"]])
+        monkeypatch.setattr("app.saleor.api.saleor_client.execute", execute)
+        
+        products = await get_products(first=150)
+        
+        assert len(products) == 150
+        assert products[-1]["id"] == "p149"
+
+
+@pytest.mark.unit
+class TestBulkMetadataUpdate:
+    """Test packing many updateMetadata mutations into aliased documents"""
+    
+    @pytest.mark.asyncio
+    async def test_bulk_update_chunks_and_reports_per_product(self, monkeypatch):
+        """Products are chunked into aliased mutations with per-product results"""
+        from app.saleor.api import bulk_update_product_metadata
+        
+        async def execute(query, variables):
+            ids = [value for key, value in variables.items() if key.startswith("id")]
+            return {"data": {
+                f"m{i}": {"errors": [{"field": "id", "message": "Not found"}] if product_id == "bad" else []}
+                for i, product_id in enumerate(ids)
+            }}
+        
+        execute_mock = AsyncMock(side_effect=execute)
+        monkeypatch.setattr("app.saleor.api.saleor_client.execute", execute_mock)
+        
+        product_ids = [f"p{i}" for i in range(9)] + ["bad"]
+        metadata = [{"key": "discounts", "value": "[]"}]
+        results = await bulk_update_product_metadata(product_ids, metadata, chunk_size=4, concurrency=2)
+        
+        assert execute_mock.call_count == 3
+        query, variables = execute_mock.call_args_list[0].args
+        assert query.startswith("mutation BulkUpdateMetadata")
+        assert "m3: updateMetadata(id: $id3, input: $input)" in query
+        assert variables["input"] == metadata
+        assert results == {**{f"p{i}": True for i in range(9)}, "bad": False}
+        
+    @pytest.mark.asyncio
+    async def test_failed_chunk_marks_only_its_products(self, monkeypatch):
+        """A transport error fails its own chunk without aborting the rest"""
+        from app.saleor.api import bulk_update_product_metadata
+        
+        async def execute(query, variables):
+            if variables["id0"] == "p2":
+                raise RuntimeError("connection reset")
+            return {"data": {"m0": {"errors": []}, "m1": {"errors": []}}}
+        
+        monkeypatch.setattr("app.saleor.api.saleor_client.execute", AsyncMock(side_effect=execute))
+        
+        results = await bulk_update_product_metadata(["p0", "p1", "p2", "p3"], [], chunk_size=2)
+        
+        assert results == {"p0": True, "p1": True, "p2": False, "p3": False}
+
+
+@pytest.mark.unit
+class TestVariantPriceWrite:
+    """Test writing variant channel prices: metadata first, then listings"""
+    
+    @pytest.mark.asyncio
+    async def test_listings_follow_successful_metadata(self, monkeypatch):
+        """Only variants whose base price metadata was saved get their listings updated"""
+        from app.saleor.api import update_variant_channel_prices
+        
+        async def execute(query, variables):
+            if query.startswith("mutation UpdateVariantMetadata"):
+                return {"data": {"m0": {"errors": []}, "m1": {"errors": [{"field": "id", "message": "Not found"}]}}}
+            return {"data": {"v0": {"errors": []}}}
+        
+        execute_mock = AsyncMock(side_effect=execute)
+        monkeypatch.setattr("app.saleor.api.saleor_client.execute", execute_mock)
+        
+        metadata = [{"key": "base_prices", "value": '{"ch1": {"base": "100", "price": "115.00"}}'}]
+        results = await update_variant_channel_prices([
+            {"variant_id": "v1", "prices": {"ch1": Decimal("115.00")}, "metadata": metadata},
+            {"variant_id": "v2", "prices": {"ch1": Decimal("1.00")}, "metadata": metadata},
+        ])
+        
+        assert execute_mock.call_count == 2
+        metadata_query, metadata_variables = execute_mock.call_args_list[0].args
+        assert "m1: updateMetadata(id: $id1, input: $meta1)" in metadata_query
+        assert metadata_variables["meta0"] == metadata
+        listings_query, listings_variables = execute_mock.call_args_list[1].args
+        assert "v0: productVariantChannelListingUpdate(id: $id0, input: $input0)" in listings_query
+        assert "v1:" not in listings_query
+        assert listings_variables == {"id0": "v1", "input0": [{"channelId": "ch1", "price": "115.00"}]}
+        assert results == {"v1": True, "v2": False}
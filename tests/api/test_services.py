@@ -1,8 +1,12 @@
 import pytest
+import asyncio
+import json
 from decimal import Decimal
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import ANY, AsyncMock, MagicMock
 
-from app.services.markup_service import MarkupService
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.services.markup_service import MarkupService, MARKUP_INVALIDATION_CHANNEL, NO_MARKUP
 from app.services.price_calculator import calculate_price_with_markup
 
 
@@ -41,7 +45,7 @@ class TestMarkupService:
         result = await service.get_channel_markup("Q2hhbm5lbDox")
         
         assert result == Decimal('20.5')
-        mock_redis.set.assert_called_once_with(
+        mock_redis.set.assert_any_call(
             "channel_markup:Q2hhbm5lbDox", "20.5", ex=3600
         )
         
@@ -119,6 +123,175 @@ class TestMarkupService:
         await service.invalidate_cache("Q2hhbm5lbDox")
         
         mock_redis.delete.assert_called_once_with("channel_markup:Q2hhbm5lbDox")
+        
+    @pytest.mark.asyncio
+    async def test_l1_cache_skips_redis(self, mock_redis):
+        """Repeated lookups are served from the in-process L1 cache"""
+        mock_redis.get.return_value = b'15.5'
+        service = MarkupService()
+        service.redis = mock_redis
+        
+        assert await service.get_channel_markup("Q2hhbm5lbDox") == Decimal('15.5')
+        assert await service.get_channel_markup("Q2hhbm5lbDox") == Decimal('15.5')
+        
+        mock_redis.get.assert_called_once_with("channel_markup:Q2hhbm5lbDox")
+        
+    @pytest.mark.asyncio
+    async def test_set_and_invalidate_publish(self, mock_redis, monkeypatch):
+        """Markup changes are broadcast to other workers"""
+        monkeypatch.setattr(
+            "app.services.markup_service.update_channel_metadata",
+            AsyncMock(return_value=True)
+        )
+        service = MarkupService()
+        service.redis = mock_redis
+        
+        await service.set_channel_markup("Q2hhbm5lbDox", Decimal('25.5'))
+        await service.invalidate_cache("Q2hhbm5lbDox")
+        
+        assert mock_redis.publish.await_count == 2
+        channel, message = mock_redis.publish.call_args.args
+        assert channel == MARKUP_INVALIDATION_CHANNEL
+        assert json.loads(message)["channel_id"] == "Q2hhbm5lbDox"
+        
+    @pytest.mark.asyncio
+    async def test_invalidation_from_other_worker_drops_l1(self, mock_redis):
+        """An invalidation published by another worker evicts the L1 entry"""
+        mock_redis.get.return_value = b'15.5'
+        service = MarkupService()
+        service.redis = mock_redis
+        await service.get_channel_markup("Q2hhbm5lbDox")
+        
+        # Own messages are ignored
+        service._handle_invalidation(json.dumps({"channel_id": "Q2hhbm5lbDox", "origin": service._worker_id}))
+        await service.get_channel_markup("Q2hhbm5lbDox")
+        assert mock_redis.get.await_count == 1
+        
+        service._handle_invalidation(json.dumps({"channel_id": "Q2hhbm5lbDox", "origin": "other"}).encode())
+        mock_redis.get.return_value = b'30'
+        
+        assert await service.get_channel_markup("Q2hhbm5lbDox") == Decimal('30')
+        assert mock_redis.get.await_count == 2
+        assert service.stats()["invalidations_received"] == 1
+        
+    @pytest.mark.asyncio
+    async def test_get_channel_markups_bulk(self, mock_redis, monkeypatch):
+        """Bulk lookup: one MGET for hits, one batched Saleor query and one pipeline for misses"""
+        mock_redis.mget.side_effect = lambda keys: [b'5' if key.endswith(":ch1") else None for key in keys]
+        pipeline = MagicMock()
+        pipeline.execute = AsyncMock(return_value=[True])
+        mock_redis.pipeline = MagicMock(return_value=pipeline)
+        mock_get_channels = AsyncMock(return_value={
+            "ch2": {"id": "ch2", "metadata": [{"key": "price_markup_percent", "value": "12.5"}]},
+            "ch3": {"id": "ch3", "metadata": []},
+        })
+        monkeypatch.setattr("app.services.markup_service.get_channels_by_ids", mock_get_channels)
+        service = MarkupService()
+        service.redis = mock_redis
+        
+        result = await service.get_channel_markups(["ch1", "ch2", "ch1", "ch3", "ch2"])
+        
+        assert result == {"ch1": Decimal('5'), "ch2": Decimal('12.5'), "ch3": Decimal('0')}
+        mock_redis.mget.assert_awaited_once_with(
+            ["channel_markup:ch1", "channel_markup:ch2", "channel_markup:ch3"]
+        )
+        mock_get_channels.assert_awaited_once_with(["ch2", "ch3"])
+        pipeline.set.assert_any_call("channel_markup:ch2", "12.5", ex=3600)
+        pipeline.set.assert_any_call("channel_markup:ch3", NO_MARKUP, ex=settings.MARKUP_NEGATIVE_TTL)
+        pipeline.execute.assert_awaited_once()
+        
+        # Second call is served entirely from L1
+        assert await service.get_channel_markups(["ch1", "ch2"]) == {"ch1": Decimal('5'), "ch2": Decimal('12.5')}
+        assert mock_redis.mget.await_count == 1
+        
+    @pytest.mark.asyncio
+    async def test_missing_markup_is_negatively_cached(self, mock_redis, monkeypatch):
+        """A channel without markup metadata is cached with the negative TTL"""
+        mock_get_channel = AsyncMock(return_value={"id": "Q2hhbm5lbDox", "metadata": []})
+        monkeypatch.setattr("app.services.markup_service.get_channel", mock_get_channel)
+        service = MarkupService()
+        service.redis = mock_redis
+        
+        assert await service.get_channel_markup("Q2hhbm5lbDox") == Decimal('0')
+        assert await service.get_channel_markup("Q2hhbm5lbDox") == Decimal('0')
+        
+        mock_get_channel.assert_awaited_once()
+        mock_redis.set.assert_any_call(
+            "channel_markup:Q2hhbm5lbDox", NO_MARKUP, ex=settings.MARKUP_NEGATIVE_TTL
+        )
+        
+        # Negative entries stored by another worker are honoured too
+        mock_redis.get.return_value = NO_MARKUP.encode()
+        other = MarkupService()
+        other.redis = mock_redis
+        assert await other.get_channel_markup("Q2hhbm5lbDox") == Decimal('0')
+        mock_get_channel.assert_awaited_once()
+        
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_share_one_saleor_call(self, mock_redis, monkeypatch):
+        """Concurrent misses in one process coalesce into one locked recompute"""
+        async def slow_get_channel(channel_id):
+            await asyncio.sleep(0.01)
+            return {"id": channel_id, "metadata": [{"key": "price_markup_percent", "value": "7"}]}
+        mock_get_channel = AsyncMock(side_effect=slow_get_channel)
+        monkeypatch.setattr("app.services.markup_service.get_channel", mock_get_channel)
+        service = MarkupService()
+        service.redis = mock_redis
+        
+        results = await asyncio.gather(*(service.get_channel_markup("ch1") for _ in range(20)))
+        
+        assert results == [Decimal('7')] * 20
+        mock_get_channel.assert_awaited_once()
+        mock_redis.set.assert_any_call("lock:channel_markup:ch1", ANY, nx=True, ex=settings.MARKUP_LOCK_TTL)
+        mock_redis.eval.assert_awaited_once()
+        
+    @pytest.mark.asyncio
+    async def test_locked_key_waits_for_other_worker(self, mock_redis, monkeypatch):
+        """When another worker holds the lock, the value is read from Redis instead of Saleor"""
+        monkeypatch.setattr("app.services.markup_service.MARKUP_LOCK_POLL_INTERVAL", 0.001)
+        mock_redis.set.return_value = None  # lock not acquired
+        mock_redis.get.side_effect = [None, None, b'9.5']
+        mock_get_channel = AsyncMock()
+        monkeypatch.setattr("app.services.markup_service.get_channel", mock_get_channel)
+        service = MarkupService()
+        service.redis = mock_redis
+        
+        assert await service.get_channel_markup("ch1") == Decimal('9.5')
+        
+        mock_get_channel.assert_not_called()
+        
+    @pytest.mark.asyncio
+    async def test_lock_holder_rechecks_redis(self, mock_redis, monkeypatch):
+        """A worker that gets the lock right after another filled the cache does not reload from Saleor"""
+        # First GET misses; the lock holder's re-read finds the (negatively) cached value
+        mock_redis.get.side_effect = [None, NO_MARKUP.encode()]
+        mock_get_channel = AsyncMock()
+        monkeypatch.setattr("app.services.markup_service.get_channel", mock_get_channel)
+        service = MarkupService()
+        service.redis = mock_redis
+        
+        assert await service.get_channel_markup("ch1") == Decimal('0')
+        
+        mock_get_channel.assert_not_called()
+        mock_redis.eval.assert_awaited_once()  # the lock is still released
+        
+    def test_l1_cache_is_bounded(self):
+        """The L1 cache evicts the least recently used entries"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        
+        assert "a" in cache and "c" in cache
+        assert "b" not in cache
+        
+    def test_l1_cache_expires(self):
+        """Expired L1 entries are treated as misses"""
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set("a", 1, ttl=0)
+        
+        assert cache.get("a") is None
 
 
 @pytest.mark.unit
@@ -135,7 +308,7 @@ class TestPriceCalculator:
             mock_markup
         )
         
-        mock_rust_module.calculate_price.return_value = "115.00"
+        mock_rust_module.calculate_final_price.return_value = "115.00"
         
         result = await calculate_price_with_markup(
             "UHJvZHVjdDox", "Q2hhbm5lbDox", Decimal('100')
@@ -143,7 +316,7 @@ class TestPriceCalculator:
         
         assert result == Decimal('115.00')
         mock_markup.assert_called_once_with("Q2hhbm5lbDox")
-        mock_rust_module.calculate_price.assert_called_once_with("100", "15")
+        mock_rust_module.calculate_final_price.assert_called_once_with("100", "15", "0", "0", False)
         
     @pytest.mark.asyncio
     async def test_calculate_price_without_rust_module(self, monkeypatch):
@@ -177,11 +350,86 @@ class TestPriceCalculator:
             mock_markup
         )
         
-        mock_rust_module.calculate_price.return_value = "100.00"
+        mock_rust_module.calculate_final_price.return_value = "100.00"
         
         result = await calculate_price_with_markup(
             "UHJvZHVjdDox", "Q2hhbm5lbDox", Decimal('100')
         )
         
         assert result == Decimal('100.00')
-        mock_rust_module.calculate_price.assert_called_once_with("100", "0")
\ No newline at end of file
+        mock_rust_module.calculate_final_price.assert_called_once_with("100", "0", "0", "0", False)
+
+@pytest.mark.unit
+class TestColumnarCalculation:
+    """Test the columnar int64 price calculation path"""
+    
+    def test_columnar_matches_decimal_calculation(self, monkeypatch):
+        """Integer math with banker's rounding equals the Decimal fallback"""
+        import random
+        from app.services.price_calculator import calculate_prices_columnar, _python_calculate_price
+        monkeypatch.setattr("app.services.price_calculator.price_calculator", None)
+        
+        rng = random.Random(7)
+        base_prices = [Decimal(rng.randrange(1, 10_000_000)) / 100 for _ in range(2000)]
+        markups = [Decimal(rng.randrange(0, 100_000)) / 100 for _ in range(2000)]
+        # Exact half-cent ties must round to even like Decimal.quantize
+        base_prices += [Decimal("0.05"), Decimal("0.15"), Decimal("0.25")]
+        markups += [Decimal("10"), Decimal("10"), Decimal("10")]
+        
+        results = calculate_prices_columnar(base_prices, markups)
+        
+        expected = [Decimal(_python_calculate_price(str(b), str(m))) for b, m in zip(base_prices, markups)]
+        assert results == expected
+        assert all(str(result) == "{:.2f}".format(result) for result in results)
+        
+    def test_columnar_writes_into_preallocated_buffer(self, monkeypatch):
+        """calculate_columnar fills the caller's int64 buffer in place"""
+        from array import array
+        from app.services.price_calculator import calculate_columnar
+        monkeypatch.setattr("app.services.price_calculator.price_calculator", None)
+        
+        out = array('q', [0, 0, 0])
+        result = calculate_columnar(array('q', [10000, 5000, 1999]), array('q', [1500, 0, 1000]), out)
+        
+        assert result is out
+        assert list(out) == [11500, 5000, 2199]
+        
+    def test_columnar_overflow_leaves_buffer_untouched(self, monkeypatch):
+        """A row that overflows int64 fails the call without a half-written buffer"""
+        from array import array
+        from app.services.price_calculator import calculate_columnar
+        monkeypatch.setattr("app.services.price_calculator.price_calculator", None)
+        
+        out = array('q', [7, 7])
+        with pytest.raises(OverflowError):
+            calculate_columnar(array('q', [10000, 2 ** 62]), array('q', [1500, 20000]), out)
+        
+        assert list(out) == [7, 7]
+        
+    def test_sub_cent_inputs_fall_back_to_decimal(self, monkeypatch):
+        """Prices that are not whole cents keep exact Decimal semantics"""
+        from app.services.price_calculator import calculate_prices_columnar
+        monkeypatch.setattr("app.services.price_calculator.price_calculator", None)
+        
+        assert calculate_prices_columnar([Decimal("10.005")], [Decimal("0.125")]) == [Decimal("10.02")]
+        
+    @pytest.mark.asyncio
+    async def test_large_batches_run_off_the_event_loop(self, mock_rust_module, monkeypatch):
+        """Batches above the threshold are computed in a worker thread"""
+        import threading
+        from app.core.config import settings
+        from app.services.price_calculator import calculate_prices_columnar_async
+        monkeypatch.setattr(settings, "PRICE_BATCH_THREAD_THRESHOLD", 2)
+        
+        calling_threads = []
+        def columnar(base, markup, out, parallel_threshold=None):
+            calling_threads.append(threading.current_thread())
+            from app.services.price_calculator import _python_calculate_columnar
+            _python_calculate_columnar(base, markup, out)
+        mock_rust_module.calculate_columnar.side_effect = columnar
+        
+        results = await calculate_prices_columnar_async([Decimal('100')] * 3, [Decimal('10')] * 3)
+        
+        assert results == [Decimal("110.00")] * 3
+        assert calling_threads and calling_threads[0] is not threading.main_thread()
+        assert mock_rust_module.calculate_columnar.call_args.kwargs["parallel_threshold"] == settings.RUST_PARALLEL_THRESHOLD
@@ -1,4 +1,7 @@
 import pytest
+import asyncio
+import json
+from decimal import Decimal
 from unittest.mock import AsyncMock
 
 
@@ -113,4 +116,226 @@ class TestWebhooksEndpoint:
         
         assert response.status_code == 200
         # Note: Background task execution in tests requires special handling
-        # This test verifies the webhook accepts the payload correctly
\ No newline at end of file
+        # This test verifies the webhook accepts the payload correctly
+
+PAYLOAD_PRODUCT = {
+    "id": "UHJvZHVjdDox",
+    "metadata": [{"key": "discounts", "value": '[{"percent": -10, "cap": "0"}]'}],
+    "variants": [
+        {"id": "v1", "metadata": [], "channelListings": [
+            {"channel": {"id": "ch1"}, "price": {"amount": 100, "currency": "USD"}},
+            {"channel": {"id": "ch2"}, "price": None}
+        ]}
+    ]
+}
+
+
+@pytest.mark.unit
+class TestWebhookPayloadData:
+    """Test that product webhooks reuse the payload instead of refetching"""
+
+    @pytest.fixture
+    def pricing(self, monkeypatch, mock_rust_module, variant_metadata):
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markups",
+            AsyncMock(return_value={"ch1": Decimal('15')})
+        )
+        store = AsyncMock()
+        monkeypatch.setattr("app.services.price_table.price_table.store_many", store)
+        monkeypatch.setattr(
+            "app.services.price_writeback.update_variant_channel_prices",
+            AsyncMock(side_effect=lambda updates: {update["variant_id"]: True for update in updates})
+        )
+        variant_metadata(PAYLOAD_PRODUCT)
+        return store
+
+    @pytest.mark.asyncio
+    async def test_complete_payload_needs_no_saleor_queries(self, monkeypatch, pricing):
+        """Listings and metadata from the payload replace both Saleor queries"""
+        from app.api.webhooks import recalculate_product_prices, payload_usage
+        get_product_data = AsyncMock()
+        get_product = AsyncMock()
+        monkeypatch.setattr("app.api.webhooks.get_product_data", get_product_data)
+        monkeypatch.setattr("app.services.pricing_context.get_product", get_product)
+        avoided = payload_usage.product_refetches_avoided
+
+        await recalculate_product_prices("UHJvZHVjdDox", PAYLOAD_PRODUCT)
+
+        get_product_data.assert_not_called()
+        get_product.assert_not_called()
+        assert payload_usage.product_refetches_avoided == avoided + 1
+        entry = pricing.call_args.args[0]["ch1"]["UHJvZHVjdDox"]
+        assert entry.final_price == Decimal("103.50")
+
+    @pytest.mark.asyncio
+    async def test_missing_fields_are_refetched(self, monkeypatch, pricing):
+        """Without listings the product data is fetched; without metadata the discounts are"""
+        from app.api.webhooks import recalculate_product_prices, payload_usage
+        get_product_data = AsyncMock(return_value=PAYLOAD_PRODUCT)
+        get_product = AsyncMock(return_value={"id": "UHJvZHVjdDox", "metadata": []})
+        monkeypatch.setattr("app.api.webhooks.get_product_data", get_product_data)
+        monkeypatch.setattr("app.services.pricing_context.get_product", get_product)
+        refetches = payload_usage.product_refetches
+
+        await recalculate_product_prices("UHJvZHVjdDox", {"id": "UHJvZHVjdDox", "name": "Renamed"})
+
+        get_product_data.assert_awaited_once_with("UHJvZHVjdDox")
+        get_product.assert_awaited_once_with("UHJvZHVjdDox")
+        assert payload_usage.product_refetches == refetches + 1
+
+    def test_webhook_passes_payload_product_to_job(self, client, monkeypatch):
+        """The payload product travels with the queued job"""
+        from app.core.config import settings
+        enqueue = AsyncMock()
+        monkeypatch.setattr("app.api.webhooks.job_queue.enqueue_debounced", enqueue)
+
+        response = client.post("/webhooks/product-updated", json={
+            "event_type": "PRODUCT_UPDATED", "product_id": "UHJvZHVjdDox", "data": {"product": PAYLOAD_PRODUCT}
+        })
+
+        assert response.status_code == 200
+        assert enqueue.call_args.kwargs["product"] == PAYLOAD_PRODUCT
+        assert enqueue.call_args.args[2] == settings.PRODUCT_WEBHOOK_DEBOUNCE_WINDOW
+
+
+@pytest.mark.unit
+class TestPriceWriteback:
+    """Test writing recalculated prices back to Saleor channel listings"""
+
+    @pytest.fixture
+    def write(self, monkeypatch, mock_rust_module):
+        monkeypatch.setattr(
+            "app.services.markup_service.markup_service.get_channel_markups",
+            AsyncMock(return_value={"ch1": Decimal('15'), "ch2": Decimal('0')})
+        )
+        monkeypatch.setattr("app.services.pricing_context.get_product", AsyncMock(return_value={"metadata": []}))
+        write = AsyncMock(side_effect=lambda updates: {update["variant_id"]: True for update in updates})
+        monkeypatch.setattr("app.services.price_writeback.update_variant_channel_prices", write)
+        return write
+
+    @staticmethod
+    def _product(*variants):
+        return {"id": "p1", "variants": [
+            {"id": variant_id, "metadata": metadata, "channelListings": [
+                {"channel": {"id": channel_id}, "price": {"amount": amount}} for channel_id, amount in listings
+            ]}
+            for variant_id, metadata, listings in variants
+        ]}
+
+    @pytest.mark.asyncio
+    async def test_only_changed_listings_are_written(self, write, variant_metadata):
+        """Unchanged listings are skipped; the base and written price are recorded with the write"""
+        from app.api.webhooks import recalculate_product_prices
+        product = self._product(
+            ("v1", [], [("ch1", 100), ("ch2", 50)]),
+            ("v2", [], [("ch2", 10)]),
+        )
+        variant_metadata(product)
+
+        await recalculate_product_prices("p1", product)
+
+        updates = write.call_args.args[0]
+        assert [update["variant_id"] for update in updates] == ["v1"]
+        assert updates[0]["prices"] == {"ch1": Decimal("115.00")}
+        assert json.loads(updates[0]["metadata"][0]["value"]) == {"ch1": {"base": "100", "price": "115.00"}}
+
+    @pytest.mark.asyncio
+    async def test_recorded_base_prevents_compounding(self, write):
+        """A listing still holding the price we wrote is priced from the recorded base"""
+        from app.api.webhooks import recalculate_product_prices
+        recorded = [{"key": "base_prices", "value": '{"ch1": {"base": "100", "price": "115.00"}}'}]
+
+        await recalculate_product_prices("p1", self._product(("v1", recorded, [("ch1", "115.00"), ("ch2", 50)])))
+
+        write.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_manual_edit_becomes_new_base(self, write, variant_metadata):
+        """A listing price that differs from the one we wrote is treated as a new base"""
+        from app.api.webhooks import recalculate_product_prices
+        recorded = [{"key": "base_prices", "value": '{"ch1": {"base": "100", "price": "115.00"}, "ch9": {"base": "1", "price": "2"}}'}]
+        product = self._product(("v1", recorded, [("ch1", "200"), ("ch2", 50)]))
+        variant_metadata(product)
+
+        await recalculate_product_prices("p1", product)
+
+        update = write.call_args.args[0][0]
+        assert update["prices"] == {"ch1": Decimal("230.00")}
+        assert json.loads(update["metadata"][0]["value"]) == {
+            "ch1": {"base": "200", "price": "230.00"}, "ch9": {"base": "1", "price": "2"}
+        }
+
+    @pytest.mark.asyncio
+    async def test_interleaved_write_backs_keep_both_channels(self, monkeypatch):
+        """Two write-backs of one product read before either writes; both channel records survive"""
+        from types import SimpleNamespace
+        from app.services.price_writeback import PriceWriteback, collect_listings
+        saleor = {"v1": []}
+
+        async def read(variant_ids):
+            await asyncio.sleep(0)
+            return {variant_id: {"id": variant_id, "metadata": list(saleor[variant_id])} for variant_id in variant_ids}
+
+        async def write(updates):
+            await asyncio.sleep(0)
+            for update in updates:
+                saleor[update["variant_id"]] = update["metadata"]
+            return {update["variant_id"]: True for update in updates}
+
+        monkeypatch.setattr("app.services.price_writeback.get_variants_metadata", read)
+        monkeypatch.setattr("app.services.price_writeback.update_variant_channel_prices", write)
+        writeback = PriceWriteback()
+        # Both passes (a channel reprice and a product webhook) read the product before any write
+        product = self._product(("v1", [], [("ch1", 100), ("ch2", 50)]))
+        webhook = collect_listings(product, "ch1")
+        reprice = collect_listings(product, "ch2")
+
+        await asyncio.gather(
+            writeback.write_back("p1", webhook, [SimpleNamespace(error=None, final_price="115.00")]),
+            writeback.write_back("p1", reprice, [SimpleNamespace(error=None, final_price="55.00")]),
+        )
+
+        assert json.loads(saleor["v1"][0]["value"]) == {
+            "ch1": {"base": "100", "price": "115.00"}, "ch2": {"base": "50", "price": "55.00"}
+        }
+
+    @pytest.mark.asyncio
+    async def test_write_back_waits_for_other_worker(self, write, mock_redis, monkeypatch):
+        """A product locked by another worker past the wait fails the job instead of writing"""
+        from types import SimpleNamespace
+        from app.core.config import settings
+        from app.services.price_writeback import PriceWriteback, collect_listings
+        monkeypatch.setattr(settings, "PRICE_WRITEBACK_LOCK_WAIT", 0.0)
+        mock_redis.set.return_value = False
+        writeback = PriceWriteback()
+        listings = collect_listings(self._product(("v1", [], [("ch1", 100)])))
+
+        with pytest.raises(RuntimeError):
+            await writeback.write_back("p1", listings, [SimpleNamespace(error=None, final_price="115.00")])
+
+        write.assert_not_called()
+        assert writeback.lock_wait_timeouts == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_write_fails_the_job(self, write, variant_metadata):
+        """A variant Saleor rejected makes the job fail so the queue retries it"""
+        from app.api.webhooks import recalculate_product_prices
+        write.side_effect = lambda updates: {update["variant_id"]: False for update in updates}
+        product = self._product(("v1", [], [("ch1", 100)]))
+        variant_metadata(product)
+
+        with pytest.raises(RuntimeError):
+            await recalculate_product_prices("p1", product)
+
+        write.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_unreadable_variant_is_not_written(self, write, variant_metadata):
+        """A variant whose fresh metadata cannot be read is retried instead of overwriting it"""
+        from app.api.webhooks import recalculate_product_prices
+        variant_metadata()
+
+        with pytest.raises(RuntimeError):
+            await recalculate_product_prices("p1", self._product(("v1", [], [("ch1", 100)])))
+
+        write.assert_not_called()
@@ -6,6 +6,8 @@ from fastapi.testclient import TestClient
 from faker import Faker
 
 from app.core.config import settings
+from app.core.cache import TTLCache
+from app.services.price_calculator import _python_calculate_columnar, _python_calculate_final_price
 from main import app
 
 fake = Faker()
@@ -29,9 +31,37 @@ def mock_redis():
     mock.get = AsyncMock(return_value=None)
     mock.set = AsyncMock(return_value=True)
     mock.delete = AsyncMock(return_value=1)
+    mock.mget = AsyncMock(side_effect=lambda keys: [None] * len(keys))
+    mock.eval = AsyncMock(return_value=1)
+    mock.publish = AsyncMock(return_value=1)
+    mock.hget = AsyncMock(return_value=None)
+    mock.hscan = AsyncMock(return_value=(0, {}))
+    mock.hgetall = AsyncMock(return_value={})
+    mock.pipeline = MagicMock(side_effect=lambda **kwargs: _mock_pipeline())
+    mock.pubsub = MagicMock(return_value=_mock_pubsub())
     return mock
 
 
+def _mock_pipeline():
+    """Pipeline that queues commands and executes them as a no-op"""
+    pipeline = MagicMock()
+    pipeline.execute = AsyncMock(return_value=[])
+    return pipeline
+
+
+def _mock_pubsub():
+    """Pub/sub connection that subscribes fine and never delivers messages"""
+    async def listen():
+        await asyncio.Event().wait()
+        yield
+    
+    pubsub = MagicMock()
+    pubsub.subscribe = AsyncMock()
+    pubsub.listen = MagicMock(side_effect=lambda: listen())
+    pubsub.aclose = AsyncMock()
+    return pubsub
+
+
 @pytest.fixture
 def mock_saleor_api():
     """Mock Saleor API responses"""
@@ -131,6 +161,8 @@ def mock_rust_module():
         {"product_id": "test1", "final_price": "115.00"},
         {"product_id": "test2", "final_price": "55.00"}
     ])
+    mock.calculate_columnar = MagicMock(side_effect=_python_calculate_columnar)
+    mock.calculate_final_price = MagicMock(side_effect=_python_calculate_final_price)
     return mock
 
 
@@ -215,6 +247,7 @@ def mock_httpx_client():
         return mock_response
     
     mock_client.post = mock_post
+    mock_client.aclose = AsyncMock(return_value=None)
     mock_client.__aenter__ = AsyncMock(return_value=mock_client)
     mock_client.__aexit__ = AsyncMock(return_value=None)
     return mock_client
@@ -224,13 +257,23 @@ def mock_dependencies(monkeypatch, mock_redis, mock_saleor_api, mock_rust_module
     """Auto-mock external dependencies for all tests"""
     # Mock Redis
     monkeypatch.setattr("app.services.markup_service.markup_service.redis", mock_redis)
+    # Channel registry snapshot must not outlive a single test
+    monkeypatch.setattr("app.services.channel_registry.channel_registry._snapshot", None)
+    monkeypatch.setattr("app.services.channel_registry.channel_registry.last_error", None)
+    # Markup L1 cache must not outlive a single test
+    monkeypatch.setattr(
+        "app.services.markup_service.markup_service._local",
+        TTLCache(maxsize=settings.MARKUP_L1_MAX_SIZE, ttl=settings.MARKUP_L1_TTL)
+    )
     
     # Mock HTTPX client at the lowest level - return a class that produces our mock
     def mock_client_class(**kwargs):
         return mock_httpx_client
     
-    monkeypatch.setattr("app.saleor.api.httpx.AsyncClient", mock_client_class)
+    monkeypatch.setattr("app.saleor.client.httpx.AsyncClient", mock_client_class)
     monkeypatch.setattr("httpx.AsyncClient", mock_client_class)
+    # Shared Saleor pool must be rebuilt from the mocked class in every test
+    monkeypatch.setattr("app.saleor.client.saleor_client._client", None)
     
     # Setup return values for Saleor API mocks (fallback)
     mock_saleor_api.list_channels.return_value = sample_channels
@@ -250,6 +293,8 @@ def mock_dependencies(monkeypatch, mock_redis, mock_saleor_api, mock_rust_module
         return sample_channels
     
     monkeypatch.setattr("app.api.channels.get_real_channels_or_fallback", mock_get_real_channels_or_fallback)
+    # The channel registry loads through fetch_saleor_channels - serve the same test data
+    monkeypatch.setattr("app.api.channels.fetch_saleor_channels", mock_get_real_channels_or_fallback)
     
     # Also mock the client initialization to prevent real API calls
     monkeypatch.setattr("app.saleor.client.init_saleor_client", AsyncMock())
@@ -258,6 +303,19 @@ def mock_dependencies(monkeypatch, mock_redis, mock_saleor_api, mock_rust_module
     monkeypatch.setattr("app.services.price_calculator.price_calculator", mock_rust_module)
 
 
+@pytest.fixture
+def variant_metadata(monkeypatch):
+    """Serve the fresh variant metadata read of price write-back from the given products"""
+    def serve(*products):
+        variants = {variant["id"]: variant for product in products for variant in product["variants"]}
+
+        async def read(variant_ids):
+            return {variant_id: variants.get(variant_id) for variant_id in variant_ids}
+
+        monkeypatch.setattr("app.services.price_writeback.get_variants_metadata", read)
+    return serve
+
+
 @pytest.fixture
 def event_loop():
     """Create an instance of the default event loop for the test session."""